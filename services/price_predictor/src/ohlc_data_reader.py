@@ -195,6 +195,9 @@ class OhlcDataReader:
         features = features[features['product_id'] == product_id]
         features = features[features['timestamp_ms'] >= from_timestamp_ms]
         features = features[features['timestamp_ms'] <= to_timestamp_ms]
+        # the feature group can hold the rolled up candles of coarser windows too
+        if 'resolution_seconds' in features:
+            features = features[features['resolution_seconds'] == self.ohlc_window_sec]
         # sort the features by timestamp (ascending)
         features = features.sort_values(by='timestamp_ms').reset_index(drop=True)
         
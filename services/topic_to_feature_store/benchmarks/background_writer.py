@@ -0,0 +1,131 @@
+"""
+Compares two ways of pushing the candles to the feature store, with a fake consumer
+and a fake feature store (no Kafka, no Hopsworks):
+
+- sync: consume a batch, push it, and only then consume the next one, like before
+- background: `BackgroundWriter` pushes a batch while the next one fills up
+
+Consuming a batch costs fetching it (a sleep) and decoding its messages with
+`decode`, and an insert is a sleep, like the network round trips of Hopsworks. So
+the sync loop takes the sum of both, and the background writer the slower of the
+two.
+
+It also checks that the offsets come back in order, only once their insert
+succeeded, and that none comes back after an insert that failed.
+
+Usage:
+    poetry run python benchmarks/background_writer.py [n_batches] [insert_sec]
+"""
+import sys
+import time
+from contextlib import suppress
+from typing import List, Tuple
+
+import orjson
+from loguru import logger
+
+from src.background_writer import BackgroundWriter, Offsets
+from src.wire_format import decode
+
+BATCH_SIZE = 40_000
+FETCH_SEC = 0.2
+
+
+def make_messages() -> List[bytes]:
+    return [
+        orjson.dumps({
+            'product_id': 'ETH/USD',
+            'timestamp_ms': 1_718_000_000_000 + i * 60_000,
+            'open': 3500.0, 'high': 3510.0, 'low': 3490.0, 'close': 3505.0,
+            'volume': 12.5,
+        })
+        for i in range(BATCH_SIZE)
+    ]
+
+
+def consume_batch(messages: List[bytes], i: int) -> Tuple[List[dict], Offsets]:
+    """
+    The batch `i`, with the offsets to commit after it, from partition 0.
+    """
+    time.sleep(FETCH_SEC)
+    return [decode(message) for message in messages], {('ohlcv', 0): (i + 1) * BATCH_SIZE}
+
+
+def run_sync(messages: List[bytes], n_batches: int, insert_sec: float) -> List[Offsets]:
+    committed = []
+    for i in range(n_batches):
+        batch, offsets = consume_batch(messages, i)
+        time.sleep(insert_sec)
+        committed.append(offsets)
+    return committed
+
+
+def run_background(
+    messages: List[bytes], n_batches: int, insert_sec: float, fail_at: int = -1
+) -> List[Offsets]:
+    inserted = []
+
+    def write(batch: List[dict]) -> None:
+        time.sleep(insert_sec)
+        if len(inserted) == fail_at:
+            raise ConnectionError('The feature store is down')
+        inserted.append(batch)
+
+    writer = BackgroundWriter(write=write, max_in_flight=1)
+    committed = []
+    try:
+        for i in range(n_batches):
+            done = writer.done_offsets()
+            if done:
+                committed.append(done)
+            batch, offsets = consume_batch(messages, i)
+            writer.submit(batch, offsets)
+        writer.close()
+        committed.append(writer.done_offsets())
+    except RuntimeError:
+        assert fail_at >= 0, 'An insert failed'
+        # the offsets of the batches before the failed one we did not get yet,
+        # or the error again
+        with suppress(RuntimeError):
+            committed.append(writer.done_offsets())
+    return [offsets for offsets in committed if offsets]
+
+
+if __name__ == '__main__':
+
+    n_batches = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    insert_sec = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    messages = make_messages()
+
+    start = time.perf_counter()
+    consume_batch(messages, 0)
+    consume_sec = time.perf_counter() - start
+    print(
+        f'{n_batches} batches of {BATCH_SIZE:,} candles, '
+        f'{consume_sec:.2f}s to consume one, {insert_sec:.2f}s to insert one'
+    )
+
+    start = time.perf_counter()
+    run_sync(messages, n_batches, insert_sec)
+    sync_sec = time.perf_counter() - start
+    print(f'        sync: {sync_sec:.2f}s, {n_batches * BATCH_SIZE / sync_sec:,.0f} rows/s')
+
+    start = time.perf_counter()
+    committed = run_background(messages, n_batches, insert_sec)
+    background_sec = time.perf_counter() - start
+    print(
+        f'  background: {background_sec:.2f}s, {n_batches * BATCH_SIZE / background_sec:,.0f} rows/s, '
+        f'{sync_sec / background_sec:.1f}x faster '
+        f'(bound: {n_batches * max(consume_sec, insert_sec) + min(consume_sec, insert_sec):.2f}s)'
+    )
+
+    last_offsets = [offsets[('ohlcv', 0)] for offsets in committed]
+    assert last_offsets == sorted(last_offsets), 'Offsets out of order'
+    assert last_offsets[-1] == n_batches * BATCH_SIZE, 'Offsets of some batches are missing'
+
+    # the 4th insert fails: the offsets stop at the end of the 3rd batch
+    logger.disable('src.background_writer')
+    committed = run_background(messages, n_batches, insert_sec, fail_at=3)
+    assert max(offsets[('ohlcv', 0)] for offsets in committed) == 3 * BATCH_SIZE, \
+        'Offsets committed after a failed insert'
+    print('Offsets committed in order, and only after their insert succeeded')
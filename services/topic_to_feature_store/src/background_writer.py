@@ -0,0 +1,133 @@
+"""
+Pushes the batches to the feature store from a background thread, so we go on
+consuming (and decoding) the next batch while the previous one uploads, and the
+throughput of the sink is the one of the slower of the two, not of both in a row.
+
+- at most `max_in_flight` batches are waiting or uploading. `submit` blocks when
+  there are more, so a slow feature store slows the consumer down, instead of
+  piling the batches up in memory
+- the batches go out one at a time, in the order we submitted them
+- the offsets of a batch come back from `done_offsets` once its insert succeeded,
+  in the same order, and the main thread commits them (the Kafka consumer is
+  not thread safe)
+- if an insert fails, the writer stops, and the main thread gets the error on its
+  next call. The offsets of that batch and of the next ones are not committed, so
+  they are consumed again after a restart (the feature group upserts by primary key)
+"""
+import queue
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+# the offset of the next message to read, per (topic, partition)
+Offsets = Dict[Tuple[str, int], int]
+
+
+class BackgroundWriter:
+    """
+    Writes the batches from a background thread, see the module docstring.
+    """
+
+    def __init__(self, write: Callable[[List[dict]], None], max_in_flight: int = 1) -> None:
+        """
+        Args:
+            write (Callable[[List[dict]], None]): Pushes a batch to the feature store.
+            max_in_flight (int): The max number of batches waiting or uploading. With
+                1, one batch uploads while the next one fills up.
+
+        Returns:
+            None
+        """
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+
+        self._write = write
+        self._in_flight = threading.Semaphore(max_in_flight)
+        self._batches: "queue.Queue[Optional[Tuple[List[dict], Offsets]]]" = queue.Queue()
+        self._done_offsets: List[Offsets] = []
+        self._lock = threading.Lock()
+        self._error: Optional[BaseException] = None
+
+        self._thread = threading.Thread(target=self._run, name="feature-store-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, batch: List[dict], offsets: Offsets) -> None:
+        """
+        Queues a batch, and waits while there are `max_in_flight` batches in flight.
+
+        Args:
+            batch (List[dict]): The rows to push to the feature store.
+            offsets (Offsets): The offsets to commit once the batch is in the
+                feature store.
+
+        Raises:
+            RuntimeError: If an insert failed.
+        """
+        self._check()
+        self._in_flight.acquire()
+        self._check()
+        self._batches.put((batch, offsets))
+
+    def done_offsets(self) -> Offsets:
+        """
+        Returns the offsets of the batches in the feature store since the last call,
+        merged in order.
+
+        Raises:
+            RuntimeError: If an insert failed.
+        """
+        with self._lock:
+            done, self._done_offsets = self._done_offsets, []
+        offsets: Offsets = {}
+        for batch_offsets in done:
+            offsets.update(batch_offsets)
+        if not offsets:
+            self._check()
+        return offsets
+
+    def flush(self) -> None:
+        """
+        Waits until the batches in flight are in the feature store. Their offsets
+        are then in `done_offsets`.
+
+        Raises:
+            RuntimeError: If an insert failed.
+        """
+        self._batches.join()
+        self._check()
+
+    def close(self) -> None:
+        """
+        Writes the batches in flight, and stops the thread.
+        """
+        self.flush()
+        self._batches.put(None)
+        self._thread.join()
+
+    def _check(self) -> None:
+        if self._error is not None:
+            raise RuntimeError("Pushing a batch to the feature store failed") from self._error
+
+    def _run(self) -> None:
+        while True:
+            item = self._batches.get()
+            try:
+                if item is None:
+                    return
+                if self._error is not None:
+                    # the batches after a failed one are not written
+                    continue
+                batch, offsets = item
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    logger.exception("Pushing a batch to the feature store failed")
+                    self._error = e
+                    continue
+                with self._lock:
+                    self._done_offsets.append(offsets)
+            finally:
+                if item is not None:
+                    self._in_flight.release()
+                self._batches.task_done()
@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from pydantic_settings import BaseSettings
 
 class AppConfig(BaseSettings):
@@ -9,9 +9,15 @@ class AppConfig(BaseSettings):
     feature_group_name: str
     feature_group_version: int
     feature_group_primary_keys: List[str]
+    # values of the columns some messages do not have, like the resolution_seconds
+    # of the candles of a trade_to_ohlc service without rollups
+    feature_group_defaults: Dict[str, Any] = {}
     feature_group_event_time: str
     start_offline_materialization: bool
     batch_size: Optional[int] = 1
+    # batches waiting or uploading to the feature store while we consume the next
+    # one, see src/background_writer.py
+    max_in_flight_batches: int = 1
     
     # One way:
     class Config:
@@ -1,4 +1,4 @@
-from typing import List
+from typing import Any, Dict, List, Optional
 import hopsworks
 from src.config import hopsworks_config as config
 import pandas as pd
@@ -18,6 +18,7 @@ def push_value_to_feature_group(
     feature_group_primary_keys: List[str],
     feature_group_event_time: str,
     start_offline_materialization: bool,
+    feature_group_defaults: Optional[Dict[str, Any]] = None,
 ):
     """
     Pushes the given value to the given feature group in the feature store
@@ -30,6 +31,8 @@ def push_value_to_feature_group(
         feature_group_event_time (str): The event time of the feature group
         start_offline_materialization (bool): Whether to start offline materialization or not
           when we save the data to the feature store
+        feature_group_defaults (Optional[Dict[str, Any]]): The values of the columns
+          the messages do not have
 
     Returns:
         None
@@ -48,6 +51,19 @@ def push_value_to_feature_group(
     # Transform the value dict into a pandas 
     value_df = pd.DataFrame(value)
 
+    # The candles of a service without rollups do not have a resolution_seconds,
+    # which is part of the primary key, so that candles of different resolutions
+    # of the same window do not overwrite each other
+    for column, default in (feature_group_defaults or {}).items():
+        if column not in value_df:
+            value_df[column] = default
+        else:
+            value_df[column] = value_df[column].fillna(default).astype(type(default))
+
+    # The feature group upserts by primary key, but a batch can have several versions
+    # of the same row (like the partial candles of an open window). Keep the last one
+    value_df = value_df.drop_duplicates(subset=feature_group_primary_keys, keep='last')
+
     # breakpoint()
 
     feature_group.insert(
@@ -1,9 +1,11 @@
-from typing import List
+from typing import Any, Dict, List, Optional
 from quixstreams import Application
+from confluent_kafka import TopicPartition
 
 from loguru import logger
-import json
+from src.background_writer import BackgroundWriter, Offsets
 from src.hopsworks_api import push_value_to_feature_group
+from src.wire_format import decode
 
 def topic_to_feature_store(
     kafka_broker_address: str,
@@ -15,6 +17,8 @@ def topic_to_feature_store(
     feature_group_event_time: str,
     start_offline_materialization: bool,
     batch_size: int,
+    max_in_flight_batches: int = 1,
+    feature_group_defaults: Optional[Dict[str, Any]] = None,
 ):
     """
     Reads incoming messages from the given `kafka_input_topic`, and pushes them to the given
@@ -30,6 +34,11 @@ def topic_to_feature_store(
         feature_group_event_time (str): The event time of the feature group
         start_offline_materialization (bool): Whether to start offline materialization or not
         batch_size (int): The number of messages to batch (in memory) before pushing to the feature store
+        max_in_flight_batches (int): The max number of batches waiting or uploading to the
+            feature store while we consume the next one (see `src.background_writer`)
+        feature_group_defaults (Optional[Dict[str, Any]]): The values of the columns
+            some messages do not have, e.g. the primary key `resolution_seconds`
+            of the candles of a trade_to_ohlc service without rollups
     Returns:
         None
     """
@@ -42,16 +51,56 @@ def topic_to_feature_store(
         #auto_offset_reset='earliest', # by default it is 'latest'
     )
     
-    batch = []
+    # The batches go to the feature store from a background thread, while we
+    # consume the next one
+    writer = BackgroundWriter(
+        write=lambda batch: push_value_to_feature_group(
+            batch,
+            feature_group_name,
+            feature_group_version,
+            feature_group_primary_keys,
+            feature_group_event_time,
+            start_offline_materialization,
+            feature_group_defaults,
+        ),
+        max_in_flight=max_in_flight_batches,
+    )
 
-    # Create a consumer and start a polling loop
-    with app.get_consumer() as consumer:
+    batch = []
+    # the offset of the next message to read, per partition of the messages in `batch`
+    batch_offsets: Offsets = {}
+
+    def commit_done_offsets(consumer) -> None:
+        # the offsets of the batches that are in the feature store, in order
+        offsets = writer.done_offsets()
+        if not offsets:
+            return
+        # not the partitions another consumer of the group took over
+        assigned = {(partition.topic, partition.partition) for partition in consumer.assignment()}
+        offsets = [
+            TopicPartition(topic, partition, offset)
+            for (topic, partition), offset in offsets.items()
+            if (topic, partition) in assigned
+        ]
+        if offsets:
+            consumer.commit(offsets=offsets, asynchronous=False)
+
+    def on_revoke(consumer, partitions):
+        # commit what is in the feature store before we give the partitions up
+        writer.flush()
+        commit_done_offsets(consumer)
+
+    # Create a consumer and start a polling loop. We commit the offsets ourselves,
+    # once their batch is in the feature store
+    with app.get_consumer(auto_commit_enable=False) as consumer:
 
         # Subscribe to the input topic
-        consumer.subscribe(topics = [kafka_input_topic])
+        consumer.subscribe(topics = [kafka_input_topic], on_revoke=on_revoke)
 
         # Poll for new messages
         while True:
+            commit_done_offsets(consumer)
+
             msg = consumer.poll(timeout=0.1)
 
             if msg is None:
@@ -61,11 +110,12 @@ def topic_to_feature_store(
                 continue
 
             value = msg.value()
-            # Decode the message bytes into a dictionary
-            value = json.loads(value.decode('utf-8'))
+            # Decode the message bytes (JSON or binary) into a dictionary
+            value = decode(value)
 
             # Append the message to the batch
             batch.append(value)
+            batch_offsets[(msg.topic(), msg.partition())] = msg.offset() + 1
 
             # If the batch is not full, continue
             if len(batch) < batch_size:
@@ -73,20 +123,13 @@ def topic_to_feature_store(
                 continue
 
             logger.debug(f'Batch has size {len(batch)} >= {batch_size:,}... Pushing data to the feature store')
-            # We need to push the value to the feature store
-            push_value_to_feature_group(
-                batch,
-                feature_group_name,
-                feature_group_version,
-                feature_group_primary_keys,
-                feature_group_event_time,
-                start_offline_materialization,
-            )
-
-            # Clear the batch
-            batch = []
+            # We need to push the value to the feature store. This waits only if
+            # there are already max_in_flight_batches batches in flight
+            writer.submit(batch, batch_offsets)
 
-            consumer.store_offsets(message=msg)
+            # Start the next batch
+            batch = []
+            batch_offsets = {}
 
 
 if __name__ == "__main__":
@@ -103,4 +146,6 @@ if __name__ == "__main__":
         feature_group_event_time = config.feature_group_event_time,
         start_offline_materialization = config.start_offline_materialization,
         batch_size = config.batch_size,
+        max_in_flight_batches = config.max_in_flight_batches,
+        feature_group_defaults = config.feature_group_defaults,
     )
\ No newline at end of file
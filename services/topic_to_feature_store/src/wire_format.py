@@ -0,0 +1,195 @@
+"""
+Compact binary encoding for the messages of the `trade` and `ohlcv` topics.
+
+This module is the same in every service that reads or writes those topics
+(trade_producer, trade_to_ohlc and topic_to_feature_store). Keep the copies in sync.
+
+Every binary message starts with a 2-byte header:
+- the schema id: b'T' for trades, b'O' for OHLCV candles
+- the version of the layout: 2 for trades, 1 for OHLCV candles
+
+followed by a fixed layout of little-endian fields
+
+    trade v2: timestamp_ms (int64), price (float64), quantity (float64),
+              trade_id (int64, -1 if the trade has none)
+    ohlcv v1: timestamp_ms (int64), open, high, low, close, volume (float64)
+
+then the product id (uint8 length + utf-8 bytes), and, optionally, the fields
+that are not part of the fixed layout as a JSON object, until the end of the message.
+
+Decoders still accept trade v1 (no trade_id in the layout, so it was in the JSON
+tail), for the messages written before v2.
+
+JSON messages start with b'{', which is never a schema id, so decoders accept both
+encodings, and topics can move from JSON to binary without a flag day.
+"""
+import struct
+from typing import Any, List, Optional
+
+import orjson
+from quixstreams.models.serializers import (
+    Deserializer,
+    SerializationContext,
+    Serializer,
+)
+
+TRADE_SCHEMA = b'T'
+OHLCV_SCHEMA = b'O'
+
+# the version we encode each schema with
+VERSIONS = {TRADE_SCHEMA: 2, OHLCV_SCHEMA: 1}
+
+TRADE_FIELDS = ('timestamp_ms', 'price', 'quantity', 'trade_id')
+OHLCV_FIELDS = ('timestamp_ms', 'open', 'high', 'low', 'close', 'volume')
+
+# the trade_id of the layout for the trades that have none
+NO_TRADE_ID = -1
+
+_HEADER = struct.Struct('<cB')
+_TRADE_V1 = struct.Struct('<qdd')
+_TRADE = struct.Struct('<qddq')
+_OHLCV = struct.Struct('<qddddd')
+_LAYOUTS = {
+    (TRADE_SCHEMA, 1): (_TRADE_V1, TRADE_FIELDS[:3]),
+    (TRADE_SCHEMA, 2): (_TRADE, TRADE_FIELDS),
+    (OHLCV_SCHEMA, 1): (_OHLCV, OHLCV_FIELDS),
+}
+
+# value formats we can pick for a topic in the config
+VALUE_FORMATS = ('json', 'binary')
+
+
+def encode(schema: bytes, value: dict) -> bytes:
+    """
+    Encodes a trade or OHLCV dictionary into the binary format.
+
+    Args:
+        schema (bytes): TRADE_SCHEMA or OHLCV_SCHEMA.
+        value (dict): The message, with at least 'product_id' and the fields
+            of the fixed layout of the schema. Trades may have no 'trade_id'.
+
+    Returns:
+        bytes: The encoded message.
+    """
+    version = VERSIONS[schema]
+    layout, fields = _LAYOUTS[schema, version]
+    product_id = value['product_id'].encode()
+    extra = {
+        key: field for key, field in value.items()
+        if key != 'product_id' and key not in fields
+    }
+    if schema == TRADE_SCHEMA and value.get('trade_id') is None:
+        value = {**value, 'trade_id': NO_TRADE_ID}
+    return b''.join((
+        _HEADER.pack(schema, version),
+        layout.pack(*(value[field] for field in fields)),
+        bytes((len(product_id),)),
+        product_id,
+        orjson.dumps(extra) if extra else b'',
+    ))
+
+
+def decode(data: bytes) -> dict:
+    """
+    Decodes a binary or JSON message into a dictionary.
+
+    Args:
+        data (bytes): The message value from Kafka.
+
+    Returns:
+        dict: The decoded message.
+
+    Raises:
+        ValueError: If the message has an unknown schema id or version.
+    """
+    if data[:1] == b'{':
+        return orjson.loads(data)
+
+    schema, version = _HEADER.unpack_from(data)
+    if (schema, version) not in _LAYOUTS:
+        raise ValueError(f'Unknown message schema {schema!r} version {version}')
+
+    layout, fields = _LAYOUTS[schema, version]
+    value = dict(zip(fields, layout.unpack_from(data, _HEADER.size)))
+    if value.get('trade_id') == NO_TRADE_ID:
+        del value['trade_id']
+
+    offset = _HEADER.size + layout.size
+    product_id_length = data[offset]
+    offset += 1
+    value['product_id'] = data[offset:offset + product_id_length].decode()
+    offset += product_id_length
+
+    if offset < len(data):
+        value.update(orjson.loads(data[offset:]))
+
+    return value
+
+
+def encode_trade(value: dict) -> bytes:
+    return encode(TRADE_SCHEMA, value)
+
+
+def encode_ohlcv(value: dict) -> bytes:
+    return encode(OHLCV_SCHEMA, value)
+
+
+def encode_trades(
+    product_ids: List[str],
+    product_codes: List[int],
+    timestamp_ms: List[int],
+    price: List[float],
+    quantity: List[float],
+    trade_id: Optional[List[int]] = None,
+) -> List[bytes]:
+    """
+    Encodes many trades (given column by column) in one go. The header and the
+    product id are only encoded once per product.
+
+    A negative `trade_id` (or no `trade_id` at all) means the trade has none.
+    """
+    header = _HEADER.pack(TRADE_SCHEMA, VERSIONS[TRADE_SCHEMA])
+    tails = [
+        bytes((len(encoded),)) + encoded
+        for encoded in (product_id.encode() for product_id in product_ids)
+    ]
+    if trade_id is None:
+        trade_id = [NO_TRADE_ID] * len(product_codes)
+    pack = _TRADE.pack
+    return [
+        header + pack(ts, p, q, id_ if id_ >= 0 else NO_TRADE_ID) + tails[code]
+        for code, ts, p, q, id_ in zip(product_codes, timestamp_ms, price, quantity, trade_id)
+    ]
+
+
+class BinarySerializer(Serializer):
+    """
+    quixstreams serializer for the binary format of the given schema.
+    """
+    def __init__(self, schema: bytes):
+        super().__init__()
+        self.schema = schema
+
+    def __call__(self, value: dict, ctx: SerializationContext) -> bytes:
+        return encode(self.schema, value)
+
+
+class BinaryDeserializer(Deserializer):
+    """
+    quixstreams deserializer for the messages of the `trade` and `ohlcv` topics.
+    It decodes both binary and JSON messages, so consumers do not need to know
+    which format the producer picked.
+    """
+    def __call__(self, value: bytes, ctx: SerializationContext) -> Any:
+        return decode(value)
+
+
+def get_value_serializer(value_format: str, schema: bytes) -> Any:
+    """
+    Returns the quixstreams value serializer for the given `value_format`.
+    """
+    if value_format == 'json':
+        return 'json'
+    if value_format == 'binary':
+        return BinarySerializer(schema)
+    raise ValueError(f'Invalid value format {value_format}, expected one of {VALUE_FORMATS}')
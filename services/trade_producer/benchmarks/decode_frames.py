@@ -0,0 +1,89 @@
+"""
+Microbenchmark of the websocket frame decoding, in frames/s and trades/s:
+- old: json.loads, one pydantic Trade per trade, datetime.fromisoformat
+- strict: the opt-in `strict_validation` mode, pydantic Trade + TradeBatch
+- fast: orjson + `parse_iso8601_ms` straight into a TradeBatch
+
+The corpus is a file with one raw websocket frame per line, as captured from
+wss://ws.kraken.com/v2. Without one, we synthesize frames with the same shape.
+
+Usage:
+    poetry run python benchmarks/decode_frames.py [corpus.jsonl]
+"""
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+import orjson
+
+from src.trade_data_source import Trade, TradeBatch
+from src.trade_data_source.fast_decode import trade_batch_from_message
+from src.trade_data_source.kraken_websocket_api import KrakenWebsocketAPI
+
+
+def synthesize_frames(n_frames: int = 20_000) -> List[bytes]:
+    rng = random.Random(0)
+    now = datetime(2024, 6, 17, 9, 0, tzinfo=timezone.utc)
+    frames = []
+    for _ in range(n_frames):
+        data = []
+        for _ in range(rng.choice([1, 1, 1, 2, 3, 8])):
+            now += timedelta(microseconds=rng.randrange(1, 2_000_000))
+            data.append({
+                'symbol': rng.choice(['ETH/USD', 'BTC/USD', 'SOL/USD']),
+                'side': rng.choice(['buy', 'sell']),
+                'price': round(3500 + rng.gauss(0, 5), 2),
+                'qty': round(rng.random(), 8),
+                'ord_type': 'market',
+                'trade_id': rng.randrange(10**8),
+                'timestamp': now.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+            })
+        frames.append(json.dumps({'channel': 'trade', 'type': 'update', 'data': data}).encode())
+    return frames
+
+
+def decode_old(frame: bytes) -> List[Trade]:
+    message = json.loads(frame)
+    return [
+        Trade(
+            product_id=trade['symbol'],
+            price=trade['price'],
+            quantity=trade['qty'],
+            timestamp_ms=int(
+                datetime.fromisoformat(trade['timestamp'][:-1])
+                .replace(tzinfo=timezone.utc)
+                .timestamp() * 1000
+            ),
+        )
+        for trade in message['data']
+    ]
+
+
+def decode_strict(frame: bytes) -> TradeBatch:
+    return TradeBatch.from_trades(KrakenWebsocketAPI.parse_trades(orjson.loads(frame)))
+
+
+def decode_fast(frame: bytes) -> TradeBatch:
+    return trade_batch_from_message(orjson.loads(frame))
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'rb') as f:
+            frames = [line.strip() for line in f if b'"channel":"trade"' in line.replace(b' ', b'')]
+    else:
+        frames = synthesize_frames()
+
+    n_trades = sum(len(decode_fast(frame)) for frame in frames)
+    print(f'{len(frames):,} frames, {n_trades:,} trades')
+
+    for name, decode in [('old', decode_old), ('strict', decode_strict), ('fast', decode_fast)]:
+        start = time.perf_counter()
+        for frame in frames:
+            decode(frame)
+        elapsed = time.perf_counter() - start
+        print(f'  {name:>6}: {len(frames) / elapsed:,.0f} frames/s, {n_trades / elapsed:,.0f} trades/s')
@@ -0,0 +1,116 @@
+"""
+Compares the throughput of the two produce paths of `produce_trades` against a
+local stand-in for the Kafka broker:
+- per trade: one pydantic `Trade`, `model_dump()`, JSON serialization and one
+  f-string log line per trade
+- bulk: `TradeBatch` with pre-encoded keys and orjson payloads
+
+The stand-in producer buffers the messages and fires the delivery callbacks on
+`poll`/`flush`, like librdkafka does, so the delivery accounting is measured too.
+
+Usage:
+    poetry run python benchmarks/produce_throughput.py [n_trades]
+"""
+import json
+import sys
+import time
+from typing import List
+
+import numpy as np
+from loguru import logger
+
+from src.kafka_producer import DeliveryReport, produce_batch
+from src.trade_data_source import Trade, TradeBatch
+
+
+class FakeMessage:
+    def __init__(self, value: bytes) -> None:
+        self._value = value
+
+    def value(self) -> bytes:
+        return self._value
+
+
+class FakeProducer:
+    """
+    Stands in for the Kafka producer: it keeps the produced messages in a buffer
+    and acknowledges them when polled, every `poll_every` messages.
+    """
+    def __init__(self, poll_every: int = 10_000) -> None:
+        self.poll_every = poll_every
+        self._pending = []
+
+    def produce(self, topic: str, value: bytes, key: bytes, on_delivery=None) -> None:
+        self._pending.append((value, on_delivery))
+        if len(self._pending) >= self.poll_every:
+            self.poll()
+
+    def poll(self, timeout: float = 0) -> None:
+        for value, on_delivery in self._pending:
+            if on_delivery is not None:
+                on_delivery(None, FakeMessage(value))
+        self._pending = []
+
+    def flush(self) -> None:
+        self.poll()
+
+
+def make_batches(n_trades: int, batch_size: int = 1000) -> List[TradeBatch]:
+    rng = np.random.default_rng(0)
+    batches = []
+    for start in range(0, n_trades, batch_size):
+        n = min(batch_size, n_trades - start)
+        batches.append(TradeBatch.from_columns(
+            product_id='ETH/USD',
+            price=3500 + rng.normal(0, 5, n).cumsum(),
+            quantity=rng.random(n),
+            timestamp_ms=1_718_000_000_000 + np.arange(start, start + n) * 100,
+        ))
+    return batches
+
+
+def produce_per_trade(producer: FakeProducer, batches: List[List[Trade]]) -> int:
+    delivery_report = DeliveryReport()
+    n_bytes = 0
+    for trades in batches:
+        for trade in trades:
+            key = trade.product_id.encode()
+            value = json.dumps(trade.model_dump()).encode()
+            producer.produce(topic='trade', value=value, key=key, on_delivery=delivery_report)
+            logger.debug(f'Pushed trade to Kafka: {trade}')
+            n_bytes += len(key) + len(value)
+    producer.flush()
+    return n_bytes
+
+
+def produce_bulk(producer: FakeProducer, batches: List[TradeBatch]) -> int:
+    delivery_report = DeliveryReport()
+    n_bytes = 0
+    for trades in batches:
+        n_bytes += produce_batch(producer, 'trade', trades, on_delivery=delivery_report)
+    producer.flush()
+    return n_bytes
+
+
+if __name__ == '__main__':
+
+    # log lines are formatted but not written anywhere, like in production with
+    # the log level set above DEBUG
+    logger.remove()
+
+    n_trades = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    batches = make_batches(n_trades)
+    trade_lists = [batch.to_trades() for batch in batches]
+
+    print(f'Producing {n_trades:,} trades to a local broker stand-in')
+    for name, produce, data in [
+        ('per trade', produce_per_trade, trade_lists),
+        ('bulk', produce_bulk, batches),
+    ]:
+        start = time.perf_counter()
+        n_bytes = produce(FakeProducer(), data)
+        elapsed = time.perf_counter() - start
+        print(
+            f'  {name:>9}: {n_trades / elapsed:,.0f} msgs/s, '
+            f'{n_bytes / elapsed / 1e6:,.1f} MB/s'
+        )
@@ -0,0 +1,110 @@
+"""
+Compares the sustained request rate we get from the Kraken REST API with
+- the old strategy: sleep 1 second after every request, and 30 seconds after
+  'EGeneral:Too many requests', and
+- the adaptive `RateLimiter`.
+
+Everything runs against a simulated Kraken call counter driven by a fake clock, so
+the benchmark is deterministic and takes no wall time.
+
+Usage:
+    poetry run python benchmarks/rate_limiter.py
+"""
+import random
+
+from loguru import logger
+
+from src.trade_data_source.rate_limiter import RateLimiter
+
+
+class FakeClock:
+    """
+    A clock that only moves forward when someone sleeps on it.
+    """
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += max(0.0, seconds)
+
+
+class FakeKraken:
+    """
+    Simulates Kraken's call counter: +1 per request, decaying at `decay_per_sec`,
+    and an error when the counter goes above `max_counter`.
+    """
+    def __init__(self, clock: FakeClock, max_counter: float, decay_per_sec: float) -> None:
+        self.clock = clock
+        self.max_counter = max_counter
+        self.decay_per_sec = decay_per_sec
+        self.counter = 0.0
+        self.last_update = clock.time()
+
+    def request(self, latency_sec: float) -> bool:
+        """
+        Returns True if the request went through, False if we got throttled.
+        """
+        now = self.clock.time()
+        self.counter = max(0.0, self.counter - (now - self.last_update) * self.decay_per_sec)
+        self.last_update = now
+        self.clock.sleep(latency_sec)
+
+        if self.counter + 1 > self.max_counter:
+            return False
+        self.counter += 1
+        return True
+
+
+def run_fixed_sleeps(n_requests: int, server_decay_per_sec: float, latency_sec: float):
+    clock = FakeClock()
+    kraken = FakeKraken(clock, max_counter=15, decay_per_sec=server_decay_per_sec)
+    ok, errors = 0, 0
+    while ok < n_requests:
+        if kraken.request(latency_sec):
+            ok += 1
+            clock.sleep(1)
+        else:
+            errors += 1
+            clock.sleep(30)
+    return ok / clock.time(), errors
+
+
+def run_rate_limiter(n_requests: int, server_decay_per_sec: float, latency_sec: float):
+    clock = FakeClock()
+    kraken = FakeKraken(clock, max_counter=15, decay_per_sec=server_decay_per_sec)
+    limiter = RateLimiter(
+        max_counter=15,
+        decay_per_sec=1.0,
+        clock=clock.time,
+        sleep=clock.sleep,
+        rng=random.Random(42).random,
+    )
+    ok, errors = 0, 0
+    while ok < n_requests:
+        limiter.acquire()
+        if kraken.request(latency_sec):
+            ok += 1
+            limiter.on_success()
+        else:
+            errors += 1
+            limiter.on_error()
+    return ok / clock.time(), errors
+
+
+if __name__ == '__main__':
+
+    logger.remove()
+
+    n_requests = 2_000
+    latency_sec = 0.25
+
+    # 1.0 -> Kraken decays the counter as fast as the limiter assumes
+    # 0.8 -> Kraken is stricter than we think, so the limiter has to adapt
+    for server_decay_per_sec in [1.0, 0.8]:
+        print(f'Kraken counter decay: {server_decay_per_sec}/s, request latency: {latency_sec}s')
+        for name, run in [('fixed sleeps', run_fixed_sleeps), ('RateLimiter', run_rate_limiter)]:
+            requests_per_sec, errors = run(n_requests, server_decay_per_sec, latency_sec)
+            print(f'  {name:>12}: {requests_per_sec:.3f} requests/sec sustained, {errors} throttled requests')
@@ -0,0 +1,121 @@
+"""
+Measures the per-page latency of the Kraken REST API client against a local stub
+server that answers every request with the same 1,000-trade page.
+
+- before: a new connection per request with `requests.request`, and
+  `json.loads(response.text)`
+- after: the pooled keep-alive session of `KrakenRestAPI`, and
+  `orjson.loads(response.content)`
+
+Usage:
+    poetry run python benchmarks/rest_api_latency.py [n_pages]
+"""
+import gzip
+import json
+import random
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List
+
+import orjson
+import requests
+
+from src.trade_data_source.kraken_rest_api import KrakenRestAPI
+
+
+def make_page(product_id: str = 'ETH/USD', n_trades: int = 1000) -> bytes:
+    """
+    Returns a JSON page that looks like the response of the Kraken Trades endpoint
+    """
+    rng = random.Random(0)
+    ts = 1_718_000_000.0
+    trades = []
+    for i in range(n_trades):
+        ts += rng.random()
+        trades.append([
+            f'{3500 + rng.gauss(0, 5):.2f}',
+            f'{rng.random():.8f}',
+            round(ts, 4),
+            rng.choice('bs'),
+            rng.choice('ml'),
+            '',
+            70_000_000 + i,
+        ])
+    body = {'error': [], 'result': {product_id: trades, 'last': str(int(ts * 1e9))}}
+    return json.dumps(body).encode()
+
+
+PAGE = make_page()
+PAGE_GZIP = gzip.compress(PAGE)
+
+
+class StubKrakenHandler(BaseHTTPRequestHandler):
+    # keep-alive needs HTTP/1.1
+    protocol_version = 'HTTP/1.1'
+    # the headers and the body go out in two writes, and on a reused connection
+    # Nagle holds the body back until the client's delayed ACK of the headers
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        body = PAGE
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = PAGE_GZIP
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def fetch_before(url: str) -> dict:
+    response = requests.request('GET', url, headers={'Accept': 'application/json'}, data={})
+    return json.loads(response.text)
+
+
+def make_fetch_after() -> Callable[[str], dict]:
+    session = KrakenRestAPI._create_session()
+
+    def fetch_after(url: str) -> dict:
+        response = session.get(url, timeout=KrakenRestAPI.REQUEST_TIMEOUT_SEC)
+        return orjson.loads(response.content)
+
+    return fetch_after
+
+
+def measure(fetch: Callable[[str], dict], url: str, n_pages: int) -> List[float]:
+    latencies_ms = []
+    for _ in range(n_pages):
+        start = time.perf_counter()
+        data = fetch(url)
+        latencies_ms.append((time.perf_counter() - start) * 1000)
+        assert len(data['result']['ETH/USD']) == 1000
+    return latencies_ms
+
+
+if __name__ == '__main__':
+
+    n_pages = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubKrakenHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/0/public/Trades?pair=ETH/USD&since=0'
+
+    print(f'{n_pages} pages of 1,000 trades ({len(PAGE):,} bytes, {len(PAGE_GZIP):,} gzipped)')
+    for name, fetch in [('before', fetch_before), ('after', make_fetch_after())]:
+        # warm up
+        measure(fetch, url, 10)
+        latencies_ms = measure(fetch, url, n_pages)
+        p99 = statistics.quantiles(latencies_ms, n=100)[98]
+        print(
+            f'  {name:>6}: mean={statistics.mean(latencies_ms):.2f}ms '
+            f'p50={statistics.median(latencies_ms):.2f}ms p99={p99:.2f}ms per page'
+        )
+
+    server.shutdown()
@@ -0,0 +1,138 @@
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+import orjson
+from loguru import logger
+
+from src.trade_data_source import TradeBatch
+
+
+class BackfillCheckpoint:
+    """
+    Keeps track of how far a historical backfill got, so a restarted producer resumes
+    from there instead of re-producing everything since `from_ms`.
+
+    The checkpoint is the timestamp and the Kraken trade id of the last trade we
+    produced, per product. The backfill resumes from that millisecond, which might
+    have more trades we did not produce yet, and skips the ones up to that trade id
+    (Kraken trade ids go up with time).
+    `update` records it in memory after every batch, and `commit` writes it to disk.
+    Only call `commit` after the producer is flushed and every message was delivered,
+    so the checkpoint never gets ahead of what is really in Kafka.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Loads the committed checkpoint from `path`, if there is one.
+
+        Args:
+            path (str): The JSON file where we keep the checkpoint.
+
+        Returns:
+            None
+        """
+        self.path = Path(path)
+
+        # the committed positions and trade ids, and the ones produced since the
+        # last commit
+        self.positions: Dict[str, int] = {}
+        self.trade_ids: Dict[str, int] = {}
+        if self.path.exists():
+            for product_id, position in orjson.loads(self.path.read_bytes()).items():
+                if isinstance(position, int):
+                    # checkpoints written before we kept the trade ids
+                    self.positions[product_id] = position
+                    continue
+                self.positions[product_id] = position['timestamp_ms']
+                if position.get('trade_id') is not None:
+                    self.trade_ids[product_id] = position['trade_id']
+            logger.info(
+                f'Loaded backfill checkpoint {self.positions}, trade ids {self.trade_ids} from {self.path}'
+            )
+
+        self._pending: Dict[str, int] = dict(self.positions)
+        self._pending_trade_ids: Dict[str, int] = dict(self.trade_ids)
+
+    def get(self, product_id: str) -> Optional[int]:
+        """
+        Returns the timestamp of the last trade of `product_id` we know is in Kafka.
+        """
+        return self.positions.get(product_id)
+
+    def get_trade_id(self, product_id: str) -> Optional[int]:
+        """
+        Returns the trade id of the last trade of `product_id` we know is in Kafka,
+        or None if we do not know it.
+        """
+        return self.trade_ids.get(product_id)
+
+    def update(self, trades: TradeBatch) -> None:
+        """
+        Records the last timestamp and trade id of every product in the batch as
+        produced (but not committed yet).
+        """
+        for code, product_id in enumerate(trades.product_ids):
+            in_product = trades.product_codes == code
+            timestamps = trades.timestamp_ms[in_product]
+            if len(timestamps) > 0:
+                last_ms = int(np.max(timestamps))
+                self._pending[product_id] = max(self._pending.get(product_id, last_ms), last_ms)
+
+            trade_ids = trades.trade_id[in_product]
+            trade_ids = trade_ids[trade_ids != TradeBatch.NO_TRADE_ID]
+            if len(trade_ids) > 0:
+                last_id = int(np.max(trade_ids))
+                self._pending_trade_ids[product_id] = max(
+                    self._pending_trade_ids.get(product_id, last_id), last_id
+                )
+
+    def commit(self) -> None:
+        """
+        Persists the positions recorded by `update`. We write to a temporary file
+        first, so a crash never leaves a half-written checkpoint behind.
+        """
+        if self._pending == self.positions and self._pending_trade_ids == self.trade_ids:
+            return
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        tmp_path.write_bytes(orjson.dumps({
+            product_id: {
+                'timestamp_ms': position,
+                'trade_id': self._pending_trade_ids.get(product_id),
+            }
+            for product_id, position in self._pending.items()
+        }))
+        tmp_path.replace(self.path)
+
+        self.positions = dict(self._pending)
+        self.trade_ids = dict(self._pending_trade_ids)
+        logger.debug(f'Committed backfill checkpoint {self.positions}, trade ids {self.trade_ids}')
+
+
+def commit_after_flush(producer, checkpoint: BackfillCheckpoint, delivery_report) -> None:
+    """
+    Flushes the producer and commits the checkpoint, if every message we produced
+    so far was delivered.
+
+    Args:
+        producer: The producer to flush, or None if it is already flushed and closed.
+        checkpoint (BackfillCheckpoint): The checkpoint to commit.
+        delivery_report (DeliveryReport): The delivery callback of all the messages.
+
+    Raises:
+        RuntimeError: If some messages were not delivered. The checkpoint stays where
+            it was, so the next run produces those trades again.
+    """
+    if producer is not None:
+        producer.flush()
+
+    if delivery_report.failed:
+        raise RuntimeError(
+            f'{delivery_report.failed:,} trades were not delivered to Kafka '
+            f'({delivery_report.last_error}). Keeping the backfill checkpoint at '
+            f'{checkpoint.positions}, so the next run resumes from there'
+        )
+
+    checkpoint.commit()
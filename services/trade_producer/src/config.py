@@ -1,13 +1,57 @@
-from typing import Optional
+from typing import List, Optional
 from pydantic_settings import BaseSettings
 
 class AppConfig(BaseSettings):
     kafka_broker_address: str
     kafka_topic: str
-    product_id: str
+    # 'json' or 'binary', see src/wire_format.py
+    kafka_topic_value_format: str = 'json'
+    product_ids: List[str]
+    # provisioning of kafka_topic when it does not exist yet, see src/topics.py.
+    # The trades are keyed by product_id, so up to kafka_topic_partitions
+    # trade_to_ohlc workers can share them
+    kafka_topic_partitions: int = 1
+    kafka_topic_replication_factor: int = 1
+    kafka_topic_retention_ms: Optional[int] = None
 
+    # 'live', 'historical', 'replay' or 'synthetic'
     live_or_historical: Optional[str] = None
+
+    # live mode: read the websocket on a background asyncio task, with a bounded
+    # queue of frames between the socket and the Kafka producer
+    live_async_ingestion: bool = True
+    websocket_queue_size: int = 10_000
+    # validate every live trade with pydantic, only to debug bad frames
+    strict_validation: bool = False
+    # live mode: backfill the last n days with the REST API first, and switch to
+    # the live trades with no gap and no duplicates
+    backfill_last_n_days: Optional[int] = None
     last_n_days: Optional[int] = None
+    n_shards: Optional[int] = 1
+    cache_dir: Optional[str] = None
+    # JSON file with the last produced trade of each product, to resume backfills
+    checkpoint_path: Optional[str] = None
+
+    # replay mode: a parquet/CSV file or directory (like cache_dir) to replay, and
+    # how fast, relative to real time. 0 means as fast as possible
+    replay_path: Optional[str] = None
+    replay_speed: float = 0.0
+
+    # synthetic mode: generated trades at a target rate, to stress test the pipeline.
+    # With synthetic_n_products we generate products SYN0/USD, SYN1/USD, ...
+    # instead of using product_ids
+    synthetic_trades_per_sec: float = 10_000
+    synthetic_n_products: Optional[int] = None
+    synthetic_duration_sec: Optional[float] = None
+    synthetic_late_fraction: float = 0.0
+    synthetic_max_lateness_ms: int = 10_000
+
+    # producer tuning. None keeps the librdkafka defaults
+    bulk_produce: bool = True
+    kafka_producer_linger_ms: Optional[int] = None
+    kafka_producer_batch_size: Optional[int] = None
+    kafka_producer_compression_type: Optional[str] = None
+    kafka_producer_acks: Optional[str] = None
 
     # One way:
     class Config:
@@ -0,0 +1,133 @@
+import time
+from typing import Callable, Optional
+
+from loguru import logger
+
+from src.trade_data_source import TradeBatch
+
+
+def get_producer_config(
+    linger_ms: Optional[int] = None,
+    batch_size: Optional[int] = None,
+    compression_type: Optional[str] = None,
+    acks: Optional[str] = None,
+) -> dict:
+    """
+    Returns the librdkafka producer settings we pass to the quixstreams Application.
+    Settings left to None keep the librdkafka defaults.
+
+    Args:
+        linger_ms (Optional[int]): How long the producer waits to fill a batch before sending it.
+        batch_size (Optional[int]): The max size in bytes of a batch of messages to one partition.
+        compression_type (Optional[str]): One of 'none', 'gzip', 'snappy', 'lz4' or 'zstd'.
+        acks (Optional[str]): How many replicas must acknowledge a message: '0', '1' or 'all'.
+
+    Returns:
+        dict: The producer settings.
+    """
+    config = {
+        'linger.ms': linger_ms,
+        'batch.size': batch_size,
+        'compression.type': compression_type,
+        'acks': acks,
+    }
+    return {key: value for key, value in config.items() if value is not None}
+
+
+class DeliveryReport:
+    """
+    Keeps count of the messages Kafka acknowledged, and of the ones it could not
+    deliver. Pass it as the `on_delivery` callback of `producer.produce`.
+    """
+
+    def __init__(self) -> None:
+        self.delivered = 0
+        self.failed = 0
+        self.delivered_bytes = 0
+        self.last_error = None
+
+    def __call__(self, err, msg) -> None:
+        if err is not None:
+            self.failed += 1
+            self.last_error = err
+            return
+
+        self.delivered += 1
+        self.delivered_bytes += len(msg.value() or b'')
+
+    def log_summary(self) -> None:
+        """
+        Logs the delivery counts, as an error if some messages were not delivered.
+        """
+        summary = (
+            f'Delivered {self.delivered:,} messages ({self.delivered_bytes:,} bytes), '
+            f'failed {self.failed:,}'
+        )
+        if self.failed:
+            logger.error(f'{summary}. Last error: {self.last_error}')
+        else:
+            logger.info(summary)
+
+
+class SampledLogger:
+    """
+    Logs the producer progress at most once every `every_sec` seconds, instead of
+    formatting one log line per trade.
+    """
+
+    def __init__(self, every_sec: float = 10.0) -> None:
+        self.every_sec = every_sec
+        self.n_trades = 0
+        self._n_trades_at_last_log = 0
+        self._last_log_time = time.monotonic()
+
+    def add(self, n_trades: int, delivery_report: Optional[DeliveryReport] = None) -> None:
+        """
+        Counts `n_trades` more produced trades, and logs if it is time to.
+        """
+        self.n_trades += n_trades
+
+        now = time.monotonic()
+        elapsed = now - self._last_log_time
+        if elapsed < self.every_sec:
+            return
+
+        rate = (self.n_trades - self._n_trades_at_last_log) / elapsed
+        failed = f', {delivery_report.failed:,} failed' if delivery_report else ''
+        logger.info(f'Pushed {self.n_trades:,} trades to Kafka ({rate:,.0f} trades/s{failed})')
+
+        self._n_trades_at_last_log = self.n_trades
+        self._last_log_time = now
+
+
+def produce_batch(
+    producer,
+    topic_name: str,
+    trades: TradeBatch,
+    on_delivery: Optional[Callable] = None,
+    value_format: str = 'json',
+) -> int:
+    """
+    Produces all the trades in the batch with pre-encoded keys and values.
+
+    Args:
+        producer: The quixstreams (or confluent-kafka) producer.
+        topic_name (str): The Kafka topic to produce to.
+        trades (TradeBatch): The trades to produce.
+        on_delivery (Optional[Callable]): The delivery callback for every message.
+        value_format (str): 'json' or 'binary', see `src.wire_format`.
+
+    Returns:
+        int: The number of bytes we produced (keys and values).
+    """
+    if value_format == 'binary':
+        values = trades.to_binary_payloads()
+    else:
+        values = trades.to_json_payloads()
+
+    n_bytes = 0
+    produce = producer.produce
+    for key, value in zip(trades.keys(), values):
+        produce(topic=topic_name, value=value, key=key, on_delivery=on_delivery)
+        n_bytes += len(key) + len(value)
+    return n_bytes
@@ -1,5 +1,6 @@
 
-from typing import List
+import time
+from typing import List, Optional, Union
 
 from loguru import logger
 from quixstreams import Application
@@ -7,12 +8,27 @@ from quixstreams import Application
 #from src.kraken_websocket_api import (KrakenWebsocketAPI, Trade)
 #from kraken_websocket_api import (KrakenWebsocketAPI, Trade)
 
-from src.trade_data_source import Trade, TradeSource
+from src.trade_data_source import Trade, TradeBatch, TradeSource
+from src.kafka_producer import (
+    DeliveryReport,
+    SampledLogger,
+    get_producer_config,
+    produce_batch,
+)
+from src.wire_format import TRADE_SCHEMA, get_value_serializer
+from src.checkpoint import BackfillCheckpoint, commit_after_flush
+from src.topics import create_topic
 
 def produce_trades(
     kafka_broker_address: str,
     kafka_topic: str,
     trade_data_source: TradeSource,
+    producer_config: Optional[dict] = None,
+    bulk_produce: bool = True,
+    log_every_sec: float = 10.0,
+    value_format: str = 'json',
+    checkpoint: Optional[BackfillCheckpoint] = None,
+    checkpoint_every_sec: float = 30.0,
 ):
     """
     Reads trades from the Kraken Websocket API and saves them in the given `kafka_topic`
@@ -21,22 +37,75 @@ def produce_trades(
         kafka_broker_address (str): The address of the Kafka broker
         kafka_topic (str): The Kafka topic to save the trades
         trade_data_source (TradeSource): The source of the trades
+        producer_config (Optional[dict]): Extra librdkafka settings for the producer,
+            like linger.ms, batch.size, compression.type or acks
+        bulk_produce (bool): Whether to produce the trades in bulk, with pre-encoded
+            payloads and sampled logs, or one at a time through `topic.serialize`
+        log_every_sec (float): In bulk mode, how often we log the progress
+        value_format (str): How we encode the trades: 'json' or 'binary'
+            (see `src.wire_format`)
+        checkpoint (Optional[BackfillCheckpoint]): Where we record the last produced
+            trade of each product, so a restarted backfill resumes from there
+        checkpoint_every_sec (float): How often we flush the producer and commit
+            the checkpoint
 
     Returns:
         None
     """   
     # Create an Application instance with Kafka config
-    app = Application(broker_address=kafka_broker_address)
+    app = Application(
+        broker_address=kafka_broker_address,
+        producer_extra_config=producer_config,
+    )
 
-    # Define a topic "my_topic" with JSON serialization
-    topic = app.topic(name=kafka_topic, value_serializer='json')
+    # Define a topic "my_topic" with JSON (or binary) serialization
+    topic = app.topic(
+        name=kafka_topic,
+        value_serializer=get_value_serializer(value_format, TRADE_SCHEMA),
+    )
+
+    delivery_report = DeliveryReport()
+    sampled_logger = SampledLogger(every_sec=log_every_sec)
+    last_commit_time = time.monotonic()
 
     # Create a Producer instance
     with app.get_producer() as producer:
 
         while not trade_data_source.is_done():
+
+            if (
+                checkpoint is not None
+                and time.monotonic() - last_commit_time >= checkpoint_every_sec
+            ):
+                # only commit what Kafka has acknowledged
+                commit_after_flush(producer, checkpoint, delivery_report)
+                last_commit_time = time.monotonic()
             
-            trades : List[Trade] = trade_data_source.get_trades()
+            trades : Union[List[Trade], TradeBatch] = trade_data_source.get_trades()
+
+            if checkpoint is not None:
+                checkpoint.update(
+                    trades if isinstance(trades, TradeBatch) else TradeBatch.from_trades(trades)
+                )
+
+            if bulk_produce:
+                # Serialize the whole batch in one go: keys are encoded once per
+                # product, and values with a fast JSON encoder
+                if not isinstance(trades, TradeBatch):
+                    trades = TradeBatch.from_trades(trades)
+
+                produce_batch(
+                    producer,
+                    topic.name,
+                    trades,
+                    on_delivery=delivery_report,
+                    value_format=value_format,
+                )
+                sampled_logger.add(len(trades), delivery_report)
+                continue
+
+            if isinstance(trades, TradeBatch):
+                trades = trades.to_trades()
 
             for trade in trades:
                 # Serialize an event using the defined Topic
@@ -46,31 +115,108 @@ def produce_trades(
                     value = trade.model_dump())  # Transform pydantic model to dictionary
                 
                 # Produce a message into the Kafka topic
-                producer.produce(topic=topic.name, value=message.value, key=message.key)
+                producer.produce(
+                    topic=topic.name,
+                    value=message.value,
+                    key=message.key,
+                    on_delivery=delivery_report,
+                )
 
                 logger.debug(f"Pushed trade to Kafka: {trade}")
 
+    # leaving the `with` block flushes the producer, so all the delivery callbacks ran
+    delivery_report.log_summary()
+
+    if checkpoint is not None:
+        commit_after_flush(None, checkpoint, delivery_report)
+
 if __name__ == "__main__":
 
     # Load configuration. 
     #from src.config import config
     from src.config import config
 
+    checkpoint = None
+
     if config.live_or_historical == 'live':
-        from src.trade_data_source.kraken_websocket_api import KrakenWebsocketAPI
-        kraken_api = KrakenWebsocketAPI(product_id=config.product_id)
+        if config.backfill_last_n_days:
+            from src.trade_data_source.kraken_backfill_and_live import KrakenBackfillAndLive
+            kraken_api = KrakenBackfillAndLive(
+                product_ids=config.product_ids,
+                last_n_days=config.backfill_last_n_days,
+                cache_dir=config.cache_dir,
+                n_shards=config.n_shards,
+                queue_size=config.websocket_queue_size,
+            )
+        elif config.live_async_ingestion:
+            from src.trade_data_source.kraken_websocket_api_async import KrakenWebsocketAPIAsync
+            kraken_api = KrakenWebsocketAPIAsync(
+                product_ids=config.product_ids,
+                queue_size=config.websocket_queue_size,
+                strict_validation=config.strict_validation,
+            )
+        else:
+            from src.trade_data_source.kraken_websocket_api import KrakenWebsocketAPI
+            kraken_api = KrakenWebsocketAPI(product_ids=config.product_ids)
 
     elif config.live_or_historical == 'historical':
-        from src.trade_data_source.kraken_rest_api import KrakenRestAPI
-        kraken_api = KrakenRestAPI(
-            product_id=config.product_id,
-            last_n_days=config.last_n_days,            
+        # resume the backfill from the last trades we know are in Kafka
+        if config.checkpoint_path is not None:
+            checkpoint = BackfillCheckpoint(config.checkpoint_path)
+
+        from src.trade_data_source.kraken_rest_api import KrakenRestAPIMultipleProducts
+        kraken_api = KrakenRestAPIMultipleProducts(
+            product_ids=config.product_ids,
+            last_n_days=config.last_n_days,
+            n_shards=config.n_shards,
+            cache_dir=config.cache_dir,
+            resume_from_ms=checkpoint.positions if checkpoint is not None else None,
+            resume_after_trade_id=checkpoint.trade_ids if checkpoint is not None else None,
             )
+
+    elif config.live_or_historical == 'replay':
+        from src.trade_data_source.replay import ReplayTradeSource
+        kraken_api = ReplayTradeSource(
+            path=config.replay_path,
+            product_ids=config.product_ids,
+            speed=config.replay_speed,
+        )
+
+    elif config.live_or_historical == 'synthetic':
+        from src.trade_data_source.synthetic import SyntheticTradeSource
+        kraken_api = SyntheticTradeSource(
+            product_ids=(
+                [f'SYN{i}/USD' for i in range(config.synthetic_n_products)]
+                if config.synthetic_n_products else config.product_ids
+            ),
+            trades_per_sec=config.synthetic_trades_per_sec,
+            duration_sec=config.synthetic_duration_sec,
+            late_fraction=config.synthetic_late_fraction,
+            max_lateness_ms=config.synthetic_max_lateness_ms,
+        )
     else:
         raise ValueError('Invalid value for live_or_historical')
 
+    # before quixstreams creates it with the defaults
+    create_topic(
+        broker_address=config.kafka_broker_address,
+        topic=config.kafka_topic,
+        partitions=config.kafka_topic_partitions,
+        replication_factor=config.kafka_topic_replication_factor,
+        retention_ms=config.kafka_topic_retention_ms,
+    )
+
     produce_trades(
         kafka_broker_address = config.kafka_broker_address,
         kafka_topic = config.kafka_topic,
         trade_data_source = kraken_api,
+        producer_config = get_producer_config(
+            linger_ms=config.kafka_producer_linger_ms,
+            batch_size=config.kafka_producer_batch_size,
+            compression_type=config.kafka_producer_compression_type,
+            acks=config.kafka_producer_acks,
+        ),
+        bulk_produce = config.bulk_produce,
+        value_format = config.kafka_topic_value_format,
+        checkpoint = checkpoint,
     )
\ No newline at end of file
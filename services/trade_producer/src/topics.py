@@ -0,0 +1,63 @@
+"""
+Provisioning of the Kafka topic of the trades: partitions, replication and retention
+come from the config, instead of the defaults of the broker (or of quixstreams,
+which creates missing topics with one partition).
+
+Keying contract: every trade is keyed by its `product_id`, so all the trades of a
+product go to the same partition, in order. The services downstream keep their
+state per product, in the partition of the product, and scale out with up to one
+worker per partition (see trade_to_ohlc).
+"""
+from typing import Optional
+
+from confluent_kafka import KafkaError, KafkaException
+from confluent_kafka.admin import AdminClient, NewTopic
+from loguru import logger
+
+
+def create_topic(
+    broker_address: str,
+    topic: str,
+    partitions: int,
+    replication_factor: int,
+    retention_ms: Optional[int] = None,
+) -> None:
+    """
+    Creates the topic if it does not exist yet. An existing topic is not changed:
+    adding partitions to it would move products to other partitions, so we only
+    warn if it has another number of partitions.
+
+    Args:
+        broker_address (str): The address of the Kafka broker
+        topic (str): The name of the topic
+        partitions (int): The number of partitions, the max number of consumers
+            of a consumer group
+        replication_factor (int): The number of copies of every partition
+        retention_ms (Optional[int]): How long the broker keeps the messages.
+            None keeps the default of the broker
+
+    Returns:
+        None
+    """
+    admin = AdminClient({'bootstrap.servers': broker_address})
+    config = {'retention.ms': str(retention_ms)} if retention_ms is not None else {}
+    future = admin.create_topics(
+        [NewTopic(topic, num_partitions=partitions, replication_factor=replication_factor, config=config)]
+    )[topic]
+    try:
+        future.result()
+        logger.info(
+            f'Created topic {topic} with {partitions} partitions, '
+            f'replication factor {replication_factor}'
+        )
+        return
+    except KafkaException as e:
+        if e.args[0].code() != KafkaError.TOPIC_ALREADY_EXISTS:
+            raise
+
+    existing = admin.list_topics(topic=topic, timeout=10).topics[topic]
+    if len(existing.partitions) != partitions:
+        logger.warning(
+            f'Topic {topic} has {len(existing.partitions)} partitions, not {partitions}. '
+            'Recreate it to change its partitions'
+        )
@@ -1,3 +1,6 @@
 from .trade import Trade
+from .trade_batch import TradeBatch
 
-from .base import TradeSource
\ No newline at end of file
+from .base import TradeSource
+
+from .rate_limiter import RateLimiter
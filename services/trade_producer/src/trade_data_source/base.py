@@ -1,9 +1,10 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import List, Union
 
 # observ how I am using absolute imports here
 # if you know how to use relative imports, please use them
 from src.trade_data_source.trade import Trade
+from src.trade_data_source.trade_batch import TradeBatch
 
 class TradeSource(ABC):
     """
@@ -11,9 +12,12 @@ class TradeSource(ABC):
     """
 
     @abstractmethod
-    def get_trades(self) -> List[Trade]:
+    def get_trades(self) -> Union[List[Trade], TradeBatch]:
         """
-        Retrieve the trades from whatever source you connect to
+        Retrieve the trades from whatever source you connect to.
+
+        Sources that handle many trades per call should return a `TradeBatch`,
+        which is validated once per batch and produced to Kafka in bulk.
         """
         pass
 
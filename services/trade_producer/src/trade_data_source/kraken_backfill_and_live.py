@@ -0,0 +1,189 @@
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+from loguru import logger
+
+from src.trade_data_source.base import TradeSource
+from src.trade_data_source.kraken_rest_api import KrakenRestAPI
+from src.trade_data_source.kraken_websocket_api_async import KrakenWebsocketAPIAsync
+from src.trade_data_source.rate_limiter import RateLimiter
+from src.trade_data_source.trade_batch import TradeBatch
+
+
+class KrakenBackfillAndLive(TradeSource):
+    """
+    Backfills the last `last_n_days` of trades with the Kraken REST API and then
+    switches to the live trades of the Kraken Websocket API, in one source, with
+    no gap and no duplicates around the switch.
+
+    1. We subscribe to the websocket first, and wait for Kraken to acknowledge it.
+       Every trade from that point on reaches us live, and we buffer the live trades
+       while the backfill runs.
+    2. We backfill each product, one after the other, up to the first live trade
+       we buffered for it (or up to the time we subscribed, if none came yet).
+    3. Once the backfill of a product is done, we release its buffered trades, and
+       its new live trades go straight through.
+
+    Kraken trade ids are increasing per product, and the same in both APIs, so a
+    live trade is new if its id is above the last one we backfilled.
+    """
+
+    def __init__(
+        self,
+        product_ids: List[str],
+        last_n_days: int,
+        cache_dir: Optional[str] = None,
+        n_shards: Optional[int] = 1,
+        queue_size: int = 10_000,
+        subscribe_timeout_sec: float = 30.0,
+    ) -> None:
+        """
+        Subscribes to the live trades, and prepares the backfill of each product.
+
+        Args:
+            product_ids (List[str]): The product ids to get the trades from.
+            last_n_days (int): The number of days we backfill.
+            cache_dir (Optional[str]): The cache directory of the backfill.
+            n_shards (Optional[int]): The number of time shards of each product backfill.
+            queue_size (int): The max number of websocket frames waiting for us.
+            subscribe_timeout_sec (float): How long we wait for Kraken to acknowledge
+                the websocket subscription.
+
+        Returns:
+            None
+        """
+        self.product_ids = product_ids
+
+        self.live = KrakenWebsocketAPIAsync(product_ids=product_ids, queue_size=queue_size)
+        if not self.live.wait_until_subscribed(timeout_sec=subscribe_timeout_sec):
+            self.live.close()
+            raise TimeoutError(
+                f'Kraken did not acknowledge the subscription to {product_ids} '
+                f'in {subscribe_timeout_sec} seconds'
+            )
+
+        # we are subscribed, so the trades after this moment come to us live
+        subscribed_ms = int(time.time() * 1000)
+
+        rate_limiter = RateLimiter()
+        self.backfills = {
+            product_id: KrakenRestAPI(
+                product_id=product_id,
+                last_n_days=last_n_days,
+                cache_dir=cache_dir,
+                n_shards=n_shards,
+                rate_limiter=rate_limiter,
+                to_ms=subscribed_ms,
+            )
+            for product_id in product_ids
+        }
+
+        # live trades of the products we are still backfilling, and the first
+        # live trade id of each product
+        self._buffer = TradeBatch.empty()
+        self._first_live_id: Dict[str, int] = {}
+
+        # the last trade id we backfilled, per product. A product is live once it
+        # has an entry in `_handoff_id`
+        self._last_backfill_id: Dict[str, int] = {}
+        self._handoff_id: Dict[str, int] = {}
+
+    def get_trades(self) -> TradeBatch:
+        """
+        Returns the next page of the backfill, with the live trades of the products
+        we already backfilled. Once every product is backfilled, returns live trades.
+        """
+        backfilling = [
+            product_id for product_id in self.product_ids if product_id not in self._handoff_id
+        ]
+        if not backfilling:
+            return self._new_live_trades(self.live.get_trades())
+
+        # don't let the websocket queue fill up while we backfill
+        self._buffer_live_trades()
+
+        trades = self._backfill(backfilling[0])
+        return TradeBatch.concat([trades, self._release_buffer()])
+
+    def is_done(self) -> bool:
+        return self.live.is_done()
+
+    def _backfill(self, product_id: str) -> TradeBatch:
+        """
+        Returns the next page of the backfill of `product_id`, and hands the product
+        off to the live trades once the backfill reaches them.
+        """
+        backfill = self.backfills[product_id]
+        trades = backfill.get_trades()
+
+        reached_live = False
+        first_live_id = self._first_live_id.get(product_id)
+        if first_live_id is not None:
+            before_live = trades.trade_id < first_live_id
+            reached_live = not before_live.all()
+            trades = trades[before_live]
+
+        if len(trades) > 0:
+            self._last_backfill_id[product_id] = max(
+                self._last_backfill_id.get(product_id, TradeBatch.NO_TRADE_ID),
+                int(trades.trade_id.max()),
+            )
+
+        if reached_live or backfill.is_done():
+            handoff_id = self._last_backfill_id.get(product_id, TradeBatch.NO_TRADE_ID)
+            self._handoff_id[product_id] = handoff_id
+            logger.info(
+                f'Backfill of {product_id} is done. Switching to live trades after trade id {handoff_id}'
+            )
+
+        return trades
+
+    def _buffer_live_trades(self) -> None:
+        """
+        Moves the live trades waiting in the websocket queue to our buffer.
+        """
+        trades = self.live.get_trades(timeout_sec=0)
+        if len(trades) == 0:
+            return
+
+        for code, product_id in enumerate(trades.product_ids):
+            trade_ids = trades.trade_id[trades.product_codes == code]
+            if product_id not in self._first_live_id and len(trade_ids) > 0:
+                self._first_live_id[product_id] = int(trade_ids.min())
+
+        self._buffer = TradeBatch.concat([self._buffer, trades])
+
+    def _release_buffer(self) -> TradeBatch:
+        """
+        Returns the buffered trades of the products that are live now, and keeps
+        the others in the buffer.
+        """
+        if len(self._buffer) == 0:
+            return self._buffer
+
+        is_live = np.array(
+            [product_id in self._handoff_id for product_id in self._buffer.product_ids],
+            dtype=bool,
+        )[self._buffer.product_codes]
+
+        released = self._new_live_trades(self._buffer[is_live])
+        self._buffer = self._buffer[~is_live]
+        return released
+
+    def _new_live_trades(self, trades: TradeBatch) -> TradeBatch:
+        """
+        Drops the live trades we already returned from the backfill.
+        """
+        if len(trades) == 0:
+            return trades
+
+        # (a masked batch can still list products we are backfilling, without trades)
+        handoff_ids = np.array(
+            [
+                self._handoff_id.get(product_id, TradeBatch.NO_TRADE_ID)
+                for product_id in trades.product_ids
+            ],
+            dtype=np.int64,
+        )
+        return trades[trades.trade_id > handoff_ids[trades.product_codes]]
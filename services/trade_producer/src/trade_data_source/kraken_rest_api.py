@@ -1,22 +1,49 @@
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 from loguru import logger
-from time import sleep
-import json 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from queue import Full, Queue
+import threading
 
-from src.trade_data_source.base import TradeSource, Trade
+import numpy as np
+
+from src.trade_data_source.base import TradeSource
+from src.trade_data_source.trade_batch import TradeBatch
+from src.trade_data_source.rate_limiter import RateLimiter
 
 
 
 class KrakenRestAPI(TradeSource):
-    URL = 'https://api.kraken.com/0/public/Trades?pair={product_id}&since={since_sec}'
+    URL = 'https://api.kraken.com/0/public/Trades?pair={product_id}&since={since_ns}'
+
+    # max number of pages each shard can fetch ahead of the one we are currently
+    # returning in `get_trades`
+    MAX_PAGES_AHEAD_PER_SHARD = 100
+
+    # how often a shard waiting for room in its queue checks if it should stop
+    SHARD_PUT_TIMEOUT_SEC = 1
+
+    # seconds we wait for the Kraken REST API to (start to) answer a request
+    REQUEST_TIMEOUT_SEC = 10
+
+    # number of times we retry a request that failed at the HTTP level
+    # (connection errors, 5xx responses)
+    MAX_RETRIES = 3
 
     def __init__(
         self,
         product_id: str,
         last_n_days: int,
         cache_dir: Optional[str] = None,
+        n_shards: Optional[int] = 1,
+        rate_limiter: Optional[RateLimiter] = None,
+        resume_from_ms: Optional[int] = None,
+        to_ms: Optional[int] = None,
+        resume_after_trade_id: Optional[int] = None,
     ) -> None:
         """
         Basic initialization of the Kraken Rest API.
@@ -25,22 +52,51 @@ class KrakenRestAPI(TradeSource):
             product_id (str): One product ID for which we want to get the trades.
             last_n_days (int): The number of days from which we want to get historical data.
             cache_dir (Optional[str]): The directory where we will store the historical data to
+            n_shards (Optional[int]): The number of time shards we split [from_ms, to_ms] into.
+                The shards are fetched concurrently and their trades are returned in
+                timestamp order. 1 means we fetch one page at a time.
+            rate_limiter (Optional[RateLimiter]): The rate limiter all our requests go
+                through. Pass the same instance to several sources that share an IP.
+            resume_from_ms (Optional[int]): The timestamp of the last trade a previous
+                run produced. If given, we start fetching from there instead of from_ms.
+            to_ms (Optional[int]): The end of the backfill in Unix milliseconds. None
+                means today at midnight (UTC).
+            resume_after_trade_id (Optional[int]): The trade id of the last trade a
+                previous run produced. If given with `resume_from_ms`, we skip the
+                trades up to it, which that run already produced.
 
         Returns:
             None
         """
         self.product_id = product_id
         self.from_ms, self.to_ms = self._init_from_to_ms(last_n_days)
+        if to_ms is not None:
+            self.to_ms = to_ms
 
         logger.debug(
             f'Initializing KrakenRestAPI: from_ms={ts_to_date(self.from_ms)}, to_ms={ts_to_date(self.to_ms)}'
         )
 
-        # the timestamp from which we want to fetch historical data
+        # we returned all the trades before this timestamp.
         # this will be updated after each batch of trades is fetched from the API
         # self.since_ms = from_ms
         self.last_trade_ms = self.from_ms
 
+        # the trade id of the last trade a previous run produced. Kraken trade ids go
+        # up with time, so we skip the trades up to it
+        self.resume_after_trade_id = None
+
+        if resume_from_ms is not None and resume_from_ms > self.from_ms:
+            # A previous run already produced everything before resume_from_ms.
+            # We fetch again from resume_from_ms itself, because that run might not
+            # have seen all the trades in that same millisecond
+            logger.info(
+                f'Resuming backfill of {product_id} from {ts_to_date(resume_from_ms)}, '
+                f'after trade id {resume_after_trade_id}'
+            )
+            self.last_trade_ms = min(resume_from_ms, self.to_ms)
+            self.resume_after_trade_id = resume_after_trade_id
+
         # are we done fetching historical data?
         # Yes, if the last batch of trades has a data['result'][product_id]['last'] >= self.to_ms
         # self._is_done = False
@@ -52,6 +108,31 @@ class KrakenRestAPI(TradeSource):
             self.cache = CachedTradeData(cache_dir)
             self.use_cache = True
 
+            gaps = self.cache.gaps(self.product_id, self.from_ms, self.to_ms + 1)
+            logger.info(
+                f'{len(gaps)} time ranges for {self.product_id} are not cached yet, '
+                f'we will only fetch those from the Kraken REST API'
+            )
+
+        # sharded backfill. The shards are started lazily, on the first call to
+        # `get_trades`, so creating this object does not hit the network.
+        self.n_shards = max(1, n_shards or 1)
+        self._shard_queues: Optional[List[Queue]] = None
+        self._current_shard = 0
+        # set when the backfill fails, so the other shards stop fetching
+        self._stop_shards = threading.Event()
+
+        # one rate budget shared by all the requests this object makes, no matter
+        # how many shards are fetching in parallel
+        self.rate_limiter = rate_limiter or RateLimiter()
+
+        # one pooled HTTP session, with one keep-alive connection per shard, so we
+        # don't pay a new TCP + TLS handshake on every page
+        self._session = self._create_session(pool_size=self.n_shards)
+
+        # where the (non-sharded) backfill is. to_ms is inclusive
+        self._cursor = PageCursor(self.last_trade_ms, self.to_ms + 1)
+
     @staticmethod
     def _init_from_to_ms(last_n_days: int) -> Tuple[int, int]:
         """
@@ -79,124 +160,515 @@ class KrakenRestAPI(TradeSource):
 
         return from_ms, to_ms
 
-    def get_trades(self) -> List[Trade]:
+    def get_trades(self) -> TradeBatch:
         """
-        Fetches a batch of trades from the Kraken Rest API and returns them as a list
-        of dictionaries.
+        Fetches a batch of trades from the Kraken Rest API and returns them as a
+        columnar `TradeBatch`.
 
         Args:
             None
 
         Returns:
-            List[Trade]: A list of dictionaries, where each dictionary contains the trade data.
+            TradeBatch: The trades in the batch, sorted by timestamp.
         """
+        if self.n_shards > 1:
+            return self._drop_produced(self._get_trades_from_shards())
+
+        # the cursor drops the trades we already returned and the ones after to_ms
+        trades = self._fetch_trades(self._cursor)
+        self.last_trade_ms = self._cursor.boundary_ms
+
+        if self._cursor.is_done and self.use_cache:
+            # write the days we do not have all of, like the first one of a resume
+            self.cache.flush()
+
+        # if ns_to_date(since_ns) == '2024-04-30 18:33:41':
+        #     # self.cache._get_file_path(url)
+        #     breakpoint()
+
+        return self._drop_produced(trades)
+
+    def _drop_produced(self, trades: TradeBatch) -> TradeBatch:
+        """
+        Drops the trades a previous run already produced, the ones up to
+        `resume_after_trade_id`. Trades without a trade id are kept.
+        """
+        if self.resume_after_trade_id is None or not trades:
+            return trades
+
+        keep = (trades.trade_id > self.resume_after_trade_id) | (
+            trades.trade_id == TradeBatch.NO_TRADE_ID
+        )
+        if keep.all():
+            # past the millisecond we resumed from, nothing more to drop
+            self.resume_after_trade_id = None
+            return trades
+        return trades[keep]
+
+    def is_done(self) -> bool:
+        # return self._is_done
+        if self.n_shards > 1:
+            return self._shard_queues is not None and self._current_shard >= self.n_shards
+
+        return self._cursor.is_done
+
+    def _fetch_trades(self, cursor: 'PageCursor') -> TradeBatch:
+        """
+        Fetches the page of trades that comes after `cursor`, either from the cache
+        or from the Kraken REST API, and moves the cursor past it.
+
+        If the cache covers the cursor, the page holds all the cached trades up to the
+        end of the covered range or the end of the day, whatever comes first.
+        Otherwise it is one page of the Kraken REST API, requested with the `last`
+        cursor of the previous page.
+
+        Args:
+            cursor (PageCursor): Where the backfill is. It is updated in place.
+
+        Returns:
+            TradeBatch: The trades in the page we had not returned yet, before
+                cursor.to_ms and sorted by timestamp.
+        """
+        if self.use_cache:
+            covered_to_ms = self.cache.covered_until(self.product_id, cursor.boundary_ms)
+            if covered_to_ms is not None:
+                # read the data from the cache, one day at most, so we scan
+                # each day partition once
+                to_ms = min(covered_to_ms, next_midnight_ms(cursor.boundary_ms), cursor.to_ms)
+                trades = cursor.drop_seen(
+                    self.cache.read(self.product_id, cursor.boundary_ms, to_ms)
+                )
+                logger.debug(
+                    f'Loaded {len(trades)} trades for {self.product_id}, since={ts_to_date(cursor.boundary_ms)} from the cache'
+                )
+                cursor.skip_to(to_ms)
+                return trades
+
         # Replace the placeholders in the URL with the actual values for
         # - product_id
         # - since_ns
-        since_ns = self.last_trade_ms * 1_000_000
-        payload = {}
-        headers = {'Accept': 'application/json'}
-        url = self.URL.format(product_id=self.product_id, since_sec=since_ns)
+        url = self.URL.format(product_id=self.product_id, since_ns=cursor.since_ns)
         logger.debug(f'{url=}')
 
-        if self.use_cache and self.cache.has(url):
-            # read the data from the cache
-            trades = self.cache.read(url)
+        data = self._request(url)
+
+        # Each trade is a list like
+        # ['3500.12', '0.01000000', 1718000000.1234, 'b', 'l', '', 70000000]
+        # with price, volume, time (in seconds) and trade id in positions 0, 1, 2 and 6.
+        # Instead of building one Trade object per trade, we build one column per
+        # field, and NumPy parses the price and volume strings in bulk
+        rows = data['result'][self.product_id]
+        page = TradeBatch.from_columns(
+            product_id=self.product_id,
+            price=np.array([row[0] for row in rows], dtype=np.float64),
+            quantity=np.array([row[1] for row in rows], dtype=np.float64),
+            timestamp_ms=(
+                np.array([row[2] for row in rows], dtype=np.float64) * 1000
+            ).astype(np.int64),
+            trade_id=[row[6] if len(row) > 6 else TradeBatch.NO_TRADE_ID for row in rows],
+        )
+
+        logger.debug(
+            f'Fetched {len(page)} trades for {self.product_id}, since={ns_to_date(cursor.since_ns)} from the Kraken REST API'
+        )
+
+        if not page:
+            # the API has no more trades for us, so there is nothing left to fetch
+            cursor.exhausted = True
+            return page
+
+        # pages overlap at their boundaries, so some of these trades can be the
+        # last ones of the previous page
+        trades = cursor.drop_seen(page)
+
+        # `last` is the cursor Kraken wants as the `since` of the next request
+        last_ns = int(data['result'].get('last') or round(float(rows[-1][2]) * 1e9))
+
+        from_ms = cursor.boundary_ms
+        complete_trades = cursor.advance(trades, last_ns)
+
+        if self.use_cache and cursor.boundary_ms > from_ms:
+            # write the data to the cache. We know we have all the trades in
+            # [from_ms, cursor.boundary_ms), the trades at cursor.boundary_ms might
+            # continue in the next page. A shard never writes past its own range
+            to_ms = min(cursor.boundary_ms, cursor.to_ms)
+            self.cache.write(
+                self.product_id,
+                complete_trades[complete_trades.timestamp_ms < to_ms],
+                from_ms=from_ms,
+                to_ms=to_ms,
+            )
             logger.debug(
-                f'Loaded {len(trades)} trades for {self.product_id}, since={ns_to_date(since_ns)} from the cache'
+                f'Wrote to cache for {self.product_id}, since={ts_to_date(from_ms)}'
             )
-        else:
+
+        return trades[trades.timestamp_ms < cursor.to_ms]
+
+    def _request(self, url: str) -> dict:
+        """
+        Makes a GET request to the Kraken REST API and returns the parsed response.
+
+        Every request waits for the rate limiter first. If Kraken still answers with
+        'EGeneral:Too many requests' we tell the rate limiter, which backs off, and
+        we retry the same request.
+
+        Args:
+            url (str): The URL to request.
+
+        Returns:
+            dict: The parsed JSON response, without errors.
+        """
+        while True:
+            # slow down the rate at which we are making requests to the Kraken API
+            self.rate_limiter.acquire()
+
             # make the request to the Kraken REST API
-            response = requests.request('GET', url, headers=headers, data=payload)
+            response = self._session.get(url, timeout=self.REQUEST_TIMEOUT_SEC)
+            response.raise_for_status()
 
-            # parse string into dictionary
-            data = json.loads(response.text)
+            # parse the (already decompressed) bytes into a dictionary, without
+            # decoding them to a str first
+            data = orjson.loads(response.content)
 
-            # TODO: Error handling
-            # It can happen that we get an error response from KrakenRESTAP like the following:
+            # It can happen that we get an error response from the Kraken REST API like
             # data = {'error': ['EGeneral:Too many requests']}
-            # To solve this have several options
-            #
-            # Option 1. Check if the `error` key is present in the `data` and has
-            # a non-empty list value. If so, we could raise an exception, or even better, implment
-            # a retry mechanism, using a library like `retry` https://github.com/invl/retry
-            #
-            # Option 2. Simply slow down the rate at which we are making requests to the Kraken API,
-            # and cross your fingers.
-            #
-            # Option 3. Implement both Option 1 and Option 2, so you don't need to cross your fingers.
-            #
-            # Here is an example of how you could implement Option 2
-            if ('error' in data) and ('EGeneral:Too many requests' in data['error']):
-                # slow down the rate at which we are making requests to the Kraken API
-                logger.info('Too many requests. Sleeping for 30 seconds')
-                sleep(30)
-
-            # Python trick
-            # Instead of initializing an empty list and appending to it, like this
-            #
-            # trades = []
-            # for trade in data['result'][self.product_ids[0]]:
-            #     trades.append({
-            #         'price': float(trade[0]),
-            #         'volume': float(trade[1]),
-            #         'time': int(trade[2]),
-            #     })
-            #
-            # You can use a list comprehension to do the same thing
-            trades = [
-                Trade(
-                    price=float(trade[0]),
-                    quantity=float(trade[1]),
-                    timestamp_ms=int(trade[2] * 1000),
-                    product_id=self.product_id,
-                )
-                for trade in data['result'][self.product_id]
-            ]
+            if 'EGeneral:Too many requests' in data.get('error', []):
+                self.rate_limiter.on_error()
+                continue
 
-            logger.debug(
-                f'Fetched {len(trades)} trades for {self.product_id}, since={ns_to_date(since_ns)} from the Kraken REST API'
-            )
+            if data.get('error'):
+                raise ValueError(f'Kraken REST API error for {url}: {data["error"]}')
 
-            if self.use_cache:
-                # write the data to the cache
-                self.cache.write(url, trades)
-                logger.debug(
-                    f'Wrote to cache for {self.product_id}, since={ns_to_date(since_ns)}'
-                )
+            self.rate_limiter.on_success()
+            return data
 
-            # slow down the rate at which we are making requests to the Kraken API
-            sleep(1)
+    @classmethod
+    def _create_session(cls, pool_size: int = 1) -> requests.Session:
+        """
+        Returns an HTTP session with a pool of keep-alive connections, gzip
+        compression, and bounded retries with backoff for connection errors and
+        5xx responses.
+
+        'Too many requests' errors are not retried here, because Kraken returns them
+        with a 200 status code. The rate limiter takes care of them in `_request`.
+
+        Args:
+            pool_size (int): The max number of connections we keep open to the API.
+
+        Returns:
+            requests.Session: The session to make all our requests with.
+        """
+        retries = Retry(
+            total=cls.MAX_RETRIES,
+            backoff_factor=0.5,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            max_retries=retries,
+        )
+
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip',
+            'Connection': 'keep-alive',
+        })
+        return session
+
+    def _get_shard_ranges(self) -> List[Tuple[int, int]]:
+        """
+        Splits [self.last_trade_ms, self.to_ms] into `self.n_shards` contiguous time
+        ranges. Before the first call to `get_trades`, self.last_trade_ms is from_ms,
+        or where a previous run left off.
+
+        Returns:
+            List[Tuple[int, int]]: A list of (from_ms, to_ms) pairs, where to_ms is
+                exclusive. The last shard ends at self.to_ms + 1 so it includes self.to_ms.
+        """
+        shard_ms = (self.to_ms - self.last_trade_ms) // self.n_shards
+        boundaries = [self.last_trade_ms + i * shard_ms for i in range(self.n_shards)]
+        boundaries.append(self.to_ms + 1)
+        return list(zip(boundaries[:-1], boundaries[1:]))
+
+    def _start_shards(self) -> None:
+        """
+        Starts one background fetcher per shard. Each fetcher pushes its pages of
+        trades into its own queue, and a `None` once the shard is complete.
+        """
+        shard_ranges = self._get_shard_ranges()
+        logger.info(
+            f'Starting {len(shard_ranges)} shards for {self.product_id}: '
+            + ', '.join(f'{ts_to_date(a)} -> {ts_to_date(b)}' for a, b in shard_ranges)
+        )
+
+        self._shard_queues = [
+            Queue(maxsize=self.MAX_PAGES_AHEAD_PER_SHARD) for _ in shard_ranges
+        ]
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(shard_ranges), thread_name_prefix='kraken-shard'
+        )
+        for (shard_from_ms, shard_to_ms), queue in zip(shard_ranges, self._shard_queues):
+            self._executor.submit(self._fetch_shard, shard_from_ms, shard_to_ms, queue)
+
+    def _fetch_shard(self, shard_from_ms: int, shard_to_ms: int, queue: Queue) -> None:
+        """
+        Fetches all the trades in [shard_from_ms, shard_to_ms) page by page, and puts
+        them into the given `queue`.
+        """
+        try:
+            # the cursor keeps only the trades that belong to this shard. The last
+            # page of the shard overlaps with the next shard
+            cursor = PageCursor(shard_from_ms, shard_to_ms)
+            while not cursor.is_done:
+                if not self._put_page(queue, self._fetch_trades(cursor)):
+                    return
+
+            self._put_page(queue, None)
+
+        except Exception as e:
+            logger.error(f'Shard starting at {ts_to_date(shard_from_ms)} failed: {e}')
+            # hand the exception to `get_trades`, so the service does not hang
+            self._put_page(queue, e)
+
+    def _put_page(self, queue: Queue, page: Union[TradeBatch, Exception, None]) -> bool:
+        """
+        Waits until there is room for `page` in the `queue` of a shard and puts it
+        there, unless the backfill is stopped in the meantime.
+
+        Returns:
+            bool: False if the backfill was stopped, and the shard must stop too.
+        """
+        while not self._stop_shards.is_set():
+            try:
+                queue.put(page, timeout=self.SHARD_PUT_TIMEOUT_SEC)
+                return True
+            except Full:
+                continue
+        return False
+
+    def _get_trades_from_shards(self) -> TradeBatch:
+        """
+        Returns the next page of trades of the sharded backfill.
 
-        if trades[-1].timestamp_ms == self.last_trade_ms:
-            # if the last trade timestamp in the batch is the same as self.last_trade_ms,
-            # then we need to increment it by 1 to avoid repeating the exact same API request,
-            # which would result in an infinite loop
-            self.last_trade_ms = trades[-1].timestamp_ms + 1
+        Shards cover contiguous and disjoint time ranges, so draining them one
+        after the other gives us the trades in global timestamp order, while the
+        shards we have not reached yet keep fetching in the background.
+        """
+        if self._shard_queues is None:
+            self._start_shards()
+
+        if self._current_shard >= self.n_shards:
+            return TradeBatch.empty()
+
+        trades = self._shard_queues[self._current_shard].get()
+
+        if isinstance(trades, Exception):
+            # stop the other shards, which would otherwise wait forever for room
+            # in their full queues, and keep the process from exiting
+            self._stop_shards.set()
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            raise trades
+
+        if trades is None:
+            # the current shard is complete, move on to the next one
+            logger.info(f'Shard {self._current_shard + 1}/{self.n_shards} is done')
+            self._current_shard += 1
+            if self._current_shard >= self.n_shards:
+                self._executor.shutdown(wait=False)
+                if self.use_cache:
+                    self.cache.flush()
+            return TradeBatch.empty()
+
+        return trades
+
+
+class PageCursor:
+    """
+    Where a sequential walk through the trades of one product in [from_ms, to_ms) is.
+
+    Kraken pages overlap at their boundaries: the next page starts at the `last`
+    cursor of the previous one, and trades of that same instant can come back twice.
+    Only trades at the boundary can repeat, so instead of remembering every trade id
+    we returned, the cursor keeps the trades of the last millisecond we returned
+    (`boundary_trades`), and drops the trades of a new page that come before it or
+    have one of its trade ids. That set holds the trades of one millisecond, and is
+    emptied every time the boundary moves.
+    """
+
+    def __init__(self, from_ms: int, to_ms: int) -> None:
+        """
+        Args:
+            from_ms (int): The timestamp of the first trade we want, in milliseconds.
+            to_ms (int): The end (exclusive) of the walk, in milliseconds.
+
+        Returns:
+            None
+        """
+        self.to_ms = to_ms
+
+        # we returned all the trades before boundary_ms, and the ones at boundary_ms
+        # in boundary_trades
+        self.boundary_ms = from_ms
+        self.boundary_trades = TradeBatch.empty()
+
+        # the `since` of the next request, in nanoseconds. We start 1ns before from_ms
+        # so the trades at from_ms come in whether `since` is inclusive or not
+        self.since_ns = from_ms * 1_000_000 - 1
+
+        # True once the API has no more trades for us
+        self.exhausted = False
+
+    @property
+    def is_done(self) -> bool:
+        return self.exhausted or self.boundary_ms >= self.to_ms
+
+    def drop_seen(self, trades: TradeBatch) -> TradeBatch:
+        """
+        Returns the trades of a page we have not returned yet.
+        """
+        keep = trades.timestamp_ms >= self.boundary_ms
+
+        seen_ids = self.boundary_trades.trade_id
+        seen_ids = seen_ids[seen_ids != TradeBatch.NO_TRADE_ID]
+        if len(seen_ids) > 0:
+            keep &= ~np.isin(trades.trade_id, seen_ids)
+
+        return trades[keep]
+
+    def advance(self, trades: TradeBatch, last_ns: int) -> TradeBatch:
+        """
+        Moves the cursor past a page of the Kraken REST API.
+
+        Args:
+            trades (TradeBatch): The new trades of the page, after `drop_seen`.
+            last_ns (int): The `last` cursor of the page.
+
+        Returns:
+            TradeBatch: All the trades from the old boundary on, the ones we had
+                already returned at that millisecond included.
+        """
+        trades = TradeBatch.concat([self.boundary_trades, trades])
+
+        if len(trades) > 0 and trades.timestamp_ms[-1] > self.boundary_ms:
+            self.boundary_ms = int(trades.timestamp_ms[-1])
+            self.boundary_trades = trades[trades.timestamp_ms >= self.boundary_ms]
         else:
-            # otherwise, update self.last_trade_ms to the timestamp of the last trade
-            # in the batch
-            self.last_trade_ms = trades[-1].timestamp_ms
-        
-        # filter out trades that are after the end timestamp
-        trades = [trade for trade in trades if trade.timestamp_ms <= self.to_ms]
+            self.boundary_trades = trades
 
-        # if ns_to_date(since_ns) == '2024-04-30 18:33:41':
-        #     # self.cache._get_file_path(url)
-        #     breakpoint()
+        # We ask for the next page 1ns before `last`, so the trades of that same
+        # instant that did not fit in this page come in, whether `since` is
+        # inclusive or not. The ones we already have are dropped by `drop_seen`
+        if last_ns - 1 > self.since_ns:
+            self.since_ns = last_ns - 1
+        else:
+            # a whole page of trades at the same instant. Move on, instead of
+            # asking for the same page forever
+            logger.warning(f'The Kraken cursor did not move past {self.since_ns}, skipping 1ns')
+            self.since_ns += 1
 
         return trades
 
+    def skip_to(self, to_ms: int) -> None:
+        """
+        Moves the cursor to `to_ms`, once we returned all the trades before it
+        (for example, from the cache).
+        """
+        self.boundary_ms = to_ms
+        self.boundary_trades = TradeBatch.empty()
+        self.since_ns = to_ms * 1_000_000 - 1
+
+
+class KrakenRestAPIMultipleProducts(TradeSource):
+    """
+    Fetches the historical trades of several products, one product after the other,
+    with one `KrakenRestAPI` per product. All of them share the same rate limiter,
+    because Kraken counts the requests per client, not per product.
+    """
+
+    def __init__(
+        self,
+        product_ids: List[str],
+        last_n_days: int,
+        cache_dir: Optional[str] = None,
+        n_shards: Optional[int] = 1,
+        resume_from_ms: Optional[Dict[str, int]] = None,
+        resume_after_trade_id: Optional[Dict[str, int]] = None,
+    ) -> None:
+        """
+        Args:
+            product_ids (List[str]): The product IDs for which we want to get the trades.
+            last_n_days (int): The number of days from which we want to get historical data.
+            cache_dir (Optional[str]): The directory where we will store the historical data to
+            n_shards (Optional[int]): The number of time shards of each product backfill.
+            resume_from_ms (Optional[Dict[str, int]]): The timestamp of the last trade a
+                previous run produced, per product.
+            resume_after_trade_id (Optional[Dict[str, int]]): The trade id of the last
+                trade a previous run produced, per product.
+
+        Returns:
+            None
+        """
+        self.product_ids = product_ids
+
+        rate_limiter = RateLimiter()
+        self.kraken_apis = [
+            KrakenRestAPI(
+                product_id=product_id,
+                last_n_days=last_n_days,
+                cache_dir=cache_dir,
+                n_shards=n_shards,
+                rate_limiter=rate_limiter,
+                resume_from_ms=(resume_from_ms or {}).get(product_id),
+                resume_after_trade_id=(resume_after_trade_id or {}).get(product_id),
+            )
+            for product_id in product_ids
+        ]
+
+    def get_trades(self) -> TradeBatch:
+        """
+        Returns the next batch of trades of the first product that is not done yet.
+        """
+        for kraken_api in self.kraken_apis:
+            if not kraken_api.is_done():
+                return kraken_api.get_trades()
+
+        return TradeBatch.empty()
+
     def is_done(self) -> bool:
-        # return self._is_done
-        return self.last_trade_ms >= self.to_ms
+        return all(kraken_api.is_done() for kraken_api in self.kraken_apis)
 
 
 class CachedTradeData:
     """
     A class to handle the caching of trade data fetched from the Kraken REST API.
+
+    Trades are stored in one parquet file per product and (UTC) day, and a small
+    index keeps track of the time ranges we have fully fetched:
+
+        cache_dir/
+            index.json              -> {product_id: [[from_ms, to_ms), ...]}
+            ETH-USD/
+                2024-06-17.parquet  -> all the cached ETH/USD trades of that day
+                2024-06-18.parquet
+
+    The cache does not depend on the `since` of the requests, so a restart on a
+    different day, or with a different `last_n_days`, reuses everything we already
+    fetched and only goes to the network for the gaps.
+
+    `write` keeps the pages of a day in memory, and writes the day partition once,
+    when the day is fully covered (or on `flush`), instead of rewriting the whole
+    file after every page. So the ranges of a day only get into the index once
+    its trades are on disk, and a crash loses at most the days in progress, which
+    we fetch again on the next run.
     """
 
+    INDEX_FILE_NAME = 'index.json'
+
     def __init__(self, cache_dir: str) -> None:
         self.cache_dir = Path(cache_dir)
 
@@ -204,55 +676,219 @@ class CachedTradeData:
             # create the cache directory if it does not exist
             self.cache_dir.mkdir(parents=True)
 
-    def read(self, url: str) -> List[Trade]:
+        # the shards of a backfill share the cache
+        self._lock = threading.Lock()
+        self._index = self._load_index()
+
+        # the days we have pages of, but did not write yet, by (product_id, day):
+        # their trades, and the [from_ms, to_ms) ranges they cover
+        self._pending_trades: Dict[Tuple[str, int], List[TradeBatch]] = {}
+        self._pending_ranges: Dict[Tuple[str, int], List[List[int]]] = {}
+
+    def read(self, product_id: str, from_ms: int, to_ms: int) -> TradeBatch:
         """
-        Reads from the cache the trade data for the given url
+        Reads from the cache the trades for the given `product_id` in [from_ms, to_ms)
         """
-        file_path = self._get_file_path(url)
+        import pandas as pd
 
-        if file_path.exists():
-            # read the data from the parquet file
-            import pandas as pd
+        data = []
+        for day in range(from_ms // DAY_MS, (to_ms - 1) // DAY_MS + 1):
+            file_path = self._get_file_path(product_id, day)
+            if not file_path.exists():
+                continue
 
-            data = pd.read_parquet(file_path)
-            # transform the data to a list of Trade objects
-            return [Trade(**trade) for trade in data.to_dict(orient='records')]
+            # one columnar scan for the whole day
+            day_data = pd.read_parquet(file_path)
+            day_data = day_data[
+                (day_data['timestamp_ms'] >= from_ms) & (day_data['timestamp_ms'] < to_ms)
+            ]
+            data.append(day_data)
+
+        if not data:
+            return TradeBatch.empty()
+
+        data = pd.concat(data)
+        # transform the columns into a TradeBatch, without going through one
+        # Python object per trade
+        return TradeBatch.from_columns(
+            product_id=product_id,
+            price=data['price'].to_numpy(),
+            quantity=data['quantity'].to_numpy(),
+            timestamp_ms=data['timestamp_ms'].to_numpy(),
+            # files cached before we kept the trade ids do not have them
+            trade_id=(
+                data['trade_id'].fillna(TradeBatch.NO_TRADE_ID).to_numpy()
+                if 'trade_id' in data else None
+            ),
+        )
 
-        return []
+    def write(self, product_id: str, trades: TradeBatch, from_ms: int, to_ms: int) -> None:
+        """
+        Adds the given trades to the days of `product_id` they belong to, and marks
+        [from_ms, to_ms) as covered once those days are written. The parts of
+        [from_ms, to_ms) that are covered already are left as they are.
 
-    def write(self, url: str, trades: List[Trade]) -> None:
+        `trades` must be all the trades of `product_id` in [from_ms, to_ms), so a
+        range with no trades is cached too.
+        """
+        with self._lock:
+            # a page that starts in a gap can run on into a range a previous run
+            # already cached, so we only add the trades (and the ranges) of the gaps
+            for gap_from_ms, gap_to_ms in self.gaps(product_id, from_ms, to_ms):
+                for day in range(gap_from_ms // DAY_MS, (gap_to_ms - 1) // DAY_MS + 1):
+                    day_from_ms = max(gap_from_ms, day * DAY_MS)
+                    day_to_ms = min(gap_to_ms, (day + 1) * DAY_MS)
+                    key = (product_id, day)
+
+                    in_day = (trades.timestamp_ms >= day_from_ms) & (trades.timestamp_ms < day_to_ms)
+                    self._pending_trades.setdefault(key, []).append(trades[in_day])
+                    self._pending_ranges[key] = merge_ranges(
+                        self._pending_ranges.get(key, []) + [[day_from_ms, day_to_ms]]
+                    )
+
+                    # write the day once we have all of it
+                    covered = merge_ranges(self._index.get(product_id, []) + self._pending_ranges[key])
+                    if any(a <= day * DAY_MS and (day + 1) * DAY_MS <= b for a, b in covered):
+                        self._write_day(key)
+
+    def flush(self) -> None:
         """
-        Saves the given trades to a parquet file in the cache directory.
+        Writes the days we did not write yet, because we do not have all of them.
         """
-        if not trades:
-            return
+        with self._lock:
+            for key in list(self._pending_trades):
+                self._write_day(key)
 
-        # transform the trades to a pandas DataFrame
+    def _write_day(self, key: Tuple[str, int]) -> None:
+        """
+        Writes the pending trades of a (product_id, day) to its partition, and then
+        adds their ranges to the index. Must be called with the lock held.
+        """
         import pandas as pd
 
-        data = pd.DataFrame([trade.model_dump() for trade in trades])
+        product_id, day = key
+        trades = TradeBatch.concat(self._pending_trades.pop(key))
+        ranges = self._pending_ranges.pop(key)
+
+        if len(trades) > 0:
+            # transform the trades to a pandas DataFrame
+            data = pd.DataFrame({
+                'product_id': product_id,
+                'quantity': trades.quantity,
+                'price': trades.price,
+                'timestamp_ms': trades.timestamp_ms,
+                'trade_id': trades.trade_id,
+            })
+            file_path = self._get_file_path(product_id, day)
+
+            # merge with the trades we already have for that day, from a previous
+            # run. `write` only keeps the trades of the gaps, but a day file can still
+            # hold trades of a range that is not in the index (e.g. a crash between
+            # the two writes), so we keep the first copy of every trade id
+            if file_path.exists():
+                data = pd.concat([pd.read_parquet(file_path), data])
+                no_trade_id = data['trade_id'].isna() | (data['trade_id'] == TradeBatch.NO_TRADE_ID)
+                data = data[no_trade_id | ~data.duplicated('trade_id', keep='first')]
+
+            data = data.sort_values('timestamp_ms', kind='stable')
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            # write to a temporary file first, so a crash never leaves a
+            # half-written partition behind
+            tmp_path = file_path.with_suffix('.tmp')
+            data.to_parquet(tmp_path, index=False)
+            tmp_path.replace(file_path)
+
+        # update the index only after the data is on disk
+        self._index[product_id] = merge_ranges(self._index.get(product_id, []) + ranges)
+        self._save_index()
+
+    def covered_until(self, product_id: str, since_ms: int) -> Optional[int]:
+        """
+        Returns the end of the covered range that contains `since_ms`, or None if
+        the cache does not have the trades at `since_ms`.
+        """
+        for from_ms, to_ms in self._index.get(product_id, []):
+            if from_ms <= since_ms < to_ms:
+                return to_ms
+        return None
+
+    def gaps(self, product_id: str, from_ms: int, to_ms: int) -> List[Tuple[int, int]]:
+        """
+        Returns the ranges in [from_ms, to_ms) that are not in the cache yet.
+        """
+        gaps = []
+        for covered_from_ms, covered_to_ms in self._index.get(product_id, []):
+            if covered_to_ms <= from_ms:
+                continue
+            if covered_from_ms >= to_ms:
+                break
+            if covered_from_ms > from_ms:
+                gaps.append((from_ms, covered_from_ms))
+            from_ms = max(from_ms, covered_to_ms)
+
+        if from_ms < to_ms:
+            gaps.append((from_ms, to_ms))
+
+        return gaps
+
+    def _get_file_path(self, product_id: str, day: int) -> Path:
+        """
+        Returns the file path where the trades of `product_id` for the given `day`
+        (days since the Unix epoch) are (or will be) stored.
+        """
+        from datetime import datetime, timezone
 
-        # write the DataFrame to a parquet file
-        file_path = self._get_file_path(url)
-        data.to_parquet(file_path)
+        date = datetime.fromtimestamp(day * DAY_MS / 1000, tz=timezone.utc).strftime('%Y-%m-%d')
+        return self.cache_dir / product_id.replace('/', '-') / f'{date}.parquet'
 
-    def has(self, url: str) -> bool:
+    def _load_index(self) -> dict:
         """
-        Returns True if the cache has the trade data for the given url, False otherwise.
+        Loads the covered ranges from the index file, if there is one.
         """
-        file_path = self._get_file_path(url)
-        return file_path.exists()
+        index_path = self.cache_dir / self.INDEX_FILE_NAME
+        if not index_path.exists():
+            return {}
+        return orjson.loads(index_path.read_bytes())
 
-    def _get_file_path(self, url: str) -> str:
+    def _save_index(self) -> None:
         """
-        Returns the file path where the trade data for the given url is (or will be) stored.
+        Saves the covered ranges to the index file. We write to a temporary file
+        first, so a crash never leaves a half-written index behind.
         """
-        # use the given url to generate a unique file name in a deterministic way
-        import hashlib
+        index_path = self.cache_dir / self.INDEX_FILE_NAME
+        tmp_path = index_path.with_suffix('.tmp')
+        tmp_path.write_bytes(orjson.dumps(self._index))
+        tmp_path.replace(index_path)
+
+
+# milliseconds in a day
+DAY_MS = 24 * 60 * 60 * 1000
 
-        url_hash = hashlib.md5(url.encode()).hexdigest()
-        return self.cache_dir / f'{url_hash}.parquet'
-        # return self.cache_dir / f'{product_id.replace ("/","-")}_{from_ms}.parquet'
+
+def next_midnight_ms(ts: int) -> int:
+    """
+    Returns the first UTC midnight after the timestamp `ts` in Unix milliseconds.
+    """
+    return (ts // DAY_MS + 1) * DAY_MS
+
+
+def merge_ranges(ranges: List[List[int]]) -> List[List[int]]:
+    """
+    Merges overlapping or adjacent [from_ms, to_ms) ranges.
+
+    Args:
+        ranges (List[List[int]]): A list of [from_ms, to_ms) ranges, in any order.
+
+    Returns:
+        List[List[int]]: The sorted list of disjoint ranges that cover the same time.
+    """
+    merged = []
+    for from_ms, to_ms in sorted(ranges):
+        if merged and from_ms <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], to_ms)
+        else:
+            merged.append([from_ms, to_ms])
+    return merged
 
 
 def ts_to_date(ts: int) -> str:
@@ -15,28 +15,36 @@ from loguru import logger
 
 from src.trade_data_source.trade import Trade
 from src.trade_data_source.base import TradeSource
+from src.trade_data_source.fast_decode import parse_iso8601_ms
 
-class KrakenWebsocketAPI:
+class KrakenWebsocketAPI(TradeSource):
     """
-    Class for reading real-time trades from the Kraken Websocket API
+    Class for reading real-time trades from the Kraken Websocket API.
+
+    One instance subscribes to all the given products over a single websocket
+    connection. Kraken tags every trade with its `symbol`, which we use as the
+    product id (and Kafka message key) of the trade.
     """
     URL = 'wss://ws.kraken.com/v2' 
 
-    def __init__(self, product_id: str):
+    def __init__(self, product_ids: List[str]):
         """
             Initializes the KrakenWebsocketAPI instance
 
             Args:
-                product_id (str): The product id to get the trades from
+                product_ids (List[str]): The product ids to get the trades from
         """
-        self.product_id = product_id
+        self.product_ids = product_ids
+
+        # trades we received while waiting for the subscription acks
+        self._pending_trades: List[Trade] = []
 
         # establish connection to the Kraken websocket API -> "Subscribing"
         self._ws = create_connection(self.URL)
         logger.debug('Connection established')
 
-        # subscribe to the trades for the given `product_id`
-        self._subscribe(product_id)
+        # subscribe to the trades for the given `product_ids`
+        self._subscribe(product_ids)
 
     def get_trades(self) -> List[Trade]:
         """
@@ -48,6 +56,9 @@ class KrakenWebsocketAPI:
             Returns
                 List[Trade]: A list of Trade objects
         """
+        if self._pending_trades:
+            trades, self._pending_trades = self._pending_trades, []
+            return trades
 
         message = self._ws.recv()
 
@@ -59,6 +70,61 @@ class KrakenWebsocketAPI:
         # parse the message string as a dictionary
         message = json.loads(message)
 
+        return self.parse_trades(message)
+
+    def is_done(self) -> bool:
+        """
+            Returns True if the KrakenWebsocketAPI instance is done
+        """
+        return False
+    
+    def _subscribe(self, product_ids: List[str]):
+        """
+        Establish connection to the Kraken websocket API and subscribe to the trades
+        for all the given `product_ids` with a single message.
+        """
+        logger.info(f'Subscribing to trades for {product_ids}')
+        # let's subscribe to the trades for the given `product_ids`
+        msg = {
+            'method': 'subscribe',
+            'params': {
+                'channel': 'trade',
+                'symbol': product_ids,
+                'snapshot': False,
+            },
+        }
+        self._ws.send(json.dumps(msg))
+
+        # Kraken acknowledges the subscription of each symbol with its own message,
+        # like {'method': 'subscribe', 'result': {'symbol': 'ETH/USD', ...}, 'success': True}
+        # Other messages (status, heartbeats, and trades of the symbols that are
+        # already subscribed) can arrive in between, so we wait until every symbol
+        # is acknowledged, and keep the trades for the first call to `get_trades`
+        pending_acks = set(product_ids)
+        while pending_acks:
+            message = json.loads(self._ws.recv())
+
+            if message.get('method') == 'subscribe':
+                symbol = message.get('result', {}).get('symbol')
+                if not message.get('success'):
+                    raise ValueError(
+                        f'Kraken rejected the subscription to {symbol}: {message.get("error")}'
+                    )
+                logger.info(f'Subscription to {symbol} worked!')
+                pending_acks.discard(symbol)
+                continue
+
+            self._pending_trades.extend(self.parse_trades(message))
+
+    @classmethod
+    def parse_trades(cls, message: dict) -> List[Trade]:
+        """
+        Returns the trades in the given websocket message, which can hold the trades
+        of any of the symbols we subscribed to. Non-trade messages have none.
+        """
+        if message.get('channel') != 'trade':
+            return []
+
         # extract trades from the message['data'] field
         trades = []
         for trade in message['data']:
@@ -75,42 +141,13 @@ class KrakenWebsocketAPI:
                     product_id=trade['symbol'],
                     price=trade['price'],
                     quantity=trade['qty'],
-                    timestamp_ms=self.to_ms(trade['timestamp']),
+                    timestamp_ms=cls.to_ms(trade['timestamp']),
+                    trade_id=trade.get('trade_id'),
                 )
             )
             
         return trades
 
-    def is_done(self) -> bool:
-        """
-            Returns True if the KrakenWebsocketAPI instance is done
-        """
-        False
-    
-    def _subscribe(self, product_id: str):
-        """
-        Establish connection to the Kraken websocket API and subscribe to the trades for the given `product_id`.
-        """
-        logger.info(f'Subscribing to trades for {product_id}')
-        # let's subscribe to the trades for the given `product_id`
-        msg = {
-            'method': 'subscribe',
-            'params': {
-                'channel': 'trade',
-                'symbol': [product_id],
-                'snapshot': False,
-            },
-        }
-        self._ws.send(json.dumps(msg))
-        logger.info('Subscription worked!')
-
-        # For each product_id we dump
-        # the first 2 messages we got from the websocket, because they contain
-        # no trade data, just confirmation on their end that the subscription was successful
-        for product_id in [product_id]:
-            _ = self._ws.recv()
-            _ = self._ws.recv()
-
     @staticmethod
     def to_ms(timestamp: str) -> int:
         """
@@ -125,10 +162,5 @@ class KrakenWebsocketAPI:
             int: A timestamp expressed in milliseconds.
         """
         # parse a string like this '2024-06-17T09:36:39.467866Z'
-        # into a datetime object assuming UTC timezone
-        # and then transform this datetime object into Unix timestamp
-        # expressed in milliseconds
-        from datetime import datetime, timezone
-
-        timestamp = datetime.fromisoformat(timestamp[:-1]).replace(tzinfo=timezone.utc)
-        return int(timestamp.timestamp() * 1000)
\ No newline at end of file
+        # field by field, without building a datetime object for every trade
+        return parse_iso8601_ms(timestamp)
\ No newline at end of file
@@ -0,0 +1,329 @@
+import asyncio
+import json
+import orjson
+import random
+import threading
+import time
+from queue import Empty, Full, Queue
+from typing import List, Optional
+
+import websockets
+from loguru import logger
+
+from src.trade_data_source.base import TradeSource
+from src.trade_data_source.fast_decode import trade_batch_from_message
+from src.trade_data_source.kraken_websocket_api import KrakenWebsocketAPI
+from src.trade_data_source.trade_batch import TradeBatch
+
+# what decoding a malformed frame raises, on the fast path (no validation) or in
+# pydantic (its ValidationError is a ValueError)
+BAD_FRAME_ERRORS = (ValueError, KeyError, TypeError, IndexError, AttributeError)
+
+
+class KrakenWebsocketAPIAsync(TradeSource):
+    """
+    Reads real-time trades from the Kraken Websocket API on a background asyncio
+    task, so a slow produce or flush to Kafka never stalls the socket reads.
+
+    - The reader task pushes the trade frames into a bounded queue. If the queue is
+      full (the consumer fell behind) the oldest frame is dropped and counted.
+    - When the connection drops, or Kraken closes it, the reader reconnects and
+      resubscribes with exponential backoff and jitter, instead of killing the
+      service. `wait_until_subscribed` waits for the acks of the new connection.
+    - A frame we can not decode is logged, counted and skipped. Any other error
+      stops the reader, and `get_trades` raises it once the queued frames are
+      consumed. So does a rejected subscription.
+    - Frames whose last trade is older than `late_frame_ms` when we read them off
+      the socket are counted as late.
+
+    `queue_depth`, `dropped_frames`, `late_frames`, `bad_frames` and `reconnects`
+    expose these numbers, and the reader logs them every `stats_every_sec` seconds.
+
+    Frames are decoded on the fast path (see `src.trade_data_source.fast_decode`)
+    into `TradeBatch`es. With `strict_validation=True` every trade goes through the
+    pydantic `Trade` model first, which is slower but useful to debug bad frames.
+    """
+    URL = 'wss://ws.kraken.com/v2'
+
+    def __init__(
+        self,
+        product_ids: List[str],
+        queue_size: int = 10_000,
+        late_frame_ms: int = 5_000,
+        max_backoff_sec: float = 60.0,
+        stats_every_sec: float = 60.0,
+        strict_validation: bool = False,
+    ):
+        """
+        Starts the background reader. It connects and subscribes on its own.
+
+        Args:
+            product_ids (List[str]): The product ids to get the trades from
+            queue_size (int): The max number of frames waiting for `get_trades`
+            late_frame_ms (int): How old the trades of a frame can be before we count
+                the frame as late
+            max_backoff_sec (float): The max time we wait between two reconnects
+            stats_every_sec (float): How often the reader logs its stats
+            strict_validation (bool): Whether to validate every trade with pydantic
+
+        Returns:
+            None
+        """
+        self.product_ids = product_ids
+        self.late_frame_ms = late_frame_ms
+        self.max_backoff_sec = max_backoff_sec
+        self.stats_every_sec = stats_every_sec
+        self.strict_validation = strict_validation
+
+        self._queue: Queue = Queue(maxsize=queue_size)
+
+        self.dropped_frames = 0
+        self.late_frames = 0
+        self.bad_frames = 0
+        self.reconnects = 0
+
+        # the error that stopped the reader, for `get_trades` to raise
+        self._error: Optional[BaseException] = None
+
+        # the products Kraken acknowledged our subscription to
+        self._subscribed = set()
+        self._all_subscribed = threading.Event()
+
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._read,
+            name='kraken-websocket-reader',
+            daemon=True,
+        )
+        self._thread.start()
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        The number of frames waiting for `get_trades`
+        """
+        return self._queue.qsize()
+
+    def get_trades(self, timeout_sec: float = 1.0) -> TradeBatch:
+        """
+        Returns the trades of all the frames in the queue, waiting up to
+        `timeout_sec` for the first one.
+
+        Args:
+            timeout_sec (float): How long we wait for a frame if the queue is empty
+
+        Returns:
+            TradeBatch: The trades, empty if no frame arrived in time
+
+        Raises:
+            RuntimeError: If the reader stopped on an error, once the frames it
+                queued before are consumed
+        """
+        if self._queue.empty():
+            self._check()
+
+        try:
+            batches = [self._queue.get(timeout=timeout_sec)]
+        except Empty:
+            self._check()
+            return TradeBatch.empty()
+
+        # take everything else that is already waiting, so we produce in batches
+        # when we fall behind
+        while True:
+            try:
+                batches.append(self._queue.get_nowait())
+            except Empty:
+                break
+
+        return TradeBatch.concat(batches)
+
+    def wait_until_subscribed(self, timeout_sec: float) -> bool:
+        """
+        Waits until Kraken acknowledged the subscription to all our products.
+
+        Args:
+            timeout_sec (float): How long we wait.
+
+        Returns:
+            bool: True if we are subscribed to all the products, False on timeout.
+
+        Raises:
+            RuntimeError: If the reader stopped on an error, like a rejected
+                subscription
+        """
+        deadline = time.monotonic() + timeout_sec
+        while not self._all_subscribed.wait(timeout=min(0.1, timeout_sec)):
+            self._check()
+            if time.monotonic() >= deadline:
+                return False
+        return True
+
+    def is_done(self) -> bool:
+        """
+        Returns True once the source is closed
+        """
+        return self._stopped.is_set()
+
+    def close(self) -> None:
+        """
+        Stops the background reader
+        """
+        self._stopped.set()
+
+    def _check(self) -> None:
+        """
+        Raises the error that stopped the reader, if any.
+        """
+        if self._error is not None:
+            raise RuntimeError(f'The Kraken websocket reader stopped: {self._error!r}') from self._error
+
+    def _read(self) -> None:
+        """
+        Runs the reader, and keeps the error that stopped it for `get_trades`,
+        instead of letting the thread die silently.
+        """
+        try:
+            asyncio.run(self._run())
+        except BaseException as e:
+            logger.exception('The Kraken websocket reader stopped')
+            self._error = e
+
+    async def _run(self) -> None:
+        """
+        Connects, subscribes and reads frames until the source is closed,
+        reconnecting with backoff when the connection drops or is closed.
+        """
+        n_failures = 0
+        last_stats_time = time.monotonic()
+
+        while not self._stopped.is_set():
+            try:
+                async with websockets.connect(self.URL, ping_interval=20) as ws:
+                    await self._subscribe(ws)
+
+                    async for frame in ws:
+                        try:
+                            has_trades = self._on_frame(frame)
+                        except BAD_FRAME_ERRORS as e:
+                            # a frame we can not decode must not stop the reader
+                            self.bad_frames += 1
+                            logger.error(f'Skipping a bad frame ({e!r}): {frame[:200]!r}')
+                            continue
+
+                        # the connection works, so the next drop starts the
+                        # backoff from scratch
+                        if has_trades:
+                            n_failures = 0
+
+                        if time.monotonic() - last_stats_time > self.stats_every_sec:
+                            self._log_stats()
+                            last_stats_time = time.monotonic()
+
+                        if self._stopped.is_set():
+                            return
+
+                reason = 'closed by Kraken'
+
+            except (websockets.WebSocketException, OSError, asyncio.TimeoutError) as e:
+                reason = f'lost ({e})'
+
+            if self._stopped.is_set():
+                return
+
+            # the acks were for the connection we lost. Kraken acks the products
+            # again after we resubscribe on the new one
+            self._subscribed.clear()
+            self._all_subscribed.clear()
+
+            n_failures += 1
+            self.reconnects += 1
+
+            # exponential backoff with jitter, so we do not hammer Kraken
+            # while it is having trouble
+            backoff_sec = min(self.max_backoff_sec, 2 ** (n_failures - 1))
+            backoff_sec = backoff_sec / 2 + random.random() * backoff_sec / 2
+            logger.warning(
+                f'Websocket connection {reason}. Reconnecting in {backoff_sec:.1f} seconds'
+            )
+            await asyncio.sleep(backoff_sec)
+
+    async def _subscribe(self, ws) -> None:
+        """
+        Subscribes to the trades of all our `product_ids`. The acks are handled
+        as they come, in `_on_frame`.
+        """
+        logger.info(f'Subscribing to trades for {self.product_ids}')
+        await ws.send(json.dumps({
+            'method': 'subscribe',
+            'params': {
+                'channel': 'trade',
+                'symbol': self.product_ids,
+                'snapshot': False,
+            },
+        }))
+
+    def _on_frame(self, frame: str) -> bool:
+        """
+        Handles one frame from the websocket: logs the subscription acks, skips
+        heartbeats and status messages, and queues the trades of the trade frames.
+
+        Returns:
+            bool: Whether the frame had trades.
+
+        Raises:
+            RuntimeError: If Kraken rejected the subscription to one of our products.
+            BAD_FRAME_ERRORS: If the frame is malformed.
+        """
+        message = orjson.loads(frame)
+
+        if message.get('method') == 'subscribe':
+            symbol = message.get('result', {}).get('symbol')
+            if not message.get('success'):
+                # like the sync source, we do not run with products missing
+                raise RuntimeError(
+                    f'Kraken rejected the subscription to {symbol}: {message.get("error")}'
+                )
+            logger.info(f'Subscription to {symbol} worked!')
+            self._subscribed.add(symbol)
+            if self._subscribed.issuperset(self.product_ids):
+                self._all_subscribed.set()
+            return False
+
+        if message.get('channel') != 'trade' or not message.get('data'):
+            return False
+
+        if self.strict_validation:
+            trades = TradeBatch.from_trades(KrakenWebsocketAPI.parse_trades(message))
+        else:
+            trades = trade_batch_from_message(message)
+
+        if time.time() * 1000 - trades.timestamp_ms[-1] > self.late_frame_ms:
+            self.late_frames += 1
+
+        self._put(trades)
+        return True
+
+    def _put(self, trades: TradeBatch) -> None:
+        """
+        Puts a frame into the queue, dropping the oldest frame if the queue is full,
+        so the reader never blocks on a slow consumer.
+        """
+        while True:
+            try:
+                self._queue.put_nowait(trades)
+                return
+            except Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped_frames += 1
+                except Empty:
+                    pass
+
+    def _log_stats(self) -> None:
+        logger.info(
+            f'Websocket stats: queue_depth={self.queue_depth}, '
+            f'dropped_frames={self.dropped_frames}, late_frames={self.late_frames}, '
+            f'bad_frames={self.bad_frames}, '
+            f'reconnects={self.reconnects}',
+        )
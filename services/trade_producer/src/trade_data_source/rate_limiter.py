@@ -0,0 +1,182 @@
+import random
+import threading
+import time
+from typing import Callable
+
+from loguru import logger
+
+
+class RateLimiter:
+    """
+    Adaptive token-bucket rate limiter that mirrors how Kraken throttles API calls.
+
+    Kraken keeps a call counter per client. Every request adds its `cost` to the
+    counter, and the counter decays at `decay_per_sec`. When a request would push the
+    counter above `max_counter`, the API answers with 'EGeneral:Too many requests'.
+
+    This class keeps a local copy of that counter and makes `acquire` wait just long
+    enough to stay `headroom` calls below the limit. When the API still throttles us
+    (e.g. because another process shares the same IP) `on_error` does two things:
+    - backs off exponentially, with jitter, and
+    - lowers the decay rate we assume, which then creeps back up after a streak of
+      successful requests.
+
+    The clock and the sleep function can be injected, so the limiter can be driven
+    by a fake clock in benchmarks.
+
+    One instance can be shared by several threads (e.g. the shards of a backfill),
+    and by any `TradeSource` that talks to a rate limited API.
+    """
+
+    def __init__(
+        self,
+        max_counter: float = 15.0,
+        decay_per_sec: float = 1.0,
+        headroom: float = 1.0,
+        base_backoff_sec: float = 1.0,
+        max_backoff_sec: float = 60.0,
+        successes_to_recover: int = 20,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+        rng: Callable[[], float] = random.random,
+    ) -> None:
+        """
+        Args:
+            max_counter (float): The max value of the call counter before the API throttles us.
+            decay_per_sec (float): How much the call counter decreases every second,
+                according to the API docs.
+            headroom (float): How many calls below `max_counter` we want to stay.
+            base_backoff_sec (float): The backoff after the first error in a row.
+            max_backoff_sec (float): The upper bound for the backoff.
+            successes_to_recover (int): The number of successful requests in a row after
+                which we move the assumed decay rate back towards `decay_per_sec`.
+            clock (Callable[[], float]): Returns the current time in seconds.
+            sleep (Callable[[float], None]): Sleeps for the given number of seconds.
+            rng (Callable[[], float]): Returns a random float in [0, 1), used for the jitter.
+
+        Returns:
+            None
+        """
+        self.max_counter = max_counter
+        self.decay_per_sec = decay_per_sec
+        self.base_backoff_sec = base_backoff_sec
+        self.max_backoff_sec = max_backoff_sec
+        self.successes_to_recover = successes_to_recover
+
+        self._clock = clock
+        self._sleep = sleep
+        self._rng = rng
+        self._lock = threading.Lock()
+
+        # the limit we aim for, `headroom` calls below the API limit
+        self._ceiling = max_counter - headroom
+
+        # the decay rate we assume. It starts at the documented one and adapts to
+        # the errors we get
+        self._decay_per_sec = decay_per_sec
+
+        # our estimate of Kraken's call counter, and the last time we updated it
+        self._counter = 0.0
+        self._last_update = clock()
+
+        # no request is allowed before this time, while we are backing off
+        self._blocked_until = 0.0
+        self._consecutive_errors = 0
+        self._consecutive_successes = 0
+
+    def acquire(self, cost: float = 1.0) -> float:
+        """
+        Blocks until a request of the given `cost` fits in the budget, and books it.
+
+        Args:
+            cost (float): How much the request adds to the call counter.
+
+        Returns:
+            float: The number of seconds we waited.
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = self._decay()
+                wait_sec = max(
+                    self._blocked_until - now,
+                    (self._counter + cost - self._ceiling) / self._decay_per_sec,
+                )
+                # tolerate float rounding, so we never spin on sub-nanosecond sleeps
+                if wait_sec <= 1e-9:
+                    self._counter += cost
+                    return waited
+
+            self._sleep(wait_sec)
+            waited += wait_sec
+
+    def on_success(self) -> None:
+        """
+        Tells the limiter that the last request went through.
+        """
+        with self._lock:
+            self._consecutive_errors = 0
+            self._consecutive_successes += 1
+
+            if self._consecutive_successes >= self.successes_to_recover:
+                # additive increase
+                self._decay_per_sec = min(
+                    self.decay_per_sec, self._decay_per_sec + 0.05 * self.decay_per_sec
+                )
+                self._consecutive_successes = 0
+
+    def on_error(self) -> float:
+        """
+        Tells the limiter that the API throttled the last request.
+
+        Returns:
+            float: The number of seconds the next `acquire` will wait, at least.
+        """
+        with self._lock:
+            now = self._decay()
+            self._consecutive_errors += 1
+            self._consecutive_successes = 0
+
+            # the API says we are at the limit, so our counter estimate was too low,
+            # and the counter decays slower than we think (multiplicative decrease)
+            self._counter = max(self._counter, self.max_counter)
+            self._decay_per_sec = max(0.1 * self.decay_per_sec, 0.8 * self._decay_per_sec)
+
+            # exponential backoff with "equal jitter": at least half of the backoff,
+            # so we do slow down, and a random other half, so several clients that
+            # got throttled at the same time do not retry at the same time
+            backoff_sec = min(
+                self.max_backoff_sec,
+                self.base_backoff_sec * 2 ** (self._consecutive_errors - 1),
+            )
+            backoff_sec = backoff_sec / 2 + self._rng() * backoff_sec / 2
+            self._blocked_until = max(self._blocked_until, now + backoff_sec)
+
+        logger.info(
+            f'Rate limited by the API ({self._consecutive_errors} errors in a row). '
+            f'Backing off for {backoff_sec:.2f} seconds'
+        )
+        return backoff_sec
+
+    @property
+    def counter(self) -> float:
+        """
+        Our current estimate of the API call counter.
+        """
+        with self._lock:
+            self._decay()
+            return self._counter
+
+    def _decay(self) -> float:
+        """
+        Applies the counter decay since the last update. Must be called with the lock held.
+
+        Returns:
+            float: The current time.
+        """
+        now = self._clock()
+        elapsed = now - self._last_update
+        if elapsed > 0:
+            self._counter = max(0.0, self._counter - elapsed * self._decay_per_sec)
+            self._last_update = now
+        return now
@@ -0,0 +1,212 @@
+import time
+from pathlib import Path
+from typing import Iterator, List, Optional
+
+import numpy as np
+from loguru import logger
+
+from src.trade_data_source.base import TradeSource
+from src.trade_data_source.trade_batch import TradeBatch
+
+
+class ReplayTradeSource(TradeSource):
+    """
+    Replays trades from local parquet or CSV files, to load-test the services
+    downstream without hitting Kraken.
+
+    `path` can be
+    - one .parquet or .csv file, or
+    - a directory, like the `cache_dir` of the `KrakenRestAPI`. The files of each
+      subdirectory (one per product in the cache) are read in name order, which is
+      day order for the cache, and the subdirectories are merged by timestamp.
+
+    Files need the columns `product_id`, `price`, `quantity` and `timestamp_ms`, and
+    optionally `trade_id`, with the trades of each file sorted by timestamp.
+
+    Files are never loaded whole: parquet files are memory-mapped and read one
+    record batch at a time, and CSV files in chunks, so the memory we use depends on
+    `batch_size` and the number of products, not on the size of the replay.
+
+    `speed` paces the replay on the trade timestamps: 1 is real time, 10 is 10x
+    faster than real time, and 0 is as fast as we can read.
+    """
+
+    # max time we block in `get_trades` waiting for the next trade to be due
+    MAX_WAIT_SEC = 1.0
+
+    def __init__(
+        self,
+        path: str,
+        product_ids: Optional[List[str]] = None,
+        speed: float = 0.0,
+        batch_size: int = 10_000,
+    ) -> None:
+        """
+        Args:
+            path (str): The file or directory with the trades to replay.
+            product_ids (Optional[List[str]]): The products we replay. None means all.
+            speed (float): How fast we replay, relative to real time. 0 means as
+                fast as possible.
+            batch_size (int): The max number of rows we read from a file at once.
+
+        Returns:
+            None
+        """
+        self.path = Path(path)
+        self.product_ids = product_ids
+        self.speed = speed
+        self.batch_size = batch_size
+
+        # one iterator of TradeBatches per group of files, and the trades we
+        # read from each one and did not merge yet
+        self._streams = [self._read_files(files) for files in self._group_files()]
+        self._heads = [TradeBatch.empty() for _ in self._streams]
+        self._exhausted = [False for _ in self._streams]
+
+        # merged trades, in timestamp order, waiting to be due
+        self._ready = TradeBatch.empty()
+
+        # wall clock time and trade timestamp at the start of the replay
+        self._start_time: Optional[float] = None
+        self._start_ms: Optional[int] = None
+
+        logger.info(
+            f'Replaying {len(self._streams)} file group(s) from {self.path} at '
+            + ('full speed' if speed <= 0 else f'{speed}x real time')
+        )
+
+    def get_trades(self) -> TradeBatch:
+        """
+        Returns the next trades that are due, waiting up to `MAX_WAIT_SEC` for them.
+
+        Returns:
+            TradeBatch: The trades, sorted by timestamp. It can be empty.
+        """
+        if len(self._ready) == 0:
+            self._ready = self._merge_next()
+
+        if len(self._ready) == 0 or self.speed <= 0:
+            trades, self._ready = self._ready, TradeBatch.empty()
+            return trades
+
+        if self._start_time is None:
+            self._start_time = time.monotonic()
+            self._start_ms = int(self._ready.timestamp_ms[0])
+
+        # how far the replay clock is, in trade time
+        replay_ms = self._replay_ms()
+        wait_sec = (self._ready.timestamp_ms[0] - replay_ms) / 1000 / self.speed
+        if wait_sec > 0:
+            time.sleep(min(wait_sec, self.MAX_WAIT_SEC))
+            replay_ms = self._replay_ms()
+
+        n_due = int(np.searchsorted(self._ready.timestamp_ms, replay_ms, side='right'))
+        trades, self._ready = self._ready[:n_due], self._ready[n_due:]
+        return trades
+
+    def is_done(self) -> bool:
+        return (
+            all(self._exhausted)
+            and all(len(head) == 0 for head in self._heads)
+            and len(self._ready) == 0
+        )
+
+    def _replay_ms(self) -> float:
+        return self._start_ms + (time.monotonic() - self._start_time) * 1000 * self.speed
+
+    def _merge_next(self) -> TradeBatch:
+        """
+        Merges the next trades of all the file groups in timestamp order.
+
+        We can only merge the trades up to the watermark, the smallest last timestamp
+        of the groups that have more trades to read: any trade after it could still
+        come after a trade we have not read yet.
+        """
+        for i, stream in enumerate(self._streams):
+            while len(self._heads[i]) == 0 and not self._exhausted[i]:
+                head = next(stream, None)
+                if head is None:
+                    self._exhausted[i] = True
+                else:
+                    self._heads[i] = head
+
+        watermarks = [
+            int(head.timestamp_ms[-1])
+            for head, exhausted in zip(self._heads, self._exhausted)
+            if not exhausted
+        ]
+        watermark = min(watermarks) if watermarks else None
+
+        parts = []
+        for i, head in enumerate(self._heads):
+            if watermark is None:
+                parts.append(head)
+                self._heads[i] = TradeBatch.empty()
+            else:
+                due = head.timestamp_ms <= watermark
+                parts.append(head[due])
+                self._heads[i] = head[~due]
+
+        trades = TradeBatch.concat(parts)
+        return trades[np.argsort(trades.timestamp_ms, kind='stable')]
+
+    def _group_files(self) -> List[List[Path]]:
+        """
+        Returns the files to replay, grouped by directory and sorted by name.
+        """
+        if self.path.is_file():
+            return [[self.path]]
+
+        groups = {}
+        for file_path in sorted(self.path.rglob('*')):
+            if file_path.suffix not in ('.parquet', '.csv'):
+                continue
+            groups.setdefault(file_path.parent, []).append(file_path)
+
+        if not groups:
+            raise ValueError(f'No parquet or CSV files to replay in {self.path}')
+
+        return list(groups.values())
+
+    def _read_files(self, files: List[Path]) -> Iterator[TradeBatch]:
+        """
+        Yields the trades of the given files, one chunk at a time.
+        """
+        import pandas as pd
+        import pyarrow.parquet as pq
+
+        for file_path in files:
+            if file_path.suffix == '.parquet':
+                parquet_file = pq.ParquetFile(file_path, memory_map=True)
+                chunks = (
+                    record_batch.to_pandas()
+                    for record_batch in parquet_file.iter_batches(batch_size=self.batch_size)
+                )
+            else:
+                chunks = pd.read_csv(file_path, chunksize=self.batch_size)
+
+            for data in chunks:
+                if self.product_ids is not None:
+                    data = data[data['product_id'].isin(self.product_ids)]
+                if len(data) > 0:
+                    yield self._to_trade_batch(data)
+
+    @staticmethod
+    def _to_trade_batch(data) -> TradeBatch:
+        """
+        Transforms a chunk of a file (a pandas DataFrame) into a TradeBatch.
+        """
+        import pandas as pd
+
+        product_codes, product_ids = pd.factorize(data['product_id'])
+        return TradeBatch(
+            product_ids=list(product_ids),
+            product_codes=product_codes,
+            price=data['price'].to_numpy(),
+            quantity=data['quantity'].to_numpy(),
+            timestamp_ms=data['timestamp_ms'].to_numpy(),
+            trade_id=(
+                data['trade_id'].fillna(TradeBatch.NO_TRADE_ID).to_numpy()
+                if 'trade_id' in data else None
+            ),
+        )
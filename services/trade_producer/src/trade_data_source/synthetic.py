@@ -0,0 +1,165 @@
+import time
+from typing import List, Optional
+
+import numpy as np
+from loguru import logger
+
+from src.trade_data_source.base import TradeSource
+from src.trade_data_source.trade_batch import TradeBatch
+
+
+class SyntheticTradeSource(TradeSource):
+    """
+    Generates realistic-looking trades at a target rate, to stress test the pipeline
+    far above what Kraken sends us.
+
+    Every `tick_sec` we generate, in one vectorized go, the trades of the time that
+    passed since the previous tick:
+    - arrivals are bursty: the number of trades of a tick is Poisson, with a rate
+      that changes from tick to tick around `trades_per_sec`
+    - some products trade more than others (Zipf-like weights)
+    - prices follow a geometric random walk per product, and quantities are lognormal
+    - optionally, a fraction of the trades is late: their timestamp is up to
+      `max_lateness_ms` in the past, so they arrive out of order
+
+    If producing to Kafka takes longer than a tick, the next batch is bigger, so we
+    keep the target rate for as long as the producer can.
+    """
+
+    def __init__(
+        self,
+        product_ids: List[str],
+        trades_per_sec: float = 10_000,
+        duration_sec: Optional[float] = None,
+        late_fraction: float = 0.0,
+        max_lateness_ms: int = 10_000,
+        burstiness: float = 0.5,
+        volatility: float = 1e-4,
+        tick_sec: float = 0.1,
+        seed: Optional[int] = None,
+    ) -> None:
+        """
+        Args:
+            product_ids (List[str]): The products we generate trades for.
+            trades_per_sec (float): The target rate, for all the products together.
+            duration_sec (Optional[float]): How long we generate trades. None means forever.
+            late_fraction (float): The fraction of trades that arrive late.
+            max_lateness_ms (int): How late a late trade can be.
+            burstiness (float): How much the rate changes from tick to tick. 0 means
+                a constant rate.
+            volatility (float): The standard deviation of the log return per trade.
+            tick_sec (float): How often we generate a batch of trades.
+            seed (Optional[int]): The seed of the random generator.
+
+        Returns:
+            None
+        """
+        self.product_ids = product_ids
+        self.trades_per_sec = trades_per_sec
+        self.duration_sec = duration_sec
+        self.late_fraction = late_fraction
+        self.max_lateness_ms = max_lateness_ms
+        self.burstiness = burstiness
+        self.volatility = volatility
+        self.tick_sec = tick_sec
+
+        self._rng = np.random.default_rng(seed)
+
+        n_products = len(product_ids)
+        weights = 1 / np.arange(1, n_products + 1)
+        self._product_weights = weights / weights.sum()
+        self._log_price = np.log(self._rng.uniform(1, 5000, n_products))
+        self._next_trade_id = 0
+
+        self._start_time = time.monotonic()
+        self._last_tick_ms = int(time.time() * 1000)
+
+        logger.info(
+            f'Generating {trades_per_sec:,.0f} trades/s for {n_products} products'
+            + (f' during {duration_sec} seconds' if duration_sec else '')
+        )
+
+    def get_trades(self) -> TradeBatch:
+        """
+        Waits for the next tick, and returns the trades generated since the last one.
+
+        Returns:
+            TradeBatch: The trades, in arrival order.
+        """
+        now_ms = int(time.time() * 1000)
+        wait_ms = self._last_tick_ms + self.tick_sec * 1000 - now_ms
+        if wait_ms > 0:
+            time.sleep(wait_ms / 1000)
+            now_ms = int(time.time() * 1000)
+
+        trades = self.generate(self._last_tick_ms, now_ms)
+        self._last_tick_ms = now_ms
+        return trades
+
+    def is_done(self) -> bool:
+        if self.duration_sec is None:
+            return False
+        return time.monotonic() - self._start_time >= self.duration_sec
+
+    def generate(self, from_ms: int, to_ms: int) -> TradeBatch:
+        """
+        Generates the trades that arrive in [from_ms, to_ms).
+
+        Args:
+            from_ms (int): The start of the time range, in Unix milliseconds.
+            to_ms (int): The end of the time range, in Unix milliseconds.
+
+        Returns:
+            TradeBatch: The trades, in arrival order.
+        """
+        rng = self._rng
+        n_products = len(self.product_ids)
+
+        # bursty arrivals: a Poisson number of trades, with a gamma-distributed rate
+        # (mean `trades_per_sec`) that changes on every tick
+        rate = self.trades_per_sec
+        if self.burstiness > 0:
+            shape = 1 / self.burstiness**2
+            rate *= rng.gamma(shape, 1 / shape)
+        n_trades = rng.poisson(rate * (to_ms - from_ms) / 1000)
+        if n_trades == 0:
+            return TradeBatch.empty()
+
+        timestamp_ms = np.sort(rng.integers(from_ms, max(to_ms, from_ms + 1), n_trades))
+        product_codes = rng.choice(n_products, size=n_trades, p=self._product_weights)
+
+        # geometric random walk per product: cumulative sums of the log returns,
+        # restarted at the start of each product's group of trades
+        order = np.argsort(product_codes, kind='stable')
+        codes = product_codes[order]
+        returns = rng.normal(0, self.volatility, n_trades)
+        walk = np.cumsum(returns)
+        counts = np.bincount(codes, minlength=n_products)
+        starts = np.minimum(np.cumsum(counts) - counts, n_trades - 1)
+        walk_before_group = np.repeat(walk[starts] - returns[starts], counts)
+        log_price = self._log_price[codes] + walk - walk_before_group
+
+        traded = counts > 0
+        self._log_price[traded] = log_price[(np.cumsum(counts) - 1)[traded]]
+
+        price = np.empty(n_trades)
+        price[order] = np.round(np.exp(log_price), 2)
+        quantity = np.round(rng.lognormal(-2, 1.5, n_trades), 8)
+
+        if self.late_fraction > 0:
+            # late trades keep their place in the arrival order, with an older timestamp
+            late = rng.random(n_trades) < self.late_fraction
+            timestamp_ms[late] -= rng.integers(1, self.max_lateness_ms + 1, late.sum())
+
+        trade_id = self._next_trade_id + np.arange(n_trades)
+        self._next_trade_id += n_trades
+
+        return TradeBatch(
+            product_ids=self.product_ids,
+            product_codes=product_codes,
+            price=np.maximum(price, 0.01),
+            quantity=quantity,
+            timestamp_ms=timestamp_ms,
+            trade_id=trade_id,
+            validate=False,
+        )
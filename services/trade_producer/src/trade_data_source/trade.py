@@ -1,7 +1,11 @@
+from typing import Optional
+
 from pydantic import BaseModel
 
 class Trade(BaseModel):
     product_id: str
     quantity: float
     price: float
-    timestamp_ms: int
\ No newline at end of file
+    timestamp_ms: int
+    # the id Kraken gives the trade, unique (and increasing) per product
+    trade_id: Optional[int] = None
@@ -0,0 +1,241 @@
+import sys
+from typing import Iterator, List, Optional, Sequence, Union
+
+import numpy as np
+import orjson
+
+from src.trade_data_source.trade import Trade
+from src.wire_format import encode_trades
+
+
+class TradeBatch:
+    """
+    A batch of trades stored column by column in NumPy arrays.
+
+    It holds the same data as a list of `Trade` objects, without one Python object
+    (and one pydantic validation) per trade:
+    - `price`, `quantity`, `timestamp_ms` and `trade_id` are NumPy arrays, one
+      element per trade. Trades without a Kraken trade id have `NO_TRADE_ID`.
+    - product ids are interned: `product_ids` holds each distinct product id once,
+      and `product_codes` holds, for each trade, the index of its product id.
+
+    The whole batch is validated once, when it is created.
+    """
+
+    __slots__ = ('product_ids', 'product_codes', 'price', 'quantity', 'timestamp_ms', 'trade_id')
+
+    # the trade_id of the trades we do not know the Kraken trade id of
+    NO_TRADE_ID = -1
+
+    def __init__(
+        self,
+        product_ids: Sequence[str],
+        product_codes: np.ndarray,
+        price: np.ndarray,
+        quantity: np.ndarray,
+        timestamp_ms: np.ndarray,
+        trade_id: Optional[np.ndarray] = None,
+        validate: bool = True,
+    ) -> None:
+        """
+        Args:
+            product_ids (Sequence[str]): The distinct product ids in the batch.
+            product_codes (np.ndarray): For each trade, the index of its product id
+                in `product_ids`.
+            price (np.ndarray): The price of each trade.
+            quantity (np.ndarray): The quantity of each trade.
+            timestamp_ms (np.ndarray): The timestamp of each trade in Unix milliseconds.
+            trade_id (Optional[np.ndarray]): The Kraken trade id of each trade.
+                None if we do not know them.
+            validate (bool): Whether to validate the batch. Only skip it for batches
+                derived from an already validated one.
+
+        Returns:
+            None
+        """
+        self.product_ids = tuple(sys.intern(product_id) for product_id in product_ids)
+        self.product_codes = np.asarray(product_codes, dtype=np.uint16)
+        self.price = np.asarray(price, dtype=np.float64)
+        self.quantity = np.asarray(quantity, dtype=np.float64)
+        self.timestamp_ms = np.asarray(timestamp_ms, dtype=np.int64)
+        if trade_id is None:
+            self.trade_id = np.full(len(self.timestamp_ms), self.NO_TRADE_ID, dtype=np.int64)
+        else:
+            self.trade_id = np.asarray(trade_id, dtype=np.int64)
+
+        if validate:
+            self.validate()
+
+    @classmethod
+    def from_columns(
+        cls,
+        product_id: str,
+        price: Sequence[float],
+        quantity: Sequence[float],
+        timestamp_ms: Sequence[int],
+        trade_id: Optional[Sequence[int]] = None,
+    ) -> 'TradeBatch':
+        """
+        Creates a batch of trades of a single product from its columns.
+        """
+        return cls(
+            product_ids=[product_id],
+            product_codes=np.zeros(len(price), dtype=np.uint16),
+            price=price,
+            quantity=quantity,
+            timestamp_ms=timestamp_ms,
+            trade_id=trade_id,
+        )
+
+    @classmethod
+    def from_trades(cls, trades: List[Trade]) -> 'TradeBatch':
+        """
+        Creates a batch from a list of `Trade` objects.
+        """
+        product_ids = {}
+        product_codes = [
+            product_ids.setdefault(trade.product_id, len(product_ids)) for trade in trades
+        ]
+        return cls(
+            product_ids=list(product_ids),
+            product_codes=product_codes,
+            price=[trade.price for trade in trades],
+            quantity=[trade.quantity for trade in trades],
+            timestamp_ms=[trade.timestamp_ms for trade in trades],
+            trade_id=[
+                cls.NO_TRADE_ID if trade.trade_id is None else trade.trade_id
+                for trade in trades
+            ],
+        )
+
+    @classmethod
+    def concat(cls, batches: List['TradeBatch']) -> 'TradeBatch':
+        """
+        Concatenates several (already validated) batches into one, merging their
+        product ids.
+        """
+        product_ids = {}
+        product_codes = []
+        for batch in batches:
+            # map the product codes of this batch to the codes of the merged batch
+            remap = np.array(
+                [product_ids.setdefault(product_id, len(product_ids)) for product_id in batch.product_ids],
+                dtype=np.uint16,
+            )
+            product_codes.append(remap[batch.product_codes])
+
+        if not batches:
+            return cls.empty()
+
+        return cls(
+            product_ids=list(product_ids),
+            product_codes=np.concatenate(product_codes),
+            price=np.concatenate([batch.price for batch in batches]),
+            quantity=np.concatenate([batch.quantity for batch in batches]),
+            timestamp_ms=np.concatenate([batch.timestamp_ms for batch in batches]),
+            trade_id=np.concatenate([batch.trade_id for batch in batches]),
+            validate=False,
+        )
+
+    @classmethod
+    def empty(cls) -> 'TradeBatch':
+        """
+        Returns a batch with no trades.
+        """
+        return cls(product_ids=[], product_codes=[], price=[], quantity=[], timestamp_ms=[])
+
+    def validate(self) -> None:
+        """
+        Checks the whole batch at once, instead of one trade at a time.
+
+        Raises:
+            ValueError: If the columns have different lengths, or hold values that
+                are not valid for a trade.
+        """
+        n_trades = len(self.timestamp_ms)
+        if not (
+            len(self.product_codes) == len(self.price) == len(self.quantity)
+            == len(self.trade_id) == n_trades
+        ):
+            raise ValueError('All the columns of a TradeBatch must have the same length')
+
+        if n_trades == 0:
+            return
+
+        if self.product_codes.max() >= len(self.product_ids):
+            raise ValueError('TradeBatch has product codes without a product id')
+        if not np.isfinite(self.price).all() or (self.price <= 0).any():
+            raise ValueError('TradeBatch has non-positive or non-finite prices')
+        if not np.isfinite(self.quantity).all() or (self.quantity < 0).any():
+            raise ValueError('TradeBatch has negative or non-finite quantities')
+        if (self.timestamp_ms < 0).any():
+            raise ValueError('TradeBatch has negative timestamps')
+
+    def __len__(self) -> int:
+        return len(self.timestamp_ms)
+
+    def __getitem__(self, index: Union[slice, np.ndarray]) -> 'TradeBatch':
+        """
+        Returns the trades selected by a slice, or a boolean mask, as a new batch.
+        """
+        return TradeBatch(
+            product_ids=self.product_ids,
+            product_codes=self.product_codes[index],
+            price=self.price[index],
+            quantity=self.quantity[index],
+            timestamp_ms=self.timestamp_ms[index],
+            trade_id=self.trade_id[index],
+            validate=False,
+        )
+
+    def to_records(self) -> Iterator[dict]:
+        """
+        Yields one dictionary per trade, with the same fields as `Trade.model_dump()`
+        """
+        product_ids = self.product_ids
+        for code, quantity, price, timestamp_ms, trade_id in zip(
+            self.product_codes.tolist(),
+            self.quantity.tolist(),
+            self.price.tolist(),
+            self.timestamp_ms.tolist(),
+            self.trade_id.tolist(),
+        ):
+            yield {
+                'product_id': product_ids[code],
+                'quantity': quantity,
+                'price': price,
+                'timestamp_ms': timestamp_ms,
+                'trade_id': None if trade_id == self.NO_TRADE_ID else trade_id,
+            }
+
+    def to_trades(self) -> List[Trade]:
+        """
+        Returns the batch as a list of `Trade` objects.
+        """
+        return [Trade(**record) for record in self.to_records()]
+
+    def to_json_payloads(self) -> List[bytes]:
+        """
+        Serializes every trade in the batch to JSON bytes, in one pass.
+        """
+        return [orjson.dumps(record) for record in self.to_records()]
+
+    def to_binary_payloads(self) -> List[bytes]:
+        """
+        Serializes every trade in the batch to the binary wire format, in one pass.
+        """
+        return encode_trades(
+            product_ids=self.product_ids,
+            product_codes=self.product_codes.tolist(),
+            timestamp_ms=self.timestamp_ms.tolist(),
+            price=self.price.tolist(),
+            quantity=self.quantity.tolist(),
+            trade_id=self.trade_id.tolist(),
+        )
+
+    def keys(self) -> List[bytes]:
+        """
+        Returns the product id of every trade, encoded once per distinct product id.
+        """
+        encoded = [product_id.encode() for product_id in self.product_ids]
+        return [encoded[code] for code in self.product_codes.tolist()]
@@ -0,0 +1,47 @@
+import time
+
+import numpy as np
+import pytest
+
+from src.trade_data_source.kraken_rest_api import KrakenRestAPI, PageCursor
+from src.trade_data_source.trade_batch import TradeBatch
+
+
+class FailingShardAPI(KrakenRestAPI):
+    """
+    Returns one trade per millisecond, and fails in the first shard after a few
+    pages, while the other shards fill their queues.
+    """
+
+    SHARD_PUT_TIMEOUT_SEC = 0.05
+
+    def _fetch_trades(self, cursor: PageCursor) -> TradeBatch:
+        first_from_ms, first_to_ms = self.shard_ranges[0]
+        if cursor.to_ms == first_to_ms and cursor.boundary_ms >= first_from_ms + 5:
+            # wait until the other shards are blocked on their full queues
+            time.sleep(0.2)
+            raise ConnectionError('Kraken is down')
+
+        ts = cursor.boundary_ms
+        cursor.skip_to(min(ts + 1, cursor.to_ms))
+        return TradeBatch.from_columns(
+            product_id=self.product_id,
+            price=np.array([3500.0]),
+            quantity=np.array([0.1]),
+            timestamp_ms=np.array([ts]),
+        )
+
+
+def test_failed_shard_stops_the_other_shards():
+    api = FailingShardAPI(product_id='ETH/USD', last_n_days=1, n_shards=3)
+    api.shard_ranges = api._get_shard_ranges()
+
+    with pytest.raises(ConnectionError):
+        while not api.is_done():
+            api.get_trades()
+
+    # the fetchers are not daemon threads, so the process would hang at exit
+    # if any of them were still waiting for room in its queue
+    for thread in api._executor._threads:
+        thread.join(timeout=5)
+        assert not thread.is_alive()
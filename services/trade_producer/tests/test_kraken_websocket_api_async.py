@@ -0,0 +1,154 @@
+import asyncio
+import json
+import threading
+import time
+from typing import Callable, List, Optional, Union
+
+import pytest
+import websockets
+
+from src.trade_data_source.kraken_websocket_api_async import KrakenWebsocketAPIAsync
+
+
+def ack(symbol: str, success: bool = True) -> str:
+    message = {'method': 'subscribe', 'result': {'symbol': symbol}, 'success': success}
+    if not success:
+        message['error'] = 'Currency pair not supported'
+    return json.dumps(message)
+
+
+def trade_frame(symbol: str, price: float) -> str:
+    return json.dumps({
+        'channel': 'trade',
+        'type': 'update',
+        'data': [{
+            'symbol': symbol,
+            'price': price,
+            'qty': 0.1,
+            'timestamp': '2024-06-17T09:36:39.467866Z',
+            'trade_id': 1,
+        }],
+    })
+
+
+class StubKraken:
+    """
+    A local websocket server. On every connection it waits for the subscription,
+    sends the frames of `script`, and closes the connection cleanly. A number in
+    the script is a pause, in seconds.
+    """
+
+    def __init__(self, script: Callable[[int], List[Union[str, float]]]) -> None:
+        self.script = script
+        self.connected_at: List[float] = []
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+        threading.Thread(target=self._serve, args=(started,), daemon=True).start()
+        started.wait()
+
+    def _serve(self, started: threading.Event) -> None:
+        async def handler(ws, *args):
+            self.connected_at.append(time.monotonic())
+            await ws.recv()
+            for frame in self.script(len(self.connected_at)):
+                if isinstance(frame, str):
+                    await ws.send(frame)
+                else:
+                    await asyncio.sleep(frame)
+
+        async def main():
+            async with websockets.serve(handler, '127.0.0.1', 0) as server:
+                self.port = list(server.sockets)[0].getsockname()[1]
+                started.set()
+                await asyncio.Future()
+
+        self._loop.run_until_complete(main())
+
+    def source(self, product_ids: Optional[List[str]] = None, **kwargs) -> KrakenWebsocketAPIAsync:
+        class Source(KrakenWebsocketAPIAsync):
+            URL = f'ws://127.0.0.1:{self.port}'
+
+        return Source(product_ids=product_ids or ['ETH/USD'], max_backoff_sec=0.2, **kwargs)
+
+
+def get_trades_until(source: KrakenWebsocketAPIAsync, n_trades: int, timeout_sec: float = 5):
+    trades = []
+    deadline = time.monotonic() + timeout_sec
+    while sum(len(batch) for batch in trades) < n_trades and time.monotonic() < deadline:
+        trades.append(source.get_trades(timeout_sec=0.1))
+    return trades
+
+
+def test_bad_frames_are_skipped():
+    server = StubKraken(lambda _: [
+        ack('ETH/USD'),
+        'not json',
+        json.dumps({'channel': 'trade', 'data': [{'symbol': 'ETH/USD'}]}),
+        trade_frame('ETH/USD', 3500.0),
+    ])
+    source = server.source()
+
+    trades = get_trades_until(source, 1)
+
+    assert [batch.price[0] for batch in trades if len(batch)][0] == 3500.0
+    assert source.bad_frames >= 2
+    source.close()
+
+
+def test_rejected_subscription_raises():
+    server = StubKraken(lambda _: [ack('ETH/USD', success=False)])
+    source = server.source()
+
+    with pytest.raises(RuntimeError, match='rejected'):
+        source.wait_until_subscribed(timeout_sec=5)
+    with pytest.raises(RuntimeError):
+        source.get_trades(timeout_sec=0.1)
+
+
+def test_clean_close_reconnects_with_backoff():
+    server = StubKraken(lambda _: [ack('ETH/USD')])
+    source = server.source()
+
+    deadline = time.monotonic() + 5
+    while len(server.connected_at) < 4 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    source.close()
+
+    assert source.reconnects >= 3
+    # with max_backoff_sec=0.2 the reader waits at least 0.1s between connections
+    gaps = [b - a for a, b in zip(server.connected_at, server.connected_at[1:])]
+    assert min(gaps) >= 0.1
+
+
+def test_reconnect_waits_for_the_acks_again():
+    # the first connection acks both products, the next ones only one of them
+    server = StubKraken(lambda n_connection: (
+        [ack('ETH/USD'), ack('BTC/USD'), 0.5] if n_connection == 1 else [ack('ETH/USD')]
+    ))
+    source = server.source(product_ids=['ETH/USD', 'BTC/USD'])
+    assert source.wait_until_subscribed(timeout_sec=5)
+
+    deadline = time.monotonic() + 5
+    while len(server.connected_at) < 3 and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    # the acks of the first connection do not count anymore
+    assert not source.wait_until_subscribed(timeout_sec=0.3)
+    source.close()
+
+
+def test_fatal_reader_error_reaches_get_trades():
+    server = StubKraken(lambda _: [ack('ETH/USD'), trade_frame('ETH/USD', 3500.0)])
+
+    class BrokenQueueSource(KrakenWebsocketAPIAsync):
+        URL = f'ws://127.0.0.1:{server.port}'
+
+        def _put(self, trades):
+            raise MemoryError('No room for the frame')
+
+    source = BrokenQueueSource(product_ids=['ETH/USD'], max_backoff_sec=0.2)
+
+    with pytest.raises(RuntimeError) as error:
+        get_trades_until(source, 1)
+    assert isinstance(error.value.__cause__, MemoryError)
+    assert not source.is_done()
@@ -0,0 +1,156 @@
+import random
+
+import orjson
+
+from src.trade_data_source.kraken_rest_api import KrakenRestAPI
+from src.trade_data_source.rate_limiter import RateLimiter
+
+
+class FakeClock:
+    """
+    A clock that only moves forward when someone sleeps on it.
+    """
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def time(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += max(0.0, seconds)
+
+
+class FakeKraken:
+    """
+    Kraken's call counter: +1 per request, decaying at `decay_per_sec`, and an
+    error when the counter would go above `max_counter`.
+    """
+
+    def __init__(self, clock: FakeClock, max_counter: float = 15, decay_per_sec: float = 1.0) -> None:
+        self.clock = clock
+        self.max_counter = max_counter
+        self.decay_per_sec = decay_per_sec
+        self.counter = 0.0
+        self.last_update = clock.time()
+
+    def request(self) -> bool:
+        """
+        Returns True if the request went through, False if we got throttled.
+        """
+        now = self.clock.time()
+        self.counter = max(0.0, self.counter - (now - self.last_update) * self.decay_per_sec)
+        self.last_update = now
+        if self.counter + 1 > self.max_counter:
+            return False
+        self.counter += 1
+        return True
+
+
+def make_limiter(clock: FakeClock) -> RateLimiter:
+    return RateLimiter(
+        max_counter=15,
+        decay_per_sec=1.0,
+        clock=clock.time,
+        sleep=clock.sleep,
+        rng=random.Random(42).random,
+    )
+
+
+def run(limiter: RateLimiter, kraken: FakeKraken, n_requests: int, latency_sec: float = 0.25):
+    """
+    Returns the time of every request that went through, and the number of
+    throttled requests.
+    """
+    times, errors = [], 0
+    while len(times) < n_requests:
+        limiter.acquire()
+        if kraken.request():
+            times.append(kraken.clock.time())
+            limiter.on_success()
+        else:
+            errors += 1
+            limiter.on_error()
+        kraken.clock.sleep(latency_sec)
+    return times, errors
+
+
+def test_sustained_rate_stays_within_the_limit():
+    clock = FakeClock()
+    times, errors = run(make_limiter(clock), FakeKraken(clock), n_requests=2_000)
+
+    assert errors == 0
+    # a burst up to the ceiling (14 calls), then at most 1 request per second,
+    # over any window
+    for i in range(len(times)):
+        window = [t for t in times[i:i + 100] if t <= times[i] + 60]
+        assert len(window) <= 14 + 60
+    # and not much less than that
+    assert len(times) / times[-1] >= 0.95
+
+
+def test_stricter_api_lowers_the_rate():
+    # Kraken decays the counter slower than documented, for example because
+    # another client shares our IP
+    clock = FakeClock()
+    times, errors = run(make_limiter(clock), FakeKraken(clock, decay_per_sec=0.8), n_requests=2_000)
+
+    # over the last half, once the limiter adapted
+    half = len(times) // 2
+    assert (len(times) - half) / (times[-1] - times[half]) <= 0.8 * 1.01
+    # it adapts, instead of getting throttled all the time
+    assert errors < 0.05 * len(times)
+
+
+def test_backs_off_after_an_error():
+    clock = FakeClock()
+    limiter = make_limiter(clock)
+
+    backoffs = []
+    for _ in range(4):
+        backoffs.append(limiter.on_error())
+        start = clock.time()
+        limiter.acquire()
+        # we wait for the backoff at least, and the counter to decay
+        assert clock.time() - start >= backoffs[-1]
+
+    # exponential backoff with jitter: each one is at least half of 2^n seconds
+    for n, backoff_sec in enumerate(backoffs):
+        assert 2 ** n / 2 <= backoff_sec <= 2 ** n
+
+
+class FakeResponse:
+    def __init__(self, data: dict) -> None:
+        self.content = orjson.dumps(data)
+
+    def raise_for_status(self) -> None:
+        pass
+
+
+class FakeSession:
+    """
+    Throttles the first `n_errors` requests like Kraken, with a 200 response.
+    """
+
+    def __init__(self, n_errors: int) -> None:
+        self.n_errors = n_errors
+        self.n_requests = 0
+
+    def get(self, url: str, timeout: float) -> FakeResponse:
+        self.n_requests += 1
+        if self.n_requests <= self.n_errors:
+            return FakeResponse({'error': ['EGeneral:Too many requests']})
+        return FakeResponse({'error': [], 'result': {'ETH/USD': [], 'last': '0'}})
+
+
+def test_request_backs_off_and_retries_when_throttled():
+    clock = FakeClock()
+    api = KrakenRestAPI(product_id='ETH/USD', last_n_days=1, rate_limiter=make_limiter(clock))
+    api._session = FakeSession(n_errors=3)
+
+    data = api._request(api.URL.format(product_id='ETH/USD', since_ns=0))
+
+    assert data['result']['ETH/USD'] == []
+    assert api._session.n_requests == 4
+    # 3 backoffs of at least 0.5, 1 and 2 seconds
+    assert clock.time() >= 3.5
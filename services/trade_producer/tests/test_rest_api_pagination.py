@@ -0,0 +1,183 @@
+"""
+`KrakenRestAPI` must return every trade exactly once, against synthetic paginated
+responses that overlap at their boundaries the way the Kraken Trades endpoint does:
+
+- pages hold at most 1,000 trades, and `last` is the time of the last one
+- `since` can be inclusive (every page starts with the last trade(s) of the previous
+  one) or exclusive, we check both
+- bursts of trades share the same millisecond, and sometimes the same nanosecond
+"""
+import json
+import random
+from bisect import bisect_left, bisect_right
+from typing import List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+import pytest
+
+from src.checkpoint import BackfillCheckpoint
+from src.trade_data_source import TradeBatch
+from src.trade_data_source.kraken_rest_api import DAY_MS, CachedTradeData, KrakenRestAPI
+
+PAGE_SIZE = 1000
+N_TRADES = 20_000
+
+
+class FakeKrakenTrades:
+    """
+    Answers the requests of `KrakenRestAPI._request` from a list of synthetic trades.
+    """
+
+    def __init__(self, product_id: str, from_ms: int, to_ms: int, n_trades: int, inclusive: bool) -> None:
+        rng = random.Random(0)
+        self.product_id = product_id
+        self.inclusive = inclusive
+        self.n_requests = 0
+
+        # time (in ns) of every trade, with bursts in the same ms and the same ns
+        times_ns = []
+        ts_ns = from_ms * 1_000_000
+        step_ns = (to_ms - from_ms) * 1_000_000 // n_trades
+        while len(times_ns) < n_trades:
+            ts_ns += rng.randrange(1, 2 * step_ns)
+            burst = rng.choice([1, 1, 1, 2, 5, 30])
+            for _ in range(burst):
+                times_ns.append(ts_ns)
+                ts_ns += rng.choice([0, 0, 1, 1_000])
+        self.times_ns = times_ns[:n_trades]
+
+        self.rows = [
+            [f'{3500 + rng.gauss(0, 5):.2f}', f'{rng.random():.8f}', t / 1e9, 'b', 'l', '', i]
+            for i, t in enumerate(self.times_ns)
+        ]
+
+    @property
+    def trade_ids(self) -> List[int]:
+        return [row[6] for row in self.rows]
+
+    def request(self, url: str) -> dict:
+        self.n_requests += 1
+        since_ns = int(parse_qs(urlparse(url).query)['since'][0])
+
+        bisect = bisect_left if self.inclusive else bisect_right
+        start = bisect(self.times_ns, since_ns)
+        rows = self.rows[start:start + PAGE_SIZE]
+        last = str(self.times_ns[start + len(rows) - 1]) if rows else str(since_ns)
+        return {'error': [], 'result': {self.product_id: rows, 'last': last}}
+
+
+def run_backfill(fake: FakeKrakenTrades, n_shards: int, cache_dir: Optional[str] = None) -> List[int]:
+    """
+    Returns the trade ids the backfill returned, in order.
+    """
+    api = KrakenRestAPI(
+        product_id=fake.product_id, last_n_days=2, n_shards=n_shards, cache_dir=cache_dir
+    )
+    api._request = fake.request
+
+    batches = []
+    while not api.is_done():
+        batches.append(api.get_trades())
+    trades = TradeBatch.concat(batches)
+
+    assert (trades.timestamp_ms[1:] >= trades.timestamp_ms[:-1]).all(), 'Trades out of order'
+    return trades.trade_id.tolist()
+
+
+def assert_exactly_once(returned: List[int], expected: List[int]) -> None:
+    duplicates = len(returned) - len(set(returned))
+    missing = sorted(set(expected) - set(returned))
+    assert duplicates == 0, f'{duplicates} duplicated trades'
+    assert not missing, f'{len(missing)} missing trades, the first ones {missing[:5]}'
+    assert sorted(returned) == sorted(expected)
+
+
+@pytest.fixture
+def make_fake():
+    from_ms, to_ms = KrakenRestAPI._init_from_to_ms(last_n_days=2)
+    return lambda inclusive: FakeKrakenTrades('ETH/USD', from_ms, to_ms, N_TRADES, inclusive)
+
+
+@pytest.mark.parametrize('inclusive', [True, False], ids=['inclusive', 'exclusive'])
+@pytest.mark.parametrize('n_shards', [1, 4])
+def test_every_trade_exactly_once(make_fake, inclusive, n_shards):
+    fake = make_fake(inclusive)
+
+    assert_exactly_once(run_backfill(fake, n_shards), fake.trade_ids)
+
+
+@pytest.mark.parametrize('inclusive', [True, False], ids=['inclusive', 'exclusive'])
+@pytest.mark.parametrize('n_shards', [1, 4])
+def test_every_trade_exactly_once_with_the_cache(make_fake, inclusive, n_shards, tmp_path):
+    fake = make_fake(inclusive)
+
+    # cold cache: from the API, written to the cache
+    assert_exactly_once(run_backfill(fake, n_shards, str(tmp_path)), fake.trade_ids)
+    cold_requests, fake.n_requests = fake.n_requests, 0
+
+    # warm cache: from the parquet files, and the API only for the last trades,
+    # whose millisecond might not be complete yet
+    assert_exactly_once(run_backfill(fake, n_shards, str(tmp_path)), fake.trade_ids)
+    assert fake.n_requests < cold_requests / 2
+
+
+def test_a_gap_right_before_a_covered_range(make_fake, tmp_path):
+    fake = make_fake(True)
+    assert_exactly_once(run_backfill(fake, 1, str(tmp_path)), fake.trade_ids)
+
+    # take the first day out of the index, and keep the next one: the page that
+    # ends the gap runs on into the next day, that is cached already
+    index_path = tmp_path / CachedTradeData.INDEX_FILE_NAME
+    index = json.loads(index_path.read_text())
+    (from_ms, to_ms), = index[fake.product_id]
+    first_day_end_ms = (from_ms // DAY_MS + 1) * DAY_MS
+    index[fake.product_id] = [[first_day_end_ms, to_ms]]
+    index_path.write_text(json.dumps(index))
+
+    assert_exactly_once(run_backfill(fake, 1, str(tmp_path)), fake.trade_ids)
+    # every trade is in the cache once (but the ones of the last millisecond,
+    # that might not be complete yet)
+    cached = pd.concat(pd.read_parquet(path) for path in tmp_path.glob('**/*.parquet'))
+    assert sorted(cached['trade_id']) == fake.trade_ids[:len(cached)]
+
+
+@pytest.mark.parametrize('inclusive', [True, False], ids=['inclusive', 'exclusive'])
+@pytest.mark.parametrize('n_shards', [1, 4])
+def test_resume_after_a_kill_every_trade_exactly_once(make_fake, inclusive, n_shards, tmp_path):
+    fake = make_fake(inclusive)
+    checkpoint_path = str(tmp_path / 'checkpoint.json')
+
+    def run(n_batches: Optional[int] = None) -> List[int]:
+        """
+        Produces the trades of the backfill, committing the checkpoint after every
+        batch, and is killed after `n_batches` (None means it runs to the end).
+        """
+        checkpoint = BackfillCheckpoint(checkpoint_path)
+        api = KrakenRestAPI(
+            product_id=fake.product_id,
+            last_n_days=2,
+            n_shards=n_shards,
+            resume_from_ms=checkpoint.get(fake.product_id),
+            resume_after_trade_id=checkpoint.get_trade_id(fake.product_id),
+        )
+        api._request = fake.request
+
+        produced = []
+        while not api.is_done() and (n_batches is None or n_batches > 0):
+            trades = api.get_trades()
+            if not trades:
+                continue
+            produced += trades.trade_id.tolist()
+            checkpoint.update(trades)
+            checkpoint.commit()
+            n_batches = None if n_batches is None else n_batches - 1
+        api._stop_shards.set()
+        return produced
+
+    before = run(n_batches=7)
+    # the kill leaves the last millisecond we produced with trades we did not
+    # produce yet, so the next run fetches that millisecond again
+    assert 0 < len(before) < len(fake.trade_ids)
+    after = run()
+    assert_exactly_once(before + after, fake.trade_ids)
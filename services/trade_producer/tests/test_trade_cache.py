@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+
+from src.trade_data_source.kraken_rest_api import DAY_MS, CachedTradeData
+from src.trade_data_source.trade_batch import TradeBatch
+
+DAY = 19_900
+
+
+def make_trades(from_ms: int, to_ms: int, n_trades: int) -> TradeBatch:
+    timestamp_ms = np.linspace(from_ms, to_ms - 1, n_trades).astype(np.int64)
+    return TradeBatch.from_columns(
+        product_id='ETH/USD',
+        price=np.full(n_trades, 3500.0),
+        quantity=np.full(n_trades, 0.1),
+        timestamp_ms=timestamp_ms,
+        trade_id=np.arange(from_ms, from_ms + n_trades),
+    )
+
+
+def write_pages(cache: CachedTradeData, from_ms: int, to_ms: int, n_pages: int) -> TradeBatch:
+    """
+    Writes [from_ms, to_ms) in `n_pages` pages, like the backfill does.
+    """
+    bounds = np.linspace(from_ms, to_ms, n_pages + 1).astype(np.int64)
+    pages = [make_trades(int(a), int(b), 10) for a, b in zip(bounds[:-1], bounds[1:])]
+    for (a, b), page in zip(zip(bounds[:-1], bounds[1:]), pages):
+        cache.write('ETH/USD', page, from_ms=int(a), to_ms=int(b))
+    return TradeBatch.concat(pages)
+
+
+def count_parquet_writes(monkeypatch) -> list:
+    writes = []
+    to_parquet = pd.DataFrame.to_parquet
+
+    def counting_to_parquet(self, path, *args, **kwargs):
+        writes.append(path)
+        return to_parquet(self, path, *args, **kwargs)
+
+    monkeypatch.setattr(pd.DataFrame, 'to_parquet', counting_to_parquet)
+    return writes
+
+
+def test_a_day_is_written_once(tmp_path, monkeypatch):
+    writes = count_parquet_writes(monkeypatch)
+    cache = CachedTradeData(str(tmp_path))
+
+    # two days, and the first hour of the third one
+    trades = write_pages(cache, DAY * DAY_MS, (DAY + 2) * DAY_MS + 3_600_000, n_pages=500)
+
+    # the two complete days, and nothing of the third one yet
+    assert len(writes) == 2
+    assert cache.gaps('ETH/USD', DAY * DAY_MS, (DAY + 3) * DAY_MS) == [
+        ((DAY + 2) * DAY_MS, (DAY + 3) * DAY_MS)
+    ]
+
+    cache.flush()
+    assert len(writes) == 3
+    assert cache.gaps('ETH/USD', DAY * DAY_MS, (DAY + 2) * DAY_MS + 3_600_000) == []
+
+    cached = cache.read('ETH/USD', DAY * DAY_MS, (DAY + 3) * DAY_MS)
+    assert cached.trade_id.tolist() == trades.trade_id.tolist()
+
+
+def test_a_day_is_completed_across_runs(tmp_path):
+    # a first run caches the first half of the day and stops
+    cache = CachedTradeData(str(tmp_path))
+    first = write_pages(cache, DAY * DAY_MS, DAY * DAY_MS + DAY_MS // 2, n_pages=20)
+    cache.flush()
+
+    # the next one fetches the rest, and the day is complete
+    cache = CachedTradeData(str(tmp_path))
+    second = write_pages(cache, DAY * DAY_MS + DAY_MS // 2, (DAY + 1) * DAY_MS, n_pages=20)
+
+    assert cache.gaps('ETH/USD', DAY * DAY_MS, (DAY + 1) * DAY_MS) == []
+    cached = cache.read('ETH/USD', DAY * DAY_MS, (DAY + 1) * DAY_MS)
+    assert cached.trade_id.tolist() == TradeBatch.concat([first, second]).trade_id.tolist()
+
+
+def test_a_gap_right_before_a_covered_range(tmp_path):
+    # a first run caches the second half of the day
+    cache = CachedTradeData(str(tmp_path))
+    second = write_pages(cache, DAY * DAY_MS + DAY_MS // 2, (DAY + 1) * DAY_MS, n_pages=20)
+    cache.flush()
+
+    # the next one fetches the first half, and its last page runs on into the
+    # second half, that is cached already
+    cache = CachedTradeData(str(tmp_path))
+    first = write_pages(cache, DAY * DAY_MS, DAY * DAY_MS + DAY_MS // 2, n_pages=19)
+    overlap = make_trades(DAY * DAY_MS + DAY_MS // 2, DAY * DAY_MS + DAY_MS // 2 + 1, 1)
+    cache.write('ETH/USD', overlap, from_ms=DAY * DAY_MS + DAY_MS // 2 - 1, to_ms=DAY * DAY_MS + DAY_MS // 2 + 1)
+
+    assert cache.gaps('ETH/USD', DAY * DAY_MS, (DAY + 1) * DAY_MS) == []
+    cached = cache.read('ETH/USD', DAY * DAY_MS, (DAY + 1) * DAY_MS)
+    assert cached.trade_id.tolist() == TradeBatch.concat([first, second]).trade_id.tolist()
@@ -0,0 +1,85 @@
+import struct
+
+import orjson
+import pytest
+
+from src.trade_data_source.trade_batch import TradeBatch
+from src.wire_format import TRADE_SCHEMA, decode, encode_ohlcv, encode_trade
+
+
+def test_trade_id_is_in_the_fixed_layout():
+    batch = TradeBatch.from_columns(
+        product_id='ETH/USD',
+        price=[3500.5, 3501.0],
+        quantity=[0.1, 0.2],
+        timestamp_ms=[1_718_000_000_000, 1_718_000_000_001],
+        trade_id=[42, TradeBatch.NO_TRADE_ID],
+    )
+    payloads = batch.to_binary_payloads()
+
+    # header, layout and product id, no JSON tail
+    assert all(payload[:2] == b'T\x02' for payload in payloads)
+    assert all(b'{' not in payload for payload in payloads)
+    assert [decode(payload) for payload in payloads] == [
+        {
+            'timestamp_ms': 1_718_000_000_000,
+            'price': 3500.5,
+            'quantity': 0.1,
+            'trade_id': 42,
+            'product_id': 'ETH/USD',
+        },
+        {
+            'timestamp_ms': 1_718_000_000_001,
+            'price': 3501.0,
+            'quantity': 0.2,
+            'product_id': 'ETH/USD',
+        },
+    ]
+    assert payloads == [encode_trade(trade) for trade in batch.to_records()]
+
+
+def test_extra_fields_go_in_the_tail():
+    trade = {
+        'product_id': 'BTC/USD',
+        'timestamp_ms': 1,
+        'price': 2.0,
+        'quantity': 3.0,
+        'trade_id': 4,
+        'side': 'buy',
+    }
+    assert decode(encode_trade(trade)) == trade
+
+    candle = {
+        'product_id': 'BTC/USD',
+        'timestamp_ms': 60_000,
+        'open': 1.0,
+        'high': 2.0,
+        'low': 0.5,
+        'close': 1.5,
+        'volume': 10.0,
+        'trade_count': 3,
+    }
+    assert encode_ohlcv(candle)[:2] == b'O\x01'
+    assert decode(encode_ohlcv(candle)) == candle
+
+
+def test_v1_trades_still_decode():
+    v1 = b''.join((
+        struct.pack('<cB', TRADE_SCHEMA, 1),
+        struct.pack('<qdd', 1_718_000_000_000, 3500.5, 0.1),
+        bytes((7,)),
+        b'ETH/USD',
+        orjson.dumps({'trade_id': 42}),
+    ))
+    assert decode(v1) == {
+        'timestamp_ms': 1_718_000_000_000,
+        'price': 3500.5,
+        'quantity': 0.1,
+        'product_id': 'ETH/USD',
+        'trade_id': 42,
+    }
+
+
+def test_unknown_version():
+    with pytest.raises(ValueError, match='version 3'):
+        decode(struct.pack('<cB', TRADE_SCHEMA, 3) + bytes(40))
@@ -0,0 +1,104 @@
+"""
+Compares the batch OHLCV engine with the streaming path on the same trades:
+
+- streaming: `transform_trade_to_ohlcv`, the real quixstreams pipeline (tumbling
+  window with `.final()`, RocksDB state), one message at a time, with the Kafka
+  clients replaced by local ones (see `tests/local_kafka.py`)
+- batch: `decode_trades` and `BatchOhlcvEngine.process` on batches of messages,
+  and the encoding of the candles
+
+Some trades are out of order, and some are late, to check both give exactly the
+same finished candles.
+
+Usage:
+    poetry run python benchmarks/batch_engine.py [n_trades] [json|binary]
+"""
+import sys
+import tempfile
+import time
+from typing import List
+
+import orjson
+from loguru import logger
+
+from src.batch_engine import BatchOhlcvEngine, decode_trades
+from src.wire_format import encode_trade
+from tests.local_kafka import partitions_per_key, run_pipeline
+from tests.trades import make_trades, synthetic_products
+
+WINDOW_SECONDS = 60
+BATCH_SIZE = 100_000
+N_PRODUCTS = 20
+# mean seconds between two trades of each product
+MEAN_SEC = 0.5
+
+
+def run_streaming(trades: List[dict], value_format: str) -> List[dict]:
+    with tempfile.TemporaryDirectory() as state_dir:
+        produced = run_pipeline(
+            trades,
+            state_dir=state_dir,
+            ohlcv_window_seconds=WINDOW_SECONDS,
+            value_format=value_format,
+            partitions=partitions_per_key(trade['product_id'] for trade in trades),
+        )
+    return [message['message'] for message in produced]
+
+
+def run_batch(messages: List[bytes]) -> List[dict]:
+    engine = BatchOhlcvEngine(window_seconds=WINDOW_SECONDS)
+    candles = []
+    for i in range(0, len(messages), BATCH_SIZE):
+        batch_candles = engine.process(*decode_trades(messages[i:i + BATCH_SIZE]))
+        # the candles go to Kafka without the aggregates, like in the streaming path
+        for candle in batch_candles:
+            del candle['trade_count'], candle['notional'], candle['buy_volume']
+            orjson.dumps(candle)
+        candles.extend(batch_candles)
+    return candles
+
+
+def as_set(candles: List[dict]) -> set:
+    return {
+        (c['product_id'], c['timestamp_ms'], c['open'], c['high'], c['low'], c['close'],
+         round(c['volume'], 6))
+        for c in candles
+    }
+
+
+if __name__ == '__main__':
+
+    n_trades = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    value_format = sys.argv[2] if len(sys.argv) > 2 else 'json'
+    # 1% of the trades are up to 2 minutes late
+    trades = make_trades(
+        synthetic_products(N_PRODUCTS, MEAN_SEC),
+        duration_sec=n_trades * MEAN_SEC / N_PRODUCTS,
+        late_fraction=0.01,
+        max_delay_ms=120_000,
+    )
+    n_trades = len(trades)
+    encode = encode_trade if value_format == 'binary' else orjson.dumps
+    messages = [encode(trade) for trade in trades]
+    print(f'{n_trades:,} {value_format} trades, {WINDOW_SECONDS}s windows')
+
+    # the streaming pipeline logs every candle at debug level
+    logger.remove()
+    logger.add(sys.stderr, level='INFO')
+
+    results = {}
+    timings = {}
+    for name, run in [
+        ('streaming', lambda: run_streaming(trades, value_format)),
+        ('batch', lambda: run_batch(messages)),
+    ]:
+        start = time.perf_counter()
+        results[name] = run()
+        timings[name] = time.perf_counter() - start
+        print(
+            f'  {name:>9}: {timings[name]:.2f}s, {n_trades / timings[name]:,.0f} trades/s, '
+            f'{len(results[name]):,} candles'
+        )
+
+    assert as_set(results['streaming']) == as_set(results['batch']), 'The candles are different'
+    print(f'Same candles, {timings["streaming"] / timings["batch"]:.1f}x faster')
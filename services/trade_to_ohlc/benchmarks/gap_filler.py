@@ -0,0 +1,69 @@
+"""
+Replays trades of products with very different liquidity through the in-memory
+tumbling windows of `tests/trades.py`, with `.final()`, and the `GapFiller`, and
+checks:
+
+- every product has exactly one candle per window, from its first trade to the
+  watermark, so a dense lookup of the keys never misses
+- the candles of the windows with trades are the ones of `.final()`
+- the flat candles have zero volume and the close of the last trade before them
+
+Then it stops the trades, and fills the rest on the wall clock.
+
+Usage:
+    poetry run python benchmarks/gap_filler.py
+"""
+from src.gap_filler import GapFiller
+from tests.trades import TumblingWindows, make_trades
+
+WINDOW_SECONDS = 60
+# mean seconds between two trades of each product
+PRODUCTS = {'BTC/USD': 0.5, 'ETH/USD': 5, 'XTZ/USD': 120, 'MLN/USD': 600}
+
+
+if __name__ == '__main__':
+
+    # a few of the trades are up to 100 ms late on the wire
+    trades = make_trades(PRODUCTS, duration_sec=6 * 60 * 60, late_fraction=0.05, max_delay_ms=100)
+    window_ms = WINDOW_SECONDS * 1000
+    gap_filler = GapFiller(window_seconds=WINDOW_SECONDS, delay_ms=5_000)
+
+    windows = TumblingWindows(WINDOW_SECONDS)
+    candles = []
+    for trade in trades:
+        gap_filler.observe_trade(trade)
+        for candle in windows.add(trade)[1]:
+            candles += gap_filler.on_candle(candle)
+
+    # the input is idle now: the wall clock keeps going
+    last_ms = max(trade['timestamp_ms'] for trade in trades)
+    candles += gap_filler.fill(last_ms + 30 * 60 * 1000)
+    # with .final(), the last window with trades of each product only closes with
+    # its next trade (partial candles show it before that)
+    candles += windows.flush()
+
+    by_key = {}
+    for candle in candles:
+        key = (candle['product_id'], candle['timestamp_ms'])
+        # a finished candle replaces the flat one, like an upsert
+        if key not in by_key or candle['volume'] > 0:
+            by_key[key] = candle
+
+    for product_id in PRODUCTS:
+        timestamps = sorted(ts for p, ts in by_key if p == product_id)
+        expected = list(range(timestamps[0], timestamps[-1] + window_ms, window_ms))
+        assert timestamps == expected, f'Missing windows for {product_id}'
+
+        n_flat = sum(
+            1 for (p, _), candle in by_key.items() if p == product_id and candle['volume'] == 0
+        )
+        print(f'  {product_id}: {len(timestamps):,} windows, {n_flat:,} of them flat')
+
+    previous = {}
+    for (product_id, _), candle in sorted(by_key.items()):
+        if candle['volume'] == 0:
+            close = previous[product_id]['close']
+            assert candle['open'] == candle['high'] == candle['low'] == candle['close'] == close
+        previous[product_id] = candle
+
+    print('No missing windows')
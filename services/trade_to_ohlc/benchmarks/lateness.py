@@ -0,0 +1,137 @@
+"""
+Replays out-of-order trades through the late trades filter, then the in-memory
+tumbling windows of `tests/trades.py` with a grace period, for several grace
+periods, and reports what they trade off:
+
+- completeness: the trades that were late, and dropped (or sent to the late
+  trades topic)
+- latency: how long after the end of a window its candle came out, in event time
+
+It checks that
+- with a grace period longer than the max delay of the trades, nothing is late,
+  and the candles have all their trades
+- the final candles of `throttle_partial_candle` (`.current()`) are the ones of
+  `.final()`, with every grace period
+
+Usage:
+    poetry run python benchmarks/lateness.py
+"""
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from src.batch_engine import BatchOhlcvEngine
+from src.lateness import DROPPED, LATE, ON_TIME, WATERMARK_KEY, LateTrades
+from src.partial_candles import throttle_partial_candle
+from src.rollup import DictState
+from tests.trades import TumblingWindows, make_trades
+
+WINDOW_SECONDS = 60
+MAX_DELAY_MS = 20_000
+GRACE_MS = [0, 1_000, 5_000, MAX_DELAY_MS]
+ALLOWED_LATENESS_MS = 10_000
+PRODUCTS = {'BTC/USD': 0.2, 'ETH/USD': 1, 'XTZ/USD': 10}
+
+
+def run_streaming(trades: List[dict], grace_ms: int) -> Tuple[List[dict], List[dict], LateTrades, List[int]]:
+    """
+    Returns the candles of `.final()`, the final candles of the partial candles,
+    the counters of the late trades, and the latency of every candle.
+    """
+    late_trades = LateTrades(
+        window_seconds=WINDOW_SECONDS,
+        grace_ms=grace_ms,
+        allowed_lateness_ms=ALLOWED_LATENESS_MS,
+        has_late_trades_topic=True,
+        log_every_sec=float('inf'),
+    )
+    windows = TumblingWindows(WINDOW_SECONDS, grace_ms=grace_ms)
+    states: Dict[str, DictState] = {}
+    finals, partial_finals, latencies = [], [], []
+
+    for trade in trades:
+        product_id = trade['product_id']
+        state = states.setdefault(product_id, DictState())
+        verdict, _ = late_trades.check(trade, state)
+        if verdict != ON_TIME:
+            continue
+
+        current, closed = windows.add(trade)
+
+        # .current(), then the partial candles
+        partial_finals += [
+            {k: v for k, v in candle.items() if k != 'is_final'}
+            for candle in throttle_partial_candle(
+                current,
+                state,
+                throttle_ms=1000,
+                now_ms=trade['timestamp_ms'],
+                watermark_ms=state.get(WATERMARK_KEY),
+                grace_ms=grace_ms,
+            )
+            if candle['is_final']
+        ]
+
+        # .final(): the windows the watermark of the product closed
+        finals += closed
+        latencies += [windows.watermarks[product_id] - candle['timestamp_ms'] for candle in closed]
+
+    return finals, partial_finals, late_trades, latencies
+
+
+def in_time_order(trades: List[dict]) -> List[dict]:
+    """
+    The candles of the trades, sorted by timestamp, so none of them is late.
+    """
+    trades = sorted(trades, key=lambda trade: trade['timestamp_ms'])
+    engine = BatchOhlcvEngine(window_seconds=WINDOW_SECONDS)
+    return engine.process(
+        [trade['product_id'] for trade in trades],
+        np.array([trade['timestamp_ms'] for trade in trades]),
+        np.array([trade['price'] for trade in trades]),
+        np.array([trade['quantity'] for trade in trades]),
+    )
+
+
+def by_window(candles: List[dict]) -> Dict[tuple, dict]:
+    return {(candle['product_id'], candle['timestamp_ms']): candle for candle in candles}
+
+
+if __name__ == '__main__':
+
+    # 5% of the trades are up to `MAX_DELAY_MS` late
+    trades = make_trades(
+        PRODUCTS, duration_sec=6 * 60 * 60, late_fraction=0.05, max_delay_ms=MAX_DELAY_MS
+    )
+    print(
+        f'{len(trades):,} trades, 5% of them up to {MAX_DELAY_MS / 1000:.0f}s late, '
+        f'{WINDOW_SECONDS}s windows, {ALLOWED_LATENESS_MS / 1000:.0f}s allowed lateness'
+    )
+    expected = by_window(in_time_order(trades))
+
+    for grace_ms in GRACE_MS:
+        finals, partial_finals, late_trades, latencies = run_streaming(trades, grace_ms)
+        counts = late_trades.counts
+        print(
+            f'  grace {grace_ms / 1000:>4.0f}s: {counts[LATE]:>5,} late, {counts[DROPPED]:>5,} dropped, '
+            f'candles out {np.median(latencies) / 1000:.1f}s after their window '
+            f'(p99 {np.percentile(latencies, 99) / 1000:.1f}s)'
+        )
+
+        key = lambda candle: (candle['product_id'], candle['timestamp_ms'])  # noqa: E731
+        assert sorted(partial_finals, key=key) == sorted(finals, key=key), \
+            f'Partial candles with a {grace_ms} ms grace period are not final like .final()'
+
+        if grace_ms >= MAX_DELAY_MS:
+            assert counts[LATE] + counts[DROPPED] == 0, 'Late trades with the longest grace period'
+            actual = by_window(finals)
+            # the reducer takes the open and close in the order the trades come in,
+            # and the sums match up to that order
+            for window, candle in actual.items():
+                assert all(
+                    np.isclose(candle[field], expected[window][field], rtol=1e-12)
+                    for field in ('high', 'low', 'volume', 'trade_count', 'notional')
+                ), f'Candle {window} is different'
+            print(f'    all {len(actual):,} closed windows complete')
+
+    print('Partial candles are final like .final() with every grace period')
@@ -0,0 +1,109 @@
+"""
+Runs the offline backfill on a synthetic trade cache, with the parquet sink:
+
+- checks the candles are the ones of one `BatchOhlcvEngine` over all the trades
+- compares 1 worker with one worker per CPU
+- times the JSON encode/decode of the same trades, the part of the Kafka path
+  the offline backfill skips (twice: trade_historical and ohlcv_historical)
+
+Usage:
+    poetry run python benchmarks/offline_backfill.py [n_days] [trades_per_day]
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import orjson
+import pandas as pd
+
+from src.batch_engine import BatchOhlcvEngine
+from src.offline_backfill import offline_backfill
+
+WINDOW_SECONDS = 60
+PRODUCT_IDS = ['BTC/USD', 'ETH/USD', 'SOL/USD', 'XRP/USD']
+DAY_MS = 24 * 60 * 60 * 1000
+FIRST_DAY = 19_900
+
+
+def make_cache(cache_dir: Path, n_days: int, trades_per_day: int) -> pd.DataFrame:
+    """
+    Writes a cache like `CachedTradeData` does, and returns all its trades.
+    """
+    rng = np.random.default_rng(0)
+    data = []
+    for product_id in PRODUCT_IDS:
+        for day in range(FIRST_DAY, FIRST_DAY + n_days):
+            timestamp_ms = np.sort(rng.integers(day * DAY_MS, (day + 1) * DAY_MS, trades_per_day))
+            day_data = pd.DataFrame({
+                'product_id': product_id,
+                'quantity': np.round(rng.lognormal(-2, 1.5, trades_per_day), 8),
+                'price': np.round(1000 * np.exp(np.cumsum(rng.normal(0, 1e-4, trades_per_day))), 2),
+                'timestamp_ms': timestamp_ms,
+                'trade_id': np.arange(trades_per_day),
+            })
+            date = datetime.fromtimestamp(day * DAY_MS / 1000, tz=timezone.utc).strftime('%Y-%m-%d')
+            file_path = cache_dir / product_id.replace('/', '-') / f'{date}.parquet'
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            day_data.to_parquet(file_path, index=False)
+            data.append(day_data)
+
+    return pd.concat(data).sort_values('timestamp_ms', kind='stable')
+
+
+def as_set(candles) -> set:
+    return {
+        (c['product_id'], c['timestamp_ms'], c['open'], c['high'], c['low'], c['close'], c['volume'])
+        for c in candles
+    }
+
+
+if __name__ == '__main__':
+
+    n_days = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    trades_per_day = int(sys.argv[2]) if len(sys.argv) > 2 else 250_000
+    n_trades = n_days * trades_per_day * len(PRODUCT_IDS)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_dir = Path(tmp_dir) / 'cache'
+        trades = make_cache(cache_dir, n_days, trades_per_day)
+        print(f'{n_trades:,} trades, {len(PRODUCT_IDS)} products, {n_days} days')
+
+        engine = BatchOhlcvEngine(window_seconds=WINDOW_SECONDS)
+        expected = engine.process(
+            trades['product_id'].tolist(),
+            trades['timestamp_ms'].to_numpy(),
+            trades['price'].to_numpy(),
+            trades['quantity'].to_numpy(),
+        ) + engine.flush()
+
+        for n_workers in sorted({1, os.cpu_count()}):
+            output_dir = Path(tmp_dir) / f'ohlcv_{n_workers}'
+            start = time.perf_counter()
+            offline_backfill(
+                cache_dir=str(cache_dir),
+                ohlcv_window_seconds=WINDOW_SECONDS,
+                sink='parquet',
+                n_workers=n_workers,
+                output_dir=str(output_dir),
+            )
+            elapsed = time.perf_counter() - start
+            candles = pd.concat(
+                pd.read_parquet(file_path) for file_path in sorted(output_dir.glob('*.parquet'))
+            ).to_dict('records')
+            assert as_set(candles) == as_set(expected), 'The candles are different'
+            print(
+                f'  {n_workers:>2} worker(s): {elapsed:.2f}s, {n_trades / elapsed:,.0f} trades/s, '
+                f'{len(candles):,} candles'
+            )
+
+        sample = trades.head(1_000_000).to_dict('records')
+        start = time.perf_counter()
+        for trade in sample:
+            orjson.loads(orjson.dumps(trade))
+        elapsed = (time.perf_counter() - start) * n_trades / len(sample)
+        print(f'  JSON encode/decode of the trades alone: ~{elapsed:.2f}s')
+        print('Same candles')
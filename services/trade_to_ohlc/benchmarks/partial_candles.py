@@ -0,0 +1,92 @@
+"""
+Replays trades through `.current()` of the in-memory tumbling windows of
+`tests/trades.py` and `throttle_partial_candle`, with the trade timestamps as the
+wall clock, and checks:
+
+- the final candles are the ones of `.final()` (the batch engine)
+- no product gets two partial candles within `throttle_ms`
+- how long after a trade its window shows up downstream, with partial candles
+  and with `.final()` only
+
+Usage:
+    poetry run python benchmarks/partial_candles.py [throttle_ms]
+"""
+import sys
+from typing import Dict, List
+
+import numpy as np
+
+from src.batch_engine import BUY, SELL, BatchOhlcvEngine
+from src.partial_candles import throttle_partial_candle
+from src.rollup import DictState
+from tests.trades import TumblingWindows, make_trades
+
+WINDOW_SECONDS = 60
+# mean seconds between two trades of each product
+PRODUCTS = {'BTC/USD': 0.1, 'ETH/USD': 0.5, 'SOL/USD': 5}
+
+
+if __name__ == '__main__':
+
+    throttle_ms = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    trades = make_trades(PRODUCTS, duration_sec=4 * 60 * 60)
+    window_ms = WINDOW_SECONDS * 1000
+
+    windows = TumblingWindows(WINDOW_SECONDS)
+    states: Dict[str, DictState] = {}
+    emitted = []
+    for trade in trades:
+        # what `.current()` gives us after each trade
+        current, _ = windows.add(trade)
+        for out in throttle_partial_candle(
+            current, states.setdefault(trade['product_id'], DictState()), throttle_ms,
+            now_ms=trade['timestamp_ms'],
+        ):
+            emitted.append((trade['timestamp_ms'], out))
+
+    engine = BatchOhlcvEngine(window_seconds=WINDOW_SECONDS)
+    expected = engine.process(
+        [trade['product_id'] for trade in trades],
+        np.array([trade['timestamp_ms'] for trade in trades]),
+        np.array([trade['price'] for trade in trades]),
+        np.array([trade['quantity'] for trade in trades]),
+        np.array([BUY if trade['side'] == 'buy' else SELL for trade in trades]),
+    )
+    finals = [
+        {k: v for k, v in candle.items() if k != 'is_final'}
+        for _, candle in emitted if candle['is_final']
+    ]
+    key = lambda candle: (candle['product_id'], candle['timestamp_ms'])  # noqa: E731
+    assert sorted(finals, key=key) == sorted(expected, key=key), 'The final candles are different'
+
+    last_partial_ms: Dict[str, int] = {}
+    for now_ms, candle in emitted:
+        if not candle['is_final']:
+            previous_ms = last_partial_ms.get(candle['product_id'])
+            assert previous_ms is None or now_ms - previous_ms >= throttle_ms, 'Not throttled'
+            last_partial_ms[candle['product_id']] = now_ms
+
+    # latency until the window of a trade is visible downstream for the first time
+    first_partial = {}
+    first_final = {}
+    for now_ms, candle in emitted:
+        target = first_final if candle['is_final'] else first_partial
+        target.setdefault(key(candle), now_ms)
+    partial_latency = []
+    final_latency = []
+    for trade in trades:
+        end_ms = trade['timestamp_ms'] // window_ms * window_ms + window_ms
+        window = (trade['product_id'], end_ms)
+        if window in first_final:
+            final_latency.append(first_final[window] - trade['timestamp_ms'])
+            partial_latency.append(
+                max(first_partial.get(window, first_final[window]) - trade['timestamp_ms'], 0)
+            )
+
+    n_partials = sum(not candle['is_final'] for _, candle in emitted)
+    print(f'{len(trades):,} trades, {throttle_ms} ms throttle')
+    print(f'  {len(finals):,} final candles (same as .final()), {n_partials:,} partial candles')
+    print(
+        f'  median time until the window is visible: {np.median(partial_latency) / 1000:.1f}s '
+        f'with partial candles, {np.median(final_latency) / 1000:.1f}s with .final()'
+    )
@@ -0,0 +1,100 @@
+"""
+Compares two ways of getting candles at several resolutions from the same trades:
+
+- separate: one service per resolution, each deserializing every trade message and
+  aggregating it into its own tumbling windows
+- rollup: one service that deserializes the trades once, aggregates them into the
+  base window, and rolls the finished base candles up with `rollup_candle`
+
+The tumbling windows are the in-memory ones of `tests/trades.py`, with the same
+reducers as `src.main` (quixstreams is not in the loop), so the numbers compare the
+work per trade, not the Kafka round trips. It also checks that both give the same
+candles.
+
+Usage:
+    poetry run python benchmarks/rollup_throughput.py [n_trades]
+"""
+import math
+import sys
+import time
+from typing import Dict, List
+
+import orjson
+
+from src.rollup import DictState, rollup_candle
+from src.wire_format import decode
+from tests.trades import TumblingWindows, make_trades
+
+BASE_WINDOW_SECONDS = 60
+ROLLUP_WINDOW_SECONDS = [300, 900, 3600]
+# mean seconds between two trades of each product
+PRODUCTS = {'ETH/USD': 0.3, 'BTC/USD': 0.3, 'SOL/USD': 0.3}
+
+
+def run_separate(messages: List[bytes]) -> List[dict]:
+    candles = []
+    for seconds in [BASE_WINDOW_SECONDS] + ROLLUP_WINDOW_SECONDS:
+        windows = TumblingWindows(seconds)
+        closed = windows.run([decode(message) for message in messages]) + windows.flush()
+        candles += [{**candle, 'resolution_seconds': seconds} for candle in closed]
+    return candles
+
+
+def run_rollup(messages: List[bytes]) -> List[dict]:
+    candles = []
+    states: Dict[str, DictState] = {}
+
+    def on_final(candle: dict) -> None:
+        state = states.setdefault(candle['product_id'], DictState())
+        candles.extend(rollup_candle(candle, state, BASE_WINDOW_SECONDS, ROLLUP_WINDOW_SECONDS))
+
+    windows = TumblingWindows(BASE_WINDOW_SECONDS)
+    for message in messages:
+        for candle in windows.add(decode(message))[1]:
+            on_final(candle)
+    for candle in windows.flush():
+        on_final(candle)
+
+    # the coarse candles that are still open at the end
+    for state in states.values():
+        candles.extend(state.get(f'rollup_{seconds}') for seconds in ROLLUP_WINDOW_SECONDS)
+    return [candle for candle in candles if candle is not None]
+
+
+def same_candles(candles: List[dict], other: List[dict]) -> bool:
+    """
+    Whether both have the same candles. The volumes are sums in another order, so
+    they only match up to the rounding.
+    """
+    def by_key(candles: List[dict]) -> Dict[tuple, dict]:
+        return {(c['product_id'], c['resolution_seconds'], c['timestamp_ms']): c for c in candles}
+
+    candles, other = by_key(candles), by_key(other)
+    return candles.keys() == other.keys() and all(
+        all(c[field] == other[key][field] for field in ('open', 'high', 'low', 'close'))
+        and math.isclose(c['volume'], other[key]['volume'], rel_tol=1e-12)
+        for key, c in candles.items()
+    )
+
+
+if __name__ == '__main__':
+
+    n_trades = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    trades = make_trades(PRODUCTS, duration_sec=n_trades * 0.3 / len(PRODUCTS))
+    messages = [orjson.dumps(trade) for trade in trades]
+    n_trades = len(messages)
+    resolutions = [BASE_WINDOW_SECONDS] + ROLLUP_WINDOW_SECONDS
+    print(f'{n_trades:,} trades, resolutions {resolutions} seconds')
+
+    results = {}
+    for name, run in [('separate', run_separate), ('rollup', run_rollup)]:
+        start = time.perf_counter()
+        results[name] = run(messages)
+        elapsed = time.perf_counter() - start
+        print(
+            f'  {name:>8}: {elapsed:.2f}s, {n_trades / elapsed:,.0f} trades/s, '
+            f'{len(results[name]):,} candles'
+        )
+
+    assert same_candles(results['separate'], results['rollup']), 'The candles are different'
+    print('Both give the same candles')
@@ -0,0 +1,127 @@
+"""
+Local scaling test of the streaming engine: the same trades aggregated by 1, 2, 4
+(and so on) workers started with `run_workers`, each with the partitions Kafka
+would give it.
+
+Every worker runs `transform_trade_to_ohlcv`, the real quixstreams pipeline with its
+RocksDB state, in a state directory of its own, on the trades of its partitions,
+with the Kafka clients replaced by local ones (see `tests/local_kafka.py`). The
+trades go to the partitions by the CRC32 of their key (the product id), like the
+default partitioner of librdkafka. There is no broker in the loop, so this
+measures how the processing spreads over the processes, not the Kafka round
+trips. It also checks that every number of workers gives the same candles.
+
+The speedup is bound by the CPUs of the machine: on one CPU the workers only
+share it, and it shows the overhead of the extra processes.
+
+Usage:
+    poetry run python benchmarks/scaling.py [n_trades] [max_workers]
+"""
+import os
+import sys
+import tempfile
+import time
+import zlib
+from pathlib import Path
+from typing import Dict, List
+
+import orjson
+from loguru import logger
+
+from src.launcher import run_workers, worker_state_dir
+from tests.local_kafka import run_pipeline
+from tests.trades import make_trades, synthetic_products
+
+WINDOW_SECONDS = 60
+N_PARTITIONS = 8
+N_PRODUCTS = 200
+# mean seconds between two trades of each product
+MEAN_SEC = 1.0
+
+
+def write_partitions(trades: List[dict], data_dir: str) -> None:
+    """
+    Writes the trades of every partition to `data_dir/<partition>.json`.
+    """
+    partitions: Dict[int, List[dict]] = {partition: [] for partition in range(N_PARTITIONS)}
+    for trade in trades:
+        partitions[zlib.crc32(trade['product_id'].encode()) % N_PARTITIONS].append(trade)
+    for partition, partition_trades in partitions.items():
+        Path(data_dir, f'{partition}.json').write_bytes(orjson.dumps(partition_trades))
+
+
+def worker(partitions: List[int], data_dir: str, state_dir: str, output_path: str) -> None:
+    """
+    Runs the pipeline on the trades of `partitions`, and writes the candles to
+    `output_path`.
+    """
+    logger.remove()
+    trades = [
+        trade
+        for partition in partitions
+        for trade in orjson.loads(Path(data_dir, f'{partition}.json').read_bytes())
+    ]
+    produced = run_pipeline(
+        trades,
+        state_dir=state_dir,
+        ohlcv_window_seconds=WINDOW_SECONDS,
+        partitions=N_PARTITIONS,
+        assigned_partitions=partitions,
+    )
+    Path(output_path).write_bytes(orjson.dumps([message['message'] for message in produced]))
+
+
+if __name__ == '__main__':
+
+    n_trades = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    trades = make_trades(
+        synthetic_products(N_PRODUCTS, MEAN_SEC), duration_sec=n_trades * MEAN_SEC / N_PRODUCTS
+    )
+    n_trades = len(trades)
+    print(
+        f'{n_trades:,} trades of {N_PRODUCTS} products in {N_PARTITIONS} partitions, '
+        f'{os.cpu_count()} CPUs'
+    )
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        write_partitions(trades, data_dir)
+
+        baseline = None
+        expected = None
+        n_workers = 1
+        while n_workers <= min(max_workers, N_PARTITIONS):
+            start = time.perf_counter()
+            run_workers(
+                target=worker,
+                n_workers=n_workers,
+                worker_kwargs=lambda i, n_workers=n_workers: {
+                    # the partitions Kafka gives to each worker, round robin
+                    'partitions': list(range(i, N_PARTITIONS, n_workers)),
+                    'data_dir': data_dir,
+                    'state_dir': worker_state_dir(f'{data_dir}/state-{n_workers}', i),
+                    'output_path': f'{data_dir}/candles-{i}.json',
+                },
+            )
+            elapsed = time.perf_counter() - start
+
+            candles = sorted(
+                (
+                    candle
+                    for i in range(n_workers)
+                    for candle in orjson.loads(Path(f'{data_dir}/candles-{i}.json').read_bytes())
+                ),
+                key=lambda candle: (candle['product_id'], candle['timestamp_ms']),
+            )
+            if expected is None:
+                expected = candles
+            assert candles == expected, f'{n_workers} workers give other candles'
+
+            baseline = baseline or elapsed
+            print(
+                f'  {n_workers} workers: {n_trades / elapsed:>10,.0f} trades/s, '
+                f'{baseline / elapsed:.2f}x, {len(candles):,} candles'
+            )
+            n_workers *= 2
+
+    print('Same candles with every number of workers')
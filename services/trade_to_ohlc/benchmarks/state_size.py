@@ -0,0 +1,140 @@
+"""
+Compares the state of the open windows, for 1, 100 and 1000 products:
+
+- dict: the previous reducer state, a dictionary with the field names and the
+  product id, serialized to JSON by the default quixstreams serializer
+- compact: the `WindowCandle` of `src.window_state`, packed by its `dumps` / `loads`
+
+The state store is emulated like quixstreams does it: every trade reads the state
+of its window from the update cache of the checkpoint, deserializes it, runs the
+reducer and serializes it back, and every checkpoint writes the last state of each
+window to RocksDB (and the changelog topic). It reports the bytes of the value of each window key, the bytes written, and the
+updates per second of the whole loop, RocksDB writes included.
+
+Usage:
+    poetry run python benchmarks/state_size.py [n_trades]
+"""
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from quixstreams.utils.json import dumps as json_dumps, loads as json_loads
+from rocksdict import Options, Rdict, WriteBatch
+
+from src.main import init_ohlcv_candle, update_ohlcv_candle
+from src.window_state import dumps, loads
+from tests.trades import make_trades, synthetic_products
+
+WINDOW_SECONDS = 60
+# mean seconds between two trades, of any product
+MEAN_SEC = 0.01
+# trades per checkpoint, like the default commit interval of a busy service
+CHECKPOINT_TRADES = 10_000
+
+
+def init_dict_candle(trade: dict) -> dict:
+    return {
+        'open': trade['price'],
+        'high': trade['price'],
+        'low': trade['price'],
+        'close': trade['price'],
+        'volume': trade['quantity'],
+        'product_id': trade['product_id'],
+        'trade_count': 1,
+        'notional': trade['price'] * trade['quantity'],
+        'buy_volume': trade['quantity'] if trade['side'] == 'buy' else 0.0,
+    }
+
+
+def update_dict_candle(candle: dict, trade: dict) -> dict:
+    candle['high'] = max(candle['high'], trade['price'])
+    candle['low'] = min(candle['low'], trade['price'])
+    candle['close'] = trade['price']
+    candle['volume'] += trade['quantity']
+    candle['product_id'] = trade['product_id']
+    candle['trade_count'] += 1
+    candle['notional'] += trade['price'] * trade['quantity']
+    if trade['side'] == 'buy':
+        candle['buy_volume'] += trade['quantity']
+    return candle
+
+
+LAYOUTS = {
+    'dict': (init_dict_candle, update_dict_candle, json_dumps, json_loads),
+    'compact': (init_ohlcv_candle, update_ohlcv_candle, dumps, loads),
+}
+
+
+def window_key(product_id: str, start_ms: int) -> bytes:
+    # the message key, then the start and end of the window, like quixstreams
+    return product_id.encode() + b'|' + struct.pack('>QQ', start_ms, start_ms + WINDOW_SECONDS * 1000)
+
+
+def run(
+    trades: List[dict],
+    init: Callable,
+    update: Callable,
+    dumps: Callable[[object], bytes],
+    loads: Callable[[bytes], object],
+    db: Rdict,
+) -> Dict[str, float]:
+    window_ms = WINDOW_SECONDS * 1000
+    cache: Dict[bytes, bytes] = {}
+    written_bytes = 0
+
+    start = time.perf_counter()
+    for i, trade in enumerate(trades, 1):
+        start_ms = trade['timestamp_ms'] // window_ms * window_ms
+        key = window_key(trade['product_id'], start_ms)
+        value = cache.get(key)
+        cache[key] = dumps(init(trade) if value is None else update(loads(value), trade))
+
+        if i % CHECKPOINT_TRADES == 0 or i == len(trades):
+            batch = WriteBatch(raw_mode=True)
+            for key, value in cache.items():
+                batch.put(key, value)
+                written_bytes += len(key) + len(value)
+            db.write(batch)
+            cache = {}
+    elapsed = time.perf_counter() - start
+
+    values = [len(value) for _, value in db.items()]
+    return {
+        'updates_per_sec': len(trades) / elapsed,
+        'value_bytes': sum(values) / len(values),
+        'written_bytes': written_bytes,
+    }
+
+
+if __name__ == '__main__':
+
+    n_trades = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    print(f'{n_trades:,} trades, {WINDOW_SECONDS}s windows, {CHECKPOINT_TRADES:,} trades per checkpoint')
+    print(f'{"products":>8} {"layout":>8} {"bytes/key":>10} {"MB written":>11} {"updates/s":>10}')
+
+    for n_products in (1, 100, 1000):
+        trades = make_trades(
+            synthetic_products(n_products, MEAN_SEC * n_products), duration_sec=n_trades * MEAN_SEC
+        )
+        results = {}
+        for layout, (init, update, dumps_, loads_) in LAYOUTS.items():
+            path = tempfile.mkdtemp()
+            # bytes in, bytes out, like the state store of quixstreams
+            db = Rdict(path, options=Options(raw_mode=True))
+            try:
+                results[layout] = run(trades, init, update, dumps_, loads_, db)
+            finally:
+                db.close()
+                shutil.rmtree(path, ignore_errors=True)
+            result = results[layout]
+            print(
+                f'{n_products:>8} {layout:>8} {result["value_bytes"]:>10.0f} '
+                f'{result["written_bytes"] / 1e6:>11.2f} {result["updates_per_sec"]:>10,.0f}'
+            )
+        print(
+            f'{"":>8} {"":>8} {results["compact"]["value_bytes"] / results["dict"]["value_bytes"]:>9.0%} '
+            f'{"":>11} {results["compact"]["updates_per_sec"] / results["dict"]["updates_per_sec"]:>9.1f}x'
+        )
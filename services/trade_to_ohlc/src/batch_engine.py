@@ -0,0 +1,402 @@
+"""
+Batch OHLCV engine for historical mode: aggregates large batches of trades with
+NumPy group-bys, instead of one quixstreams reducer call per trade.
+
+It gives the same candles as the streaming path, a tumbling window with `.final()`,
+with the `trade_count`, `notional` and `buy_volume` the indicators need (see
+`src.indicators`):
+- windows are [start, end), and the candle timestamp is the end of the window
+- every product has its own watermark, the largest trade timestamp we saw for it.
+  A window is finished (and emitted) once the watermark reaches its end
+- trades of a window the watermark of their partition passed are late, and dropped.
+  quixstreams 2.x closes the windows on the largest timestamp of the partition, so
+  with several products in a partition it drops the trades of a product that lags
+  behind the others (see `src.lateness`), and so do we. Without partitions, every
+  product is on its own, like with one product per partition
+- the window that is still open at the end of a batch carries over to the next one
+- like `update_ohlcv_candle`, a candle has a `buy_volume` if the first trade of its
+  window has a `side`, and it sums the quantity of the buy trades of the window
+"""
+import struct
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import orjson
+
+from src.wire_format import TRADE_SCHEMA, decode
+
+_HEADER = struct.Struct("<cB")
+# the fixed layouts of the binary trades, by version (see `src.wire_format`).
+# We only read timestamp_ms, price and quantity, the first fields of both
+_TRADE_SIZES = {1: struct.calcsize("<qdd"), 2: struct.calcsize("<qddq")}
+_TRADE_PREFIX = struct.Struct("<qdd")
+
+# product (or partition) codes go in the bits above the timestamp, to take
+# per-product running maxima of the timestamps with one `np.maximum.accumulate`
+_TIMESTAMP_BITS = 44
+_TIMESTAMP_MASK = (1 << _TIMESTAMP_BITS) - 1
+
+# the side of the trades, in the arrays of `decode_trades`
+BUY, SELL, NO_SIDE = 1, 0, -1
+
+
+def decode_trades(
+    values: List[bytes],
+) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Decodes the values of a batch of trade messages (binary or JSON) into columns.
+
+    Args:
+        values (List[bytes]): The message values.
+
+    Returns:
+        Tuple[List[str], np.ndarray, np.ndarray, np.ndarray, np.ndarray]: The product
+            id, timestamp_ms, price, quantity and side (BUY, SELL or NO_SIDE) of
+            every trade.
+    """
+    if all(value[:1] == b"{" for value in values):
+        # parse the whole batch of JSON messages in one call
+        trades = orjson.loads(b"[" + b",".join(values) + b"]")
+        return (
+            [trade["product_id"] for trade in trades],
+            np.array([trade["timestamp_ms"] for trade in trades], dtype=np.int64),
+            np.array([trade["price"] for trade in trades], dtype=np.float64),
+            np.array([trade["quantity"] for trade in trades], dtype=np.float64),
+            np.array([_side(trade) for trade in trades], dtype=np.int8),
+        )
+
+    product_ids = []
+    timestamp_ms = []
+    price = []
+    quantity = []
+    side = []
+
+    # the offset of the product id, after the header and the fixed layout
+    offsets = {
+        _HEADER.pack(TRADE_SCHEMA, version): _HEADER.size + size
+        for version, size in _TRADE_SIZES.items()
+    }
+    unpack_from = _TRADE_PREFIX.unpack_from
+    for value in values:
+        offset = offsets.get(value[:2])
+        if offset is not None and offset + 1 + value[offset] == len(value):
+            # the fixed layout of the binary format, without building a dictionary.
+            # Messages with extra fields, like the `side`, have a JSON tail
+            ts, p, q = unpack_from(value, _HEADER.size)
+            product_ids.append(value[offset + 1:].decode())
+            s = NO_SIDE
+        else:
+            trade = orjson.loads(value) if value[:1] == b"{" else decode(value)
+            ts, p, q = trade["timestamp_ms"], trade["price"], trade["quantity"]
+            product_ids.append(trade["product_id"])
+            s = _side(trade)
+        timestamp_ms.append(ts)
+        price.append(p)
+        quantity.append(q)
+        side.append(s)
+
+    return (
+        product_ids,
+        np.array(timestamp_ms, dtype=np.int64),
+        np.array(price, dtype=np.float64),
+        np.array(quantity, dtype=np.float64),
+        np.array(side, dtype=np.int8),
+    )
+
+
+def _side(trade: dict) -> int:
+    if "side" not in trade:
+        return NO_SIDE
+    return BUY if trade["side"] == "buy" else SELL
+
+
+class BatchOhlcvEngine:
+    """
+    Turns batches of trades into finished OHLCV candles, see the module docstring.
+    """
+
+    def __init__(self, window_seconds: int) -> None:
+        """
+        Args:
+            window_seconds (int): The size of the OHLCV windows in seconds.
+
+        Returns:
+            None
+        """
+        self.window_ms = window_seconds * 1000
+
+        # per product: the largest trade timestamp, and the candle of the open window
+        self.watermarks: Dict[str, int] = {}
+        self.open_candles: Dict[str, dict] = {}
+        # per partition: the largest trade timestamp, the one late trades are late on
+        self.partition_watermarks: Dict[int, int] = {}
+
+        # number of trades we dropped because their window was finished
+        self.late_trades = 0
+
+    def process(
+        self,
+        product_ids: List[str],
+        timestamp_ms: np.ndarray,
+        price: np.ndarray,
+        quantity: np.ndarray,
+        side: Optional[np.ndarray] = None,
+        partition: Optional[np.ndarray] = None,
+    ) -> List[dict]:
+        """
+        Adds a batch of trades, in the order we consumed them, and returns the
+        candles of the windows they finished.
+
+        Args:
+            product_ids (List[str]): The product id of every trade.
+            timestamp_ms (np.ndarray): The timestamp of every trade.
+            price (np.ndarray): The price of every trade.
+            quantity (np.ndarray): The quantity of every trade.
+            side (Optional[np.ndarray]): The side of every trade: BUY, SELL or
+                NO_SIDE. None means the trades have no side.
+            partition (Optional[np.ndarray]): The Kafka partition of every trade.
+                None means every product is in a partition of its own.
+
+        Returns:
+            List[dict]: The finished candles, like the ones of the streaming path.
+        """
+        if len(product_ids) == 0:
+            return []
+        if side is None:
+            side = np.full(len(product_ids), NO_SIDE, dtype=np.int8)
+
+        # the watermark of the partition before each trade, in the order we consumed
+        # them. The late trades are behind it, so they never move it, and it is the
+        # running maximum of all the trades of the partition
+        partition_watermark_before = None
+        if partition is not None:
+            partition = np.asarray(partition, dtype=np.int64)
+            partitions = np.unique(partition).tolist()
+            carried = np.array(
+                [self.partition_watermarks.get(p, -1) for p in partitions], dtype=np.int64
+            )
+            partition_codes = np.searchsorted(partitions, partition)
+            partition_order = np.argsort(partition_codes, kind="stable")
+            partition_codes = partition_codes[partition_order]
+            before, after, last = _running_watermarks(
+                partition_codes, timestamp_ms[partition_order], carried
+            )
+            partition_watermark_before = np.empty_like(before)
+            partition_watermark_before[partition_order] = before
+            for code, watermark in zip(partition_codes[last].tolist(), after[last].tolist()):
+                self.partition_watermarks[partitions[code]] = watermark
+
+        # intern the product ids into codes, and sort the trades by product,
+        # keeping the order of the trades of each product
+        codes_of = {}
+        codes = np.array(
+            [codes_of.setdefault(product_id, len(codes_of)) for product_id in product_ids],
+            dtype=np.int64,
+        )
+        products = list(codes_of)
+        order = np.argsort(codes, kind="stable")
+        codes = codes[order]
+        timestamp_ms = timestamp_ms[order]
+        price = price[order]
+        quantity = quantity[order]
+        side = side[order]
+
+        # the watermark of the product before each trade
+        carried = np.array([self.watermarks.get(product, -1) for product in products], dtype=np.int64)
+        watermark_before, watermark_after, last_of_product = _running_watermarks(
+            codes, timestamp_ms, carried
+        )
+        if partition_watermark_before is not None:
+            watermark_before = partition_watermark_before[order]
+
+        # drop the trades of finished windows
+        window_end = timestamp_ms // self.window_ms * self.window_ms + self.window_ms
+        on_time = window_end > watermark_before
+        self.late_trades += int((~on_time).sum())
+
+        final_watermarks = watermark_after[last_of_product]
+        for code, watermark in zip(codes[last_of_product].tolist(), final_watermarks.tolist()):
+            self.watermarks[products[code]] = watermark
+
+        codes = codes[on_time]
+        window_end = window_end[on_time]
+        price = price[on_time]
+        quantity = quantity[on_time]
+        side = side[on_time]
+
+        # one group per product and window. The windows of the on-time trades of a
+        # product never go back, so the groups are contiguous
+        candles = []
+        sums = starts = None
+        if len(codes) > 0:
+            starts = np.flatnonzero(
+                np.concatenate([[True], (codes[1:] != codes[:-1]) | (window_end[1:] != window_end[:-1])])
+            )
+            ends = np.append(starts[1:], len(codes)) - 1
+
+            # np.add.reduceat sums pairwise, and bincount one trade after the other,
+            # like the streaming reducer, so the sums are exactly the same
+            group = np.repeat(np.arange(len(starts)), ends - starts + 1)
+            sums = {
+                "volume": quantity,
+                "notional": price * quantity,
+                "buy_volume": np.where(side == BUY, quantity, 0.0),
+            }
+            volume = np.bincount(group, weights=sums["volume"])
+            notional = np.bincount(group, weights=sums["notional"])
+            buy_volume = np.bincount(group, weights=sums["buy_volume"])
+            candles = [
+                {
+                    "open": open_,
+                    "high": high,
+                    "low": low,
+                    "close": close,
+                    "volume": volume,
+                    "product_id": products[code],
+                    "timestamp_ms": end_ms,
+                    "trade_count": trade_count,
+                    "notional": notional,
+                }
+                for code, end_ms, open_, high, low, close, volume, trade_count, notional in zip(
+                    codes[starts].tolist(),
+                    window_end[starts].tolist(),
+                    price[starts].tolist(),
+                    np.maximum.reduceat(price, starts).tolist(),
+                    np.minimum.reduceat(price, starts).tolist(),
+                    price[ends].tolist(),
+                    volume.tolist(),
+                    (ends - starts + 1).tolist(),
+                    notional.tolist(),
+                )
+            ]
+            # the first trade of the window decides, like in the streaming reducer
+            for candle, has_side, buy in zip(
+                candles, (side[starts] != NO_SIDE).tolist(), buy_volume.tolist()
+            ):
+                if has_side:
+                    candle["buy_volume"] = buy
+
+        return self._merge_with_open_candles(candles, sums, starts, products)
+
+    def _merge_with_open_candles(
+        self,
+        candles: List[dict],
+        sums: Optional[Dict[str, np.ndarray]],
+        starts: Optional[np.ndarray],
+        products: List[str],
+    ) -> List[dict]:
+        """
+        Merges the candles of a batch with the open candles of the previous batches,
+        keeps the ones that are still open, and returns the finished ones.
+        """
+        finished = []
+        for i, candle in enumerate(candles):
+            product_id = candle["product_id"]
+            open_candle = self.open_candles.pop(product_id, None)
+            if open_candle is not None:
+                if open_candle["timestamp_ms"] == candle["timestamp_ms"]:
+                    candle = _merge(open_candle, candle)
+                    # add the trades one by one to the sums of the open candle, in
+                    # the same order as the streaming reducer
+                    end = starts[i + 1] if i + 1 < len(starts) else len(sums["volume"])
+                    for field, values in sums.items():
+                        if field not in candle:
+                            continue
+                        candle[field] = float(
+                            np.cumsum(np.append(open_candle[field], values[starts[i]:end]))[-1]
+                        )
+                else:
+                    finished.append(open_candle)
+
+            if candle["timestamp_ms"] > self.watermarks[product_id]:
+                self.open_candles[product_id] = candle
+            else:
+                finished.append(candle)
+
+        # open candles of the previous batches whose window the watermark passed
+        for product_id in products:
+            open_candle = self.open_candles.get(product_id)
+            if open_candle is not None and open_candle["timestamp_ms"] <= self.watermarks[product_id]:
+                finished.append(self.open_candles.pop(product_id))
+
+        return finished
+
+    def flush(self) -> List[dict]:
+        """
+        Returns the candles of the windows that are still open, and forgets them.
+        For when there are no more trades to come, like at the end of a backfill.
+        """
+        candles = list(self.open_candles.values())
+        self.open_candles = {}
+        return candles
+
+    def state_dict(self) -> dict:
+        """
+        Returns the state we need to carry on after a restart.
+        """
+        return {
+            "watermarks": self.watermarks,
+            "open_candles": self.open_candles,
+            # JSON keys are strings
+            "partition_watermarks": {str(p): w for p, w in self.partition_watermarks.items()},
+        }
+
+    def load_state_dict(self, state: Optional[dict]) -> None:
+        """
+        Restores the state returned by `state_dict`.
+        """
+        if state:
+            self.watermarks = dict(state["watermarks"])
+            self.open_candles = dict(state["open_candles"])
+            self.partition_watermarks = {
+                int(p): w for p, w in state.get("partition_watermarks", {}).items()
+            }
+
+
+def _running_watermarks(
+    codes: np.ndarray, timestamp_ms: np.ndarray, carried: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The watermark (the largest timestamp so far) of the group of every trade, before
+    and after it.
+
+    Args:
+        codes (np.ndarray): The group of every trade, sorted, with the trades of
+            each group in the order we consumed them.
+        timestamp_ms (np.ndarray): The timestamp of every trade.
+        carried (np.ndarray): The watermark of every group before these trades,
+            -1 if there is none.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: The watermark before and after
+            every trade, and the index of the last trade of every group.
+    """
+    running_max = np.maximum.accumulate((codes << _TIMESTAMP_BITS) | timestamp_ms) & _TIMESTAMP_MASK
+    watermark_after = np.maximum(running_max, carried[codes])
+    watermark_before = np.empty_like(watermark_after)
+    watermark_before[1:] = watermark_after[:-1]
+    is_first = np.ones(len(codes), dtype=bool)
+    is_first[1:] = codes[1:] != codes[:-1]
+    watermark_before[is_first] = carried[codes[is_first]]
+    last = np.flatnonzero(np.append(codes[1:] != codes[:-1], True))
+    return watermark_before, watermark_after, last
+
+
+def _merge(candle: dict, later: dict) -> dict:
+    """
+    Merges two candles of the same window, `later` with the later trades.
+    """
+    merged = {
+        "open": candle["open"],
+        "high": max(candle["high"], later["high"]),
+        "low": min(candle["low"], later["low"]),
+        "close": later["close"],
+        "volume": candle["volume"] + later["volume"],
+        "product_id": candle["product_id"],
+        "timestamp_ms": candle["timestamp_ms"],
+        "trade_count": candle["trade_count"] + later["trade_count"],
+        "notional": candle["notional"] + later["notional"],
+    }
+    if "buy_volume" in candle:
+        merged["buy_volume"] = candle["buy_volume"] + later.get("buy_volume", 0.0)
+    return merged
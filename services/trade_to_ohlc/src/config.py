@@ -1,12 +1,63 @@
-from typing import Optional
+from typing import List, Optional
 from pydantic_settings import BaseSettings
 
 class AppConfig(BaseSettings):
     kafka_broker_address: str
     kafka_input_topic: str
     kafka_output_topic: str
+    # "json" or "binary", see src/wire_format.py
+    kafka_output_value_format: str = "json"
     kafka_consumer_group: str
+    # provisioning of the topics when they do not exist yet, see src/topics.py. The
+    # input topic should have the partitions the trade_producer creates it with
+    kafka_input_topic_partitions: int = 1
+    kafka_output_topic_partitions: int = 1
+    kafka_topic_replication_factor: int = 1
+    kafka_output_topic_retention_ms: Optional[int] = None
     ohlcv_window_seconds: int
+    # coarser windows, in seconds, rolled up from the ohlcv_window_seconds candles
+    # in the same pass, like [300, 900, 3600]. They go to the same output topic, with
+    # a resolution_seconds field, so the sinks must key the candles by it too
+    ohlcv_rollup_window_seconds: List[int] = []
+    # if set, the streaming engine also emits the candles of the open windows, at most
+    # one per product every ohlcv_partial_throttle_ms, with an is_final field
+    ohlcv_partial_throttle_ms: Optional[int] = None
+    # flat candles for the windows without trades, see src/gap_filler.py. On the
+    # trade timestamps, and also on the wall clock if ohlcv_gap_fill_wall_clock (live)
+    ohlcv_gap_fill: bool = False
+    ohlcv_gap_fill_delay_ms: int = 5_000
+    ohlcv_gap_fill_wall_clock: bool = False
+    # indicators added to the candles, like ["ema_12", "rsi_14", "volatility_20", "vwap",
+    # "trade_count"], see src/indicators.py
+    ohlcv_indicators: List[str] = []
+    # out-of-order trades, see src/lateness.py. A window takes trades until
+    # ohlcv_grace_ms after its end (in event time), and its candle comes out then.
+    # The trades of closed windows go to kafka_late_trades_topic (in
+    # kafka_output_value_format), up to ohlcv_allowed_lateness_ms after their window
+    # closed, and the others are dropped.
+    # Streaming engine only
+    ohlcv_grace_ms: int = 0
+    ohlcv_allowed_lateness_ms: int = 0
+    kafka_late_trades_topic: Optional[str] = None
+
+    # "streaming" (quixstreams tumbling windows), "batch" (NumPy, for historical
+    # mode, see src/batch_engine.py) or "offline" (see below)
+    ohlcv_engine: str = "streaming"
+    # streaming engine: number of worker processes in the consumer group, up to the
+    # partitions of the input topic, see src/launcher.py. Each keeps the state of its
+    # partitions in its own directory under state_dir
+    ohlcv_n_workers: int = 1
+    state_dir: str = "state"
+    ohlcv_batch_size: int = 100_000
+    ohlcv_batch_state_path: str = "state/ohlcv_batch.json"
+
+    # "offline" engine: candles straight from the trade cache of the trade_producer,
+    # see src/offline_backfill.py. The sink is "kafka" (kafka_output_topic) or "parquet"
+    offline_cache_dir: Optional[str] = None
+    offline_product_ids: Optional[List[str]] = None
+    offline_sink: str = "kafka"
+    offline_output_dir: str = "ohlcv"
+    offline_n_workers: Optional[int] = None
 
     # One way:
     class Config:
@@ -0,0 +1,279 @@
+"""
+Fills the windows without trades with flat candles: open, high, low and close at
+the last price of the product, and zero volume. So every product has one candle
+per window, and the readers downstream can look them up without misses.
+
+A window of a product is empty once
+- a trade of the product comes in for a later window (the tumbling window drops
+  the trades of the earlier ones from then on), or
+- the last trade we saw of the product is in an earlier window, and the watermark
+  passed the end of the window, plus `delay_ms` for the trades that are still on
+  their way
+
+The watermark is either the largest trade timestamp we saw, across products (event
+time, so the job gives the same candles on a replay), or the wall clock, for live
+mode, so the windows of an idle input are filled too.
+
+The window of the last trade of a product is not empty: its candle comes out of
+the tumbling window, with `.final()` on the next trade of the product, or right
+away as a partial candle (see `src.partial_candles`).
+
+Only the base window is filled. As the flat candles can come out before that last
+candle with trades, the sinks must upsert by (`product_id`, `timestamp_ms`), like
+for the partial candles, and not rely on the order of the candles.
+
+The flat candles have the same fields as the candles with trades, with a zero
+`trade_count`. With indicators, they go through the indicator state of their
+product (see `src.indicators`), like the next candle with trades does: the
+indicators of a flat candle are the ones of a window without trades. The gap
+filler keeps a copy of the indicator state of every product after its last
+candle, as the flat candles come out on the messages of other products too.
+
+The window and price of the last trade of every product, and the last window
+filled, also live in the state of the product key, so they survive a restart or
+a move of the partition to another worker. The gap filler reads them back on the
+first trade of the product it sees, and fills the windows between its last trade
+before and its first trade after. Until then, after a restart, the product is not
+filled on the watermark. The windows filled on the messages of other products are
+only saved on the next trade of the product, so a restart may fill some of them
+again, which the upserts of the sinks absorb.
+
+It needs every trade of its products, so it runs with a single worker (see
+`src.launcher`): a worker would go on filling the products of the partitions
+another worker took over.
+"""
+import copy
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from src.indicators import INDICATORS_KEY, Indicators, strip_aggregates
+from src.rollup import DictState
+
+# state key, next to the ones of the rollups, partial candles and indicators
+GAP_FILLER_KEY = "gap_filler"
+
+
+class GapFiller:
+    """
+    Keeps, per product, the window and price of the last trade, and the last window
+    we emitted a candle for, and returns the flat candles of the empty windows.
+    They are in memory, and saved to the state of the product key (see the module
+    docstring).
+
+    It is shared by the streaming pipeline and the wall clock thread, so every
+    method takes a lock.
+    """
+
+    # max number of flat candles of a product in one go, in case a bad timestamp
+    # pushes the watermark far into the future
+    MAX_FILL_WINDOWS = 10_000
+
+    def __init__(
+        self,
+        window_seconds: int,
+        delay_ms: int = 0,
+        indicators: Optional[Indicators] = None,
+    ) -> None:
+        """
+        Args:
+            window_seconds (int): The size of the OHLCV windows in seconds.
+            delay_ms (int): How long after the end of a window we wait for its trades.
+            indicators (Optional[Indicators]): The indicators of the candles, if any.
+
+        Returns:
+            None
+        """
+        self.window_ms = window_seconds * 1000
+        self.delay_ms = delay_ms
+        self.indicators = indicators
+
+        # per product: end of the window of the last trade, and its last price
+        self._last_trade_window_ms: Dict[str, int] = {}
+        self._last_price: Dict[str, float] = {}
+        # per product: end of the last window we emitted a candle for
+        self._filled_until_ms: Dict[str, int] = {}
+        # largest trade timestamp, across products
+        self._watermark_ms: Optional[int] = None
+        # flat candles of the windows a later trade showed empty, not returned yet,
+        # with the window of the last trade before them
+        self._pending: List[Tuple[int, List[dict]]] = []
+        # per product: a copy of its indicator state, after its last candle
+        self._indicator_states: Dict[str, dict] = {}
+
+        self._lock = threading.Lock()
+
+    def observe_trade(self, trade: dict, state: Optional[Any] = None) -> None:
+        """
+        Records a trade, before it goes into the window.
+
+        Args:
+            trade (dict): The trade.
+            state (Optional[Any]): The quixstreams `State` of the product key, where
+                we save the product, and read it back from after a restart.
+
+        Returns:
+            None
+        """
+        product_id = trade["product_id"]
+        end_ms = trade["timestamp_ms"] // self.window_ms * self.window_ms + self.window_ms
+        with self._lock:
+            if state is not None and product_id not in self._last_trade_window_ms:
+                self._restore(product_id, state)
+
+            last_end_ms = self._last_trade_window_ms.get(product_id)
+            if last_end_ms is not None and end_ms > last_end_ms:
+                # the windows between the last trade and this one are empty
+                self._pending.append(
+                    (last_end_ms, self._flat_candles(product_id, end_ms - self.window_ms))
+                )
+
+            # the close of a window is the last trade that comes in for it
+            if last_end_ms is None or end_ms >= last_end_ms:
+                self._last_trade_window_ms[product_id] = end_ms
+                self._last_price[product_id] = trade["price"]
+            if self._watermark_ms is None or trade["timestamp_ms"] > self._watermark_ms:
+                self._watermark_ms = trade["timestamp_ms"]
+            if state is not None:
+                self._save(product_id, state)
+
+    def on_candle(self, candle: dict, state: Optional[Any] = None) -> List[dict]:
+        """
+        Takes a finished candle, and returns it, after the flat candles of every
+        product up to the current (event time) watermark.
+
+        Args:
+            candle (dict): A finished candle of the base window.
+            state (Optional[Any]): The quixstreams `State` of the product of the
+                candle, with its indicator state once the candle went through it.
+
+        Returns:
+            List[dict]: The flat candles, then the candle.
+        """
+        with self._lock:
+            product_id = candle["product_id"]
+            self._filled_until_ms[product_id] = max(
+                self._filled_until_ms.get(product_id, candle["timestamp_ms"]),
+                candle["timestamp_ms"],
+            )
+            if state is not None:
+                if self.indicators is not None and state.get(INDICATORS_KEY) is not None:
+                    self._indicator_states[product_id] = copy.deepcopy(state.get(INDICATORS_KEY))
+                if product_id in self._last_trade_window_ms:
+                    self._save(product_id, state)
+            watermark_ms = self._watermark_ms
+
+        flat_candles = self.fill(watermark_ms) if watermark_ms is not None else []
+        return flat_candles + [candle]
+
+    def fill(self, watermark_ms: int) -> List[dict]:
+        """
+        Returns the flat candles of the empty windows that end at or before
+        `watermark_ms - delay_ms`, for every product.
+
+        Args:
+            watermark_ms (int): The event time or wall clock time, in Unix milliseconds.
+
+        Returns:
+            List[dict]: The flat candles, in time order per product.
+        """
+        last_end_ms = (watermark_ms - self.delay_ms) // self.window_ms * self.window_ms
+
+        with self._lock:
+            runs, self._pending = self._pending, []
+            for product_id, trade_window_ms in self._last_trade_window_ms.items():
+                runs.append((trade_window_ms, self._flat_candles(product_id, last_end_ms)))
+            # the indicators now, not when a trade showed the windows empty, so
+            # they start from the state after the candle before them
+            return self._add_indicators(runs)
+
+    def _save(self, product_id: str, state: Any) -> None:
+        """
+        Saves what we know of a product to the state of its key.
+        """
+        state.set(GAP_FILLER_KEY, {
+            "last_trade_window_ms": self._last_trade_window_ms[product_id],
+            "last_price": self._last_price[product_id],
+            "filled_until_ms": self._filled_until_ms.get(product_id),
+        })
+
+    def _restore(self, product_id: str, state: Any) -> None:
+        """
+        Reads back what we saved of a product before a restart, if anything.
+        """
+        saved = state.get(GAP_FILLER_KEY)
+        if saved is None:
+            return
+        self._last_trade_window_ms[product_id] = saved["last_trade_window_ms"]
+        self._last_price[product_id] = saved["last_price"]
+        if saved["filled_until_ms"] is not None:
+            self._filled_until_ms[product_id] = saved["filled_until_ms"]
+        if self.indicators is not None and state.get(INDICATORS_KEY) is not None:
+            self._indicator_states[product_id] = copy.deepcopy(state.get(INDICATORS_KEY))
+
+    def _flat_candles(self, product_id: str, last_end_ms: int) -> List[dict]:
+        """
+        Returns the flat candles of `product_id` after its last trade and the last
+        window we emitted, up to the window that ends at `last_end_ms`.
+        """
+        trade_window_ms = self._last_trade_window_ms[product_id]
+        from_ms = max(self._filled_until_ms.get(product_id, trade_window_ms), trade_window_ms)
+        n_windows = (last_end_ms - from_ms) // self.window_ms
+        if n_windows <= 0:
+            return []
+        if n_windows > self.MAX_FILL_WINDOWS:
+            logger.warning(
+                f"Filling only the last {self.MAX_FILL_WINDOWS} of {n_windows} "
+                f"empty windows of {product_id}"
+            )
+            from_ms = last_end_ms - self.MAX_FILL_WINDOWS * self.window_ms
+
+        self._filled_until_ms[product_id] = last_end_ms
+        price = self._last_price[product_id]
+        return [
+            {
+                "open": price,
+                "high": price,
+                "low": price,
+                "close": price,
+                "volume": 0.0,
+                "product_id": product_id,
+                "timestamp_ms": end_ms,
+                "trade_count": 0,
+                "notional": 0.0,
+            }
+            for end_ms in range(from_ms + self.window_ms, last_end_ms + 1, self.window_ms)
+        ]
+
+    def _add_indicators(self, runs: List[Tuple[int, List[dict]]]) -> List[dict]:
+        """
+        Adds the indicators to runs of flat candles, in time order per product, from
+        a copy of the indicator state of their product. Without indicators, removes
+        the fields the candles with trades do not have either.
+
+        Every run comes after the window of the last trade before it, whose candle
+        may not have come out yet. Its close is the price of the flat candles, and
+        the indicators with a state only use the close, so we add that window to the
+        copy of the state first, if it is not in.
+        """
+        if self.indicators is None:
+            return [strip_aggregates(candle) for _, candles in runs for candle in candles]
+
+        states: Dict[str, DictState] = {}
+        with_indicators = []
+        for trade_window_ms, candles in runs:
+            for candle in candles:
+                product_id = candle["product_id"]
+                state = states.get(product_id)
+                if state is None:
+                    # a product without candles since we started starts from an empty
+                    # state, like in the indicator stage. After a restart, its flat
+                    # candles have the indicators of a new product, until its next candle
+                    indicator_state = copy.deepcopy(self._indicator_states.get(product_id, {}))
+                    state = states[product_id] = DictState({INDICATORS_KEY: indicator_state})
+
+                if trade_window_ms > state.get(INDICATORS_KEY).get("timestamp_ms", -1):
+                    self.indicators.add({**candle, "timestamp_ms": trade_window_ms}, state)
+                with_indicators.append(self.indicators.add(candle, state))
+        return with_indicators
@@ -0,0 +1,193 @@
+"""
+Technical indicators of the candles of each product, updated incrementally with
+every finished candle, so the services downstream get them with the candle and do
+not recompute them over the whole history.
+
+Indicators are configured by name, with their period in candles where they have one:
+
+- `ema_<n>`: exponential moving average of the close, with span `n`
+- `rsi_<n>`: relative strength index of the close, with Wilder's smoothing over `n`
+- `volatility_<n>`: standard deviation of the last `n` log returns of the close
+- `vwap`: volume weighted average price of the candle
+- `trade_count`: number of trades of the candle
+- `imbalance`: (buy volume - sell volume) / volume of the candle, only if the
+  trades have a `side`
+
+The indicators with a period are None until they have `n` values, like pandas with
+`min_periods=n`. They run on the series of every window, so a window without trades
+counts as a flat candle at the previous close, like the ones of `src.gap_filler`.
+
+The state of a product is a small JSON dictionary: updating it is O(1) per candle,
+and the `volatility_<n>` keeps its last `n` returns.
+"""
+import copy
+import math
+import re
+from typing import Any, List, Optional
+
+# the fields of the candles we only keep for the indicators
+AGGREGATE_FIELDS = ("trade_count", "notional", "buy_volume")
+
+# state key, next to the ones of the rollups and the partial candles
+INDICATORS_KEY = "indicators"
+
+_NAME = re.compile(r"^(ema|rsi|volatility)_([1-9][0-9]*)$|^(vwap|trade_count|imbalance)$")
+
+
+def strip_aggregates(candle: dict) -> dict:
+    """
+    Removes the fields we only keep for the indicators, when there are none.
+    """
+    for field in AGGREGATE_FIELDS:
+        candle.pop(field, None)
+    return candle
+
+
+class Indicators:
+    """
+    Computes the configured indicators, see the module docstring.
+    """
+
+    # max number of empty windows we go through at once, in case of a bad timestamp
+    MAX_GAP_WINDOWS = 10_000
+
+    def __init__(self, names: List[str], window_seconds: int) -> None:
+        """
+        Args:
+            names (List[str]): The indicators, like ["ema_12", "rsi_14", "vwap"].
+            window_seconds (int): The size of the OHLCV windows in seconds.
+
+        Raises:
+            ValueError: If an indicator name is not one of the above.
+        """
+        self.names = names
+        self.window_ms = window_seconds * 1000
+
+        # (name, kind, period) of the indicators with a state
+        self._stateful = []
+        for name in names:
+            match = _NAME.match(name)
+            if match is None:
+                raise ValueError(f"Invalid indicator {name}")
+            if match.group(1):
+                self._stateful.append((name, match.group(1), int(match.group(2))))
+
+    def add(self, candle: dict, state: Any) -> dict:
+        """
+        Adds the indicators to a candle, and updates the state of its product with
+        it if it is a final candle.
+
+        Args:
+            candle (dict): A candle, with the `trade_count` and `notional` of its trades.
+            state (Any): Where we keep the state of the product, like the quixstreams
+                `State` of the message key. Anything with `get` and `set` works.
+
+        Returns:
+            dict: The candle with the indicators, without the aggregate fields.
+        """
+        product_state = state.get(INDICATORS_KEY) or {}
+
+        if not candle.get("is_final", True) or \
+                candle["timestamp_ms"] <= product_state.get("timestamp_ms", -1):
+            # a partial candle, or a late one: the indicators as if it was the next
+            # candle, without changing the state
+            product_state = copy.deepcopy(product_state)
+            values = self._update(product_state, candle)
+        else:
+            values = self._update(product_state, candle)
+            state.set(INDICATORS_KEY, product_state)
+
+        return {**strip_aggregates(dict(candle)), **values}
+
+    def _update(self, state: dict, candle: dict) -> dict:
+        """
+        Updates the state with the windows without trades before the candle, and
+        the candle, and returns the indicators of the candle.
+        """
+        last_ms = state.get("timestamp_ms")
+        if last_ms is not None:
+            n_empty = (candle["timestamp_ms"] - last_ms) // self.window_ms - 1
+            for _ in range(min(n_empty, self.MAX_GAP_WINDOWS)):
+                self._update_stateful(state, state["close"])
+
+        values = self._update_stateful(state, candle["close"])
+        state["timestamp_ms"] = max(candle["timestamp_ms"], last_ms or -1)
+
+        volume = candle["volume"]
+        for name in self.names:
+            if name == "vwap":
+                values[name] = candle["notional"] / volume if volume > 0 else None
+            elif name == "trade_count":
+                values[name] = candle["trade_count"]
+            elif name == "imbalance":
+                buy_volume = candle.get("buy_volume")
+                values[name] = (
+                    (2 * buy_volume - volume) / volume
+                    if buy_volume is not None and volume > 0 else None
+                )
+        return values
+
+    def _update_stateful(self, state: dict, close: float) -> dict:
+        """
+        Updates the indicators with a state with the close of the next window.
+        """
+        previous_close = state.get("close")
+        state["close"] = close
+
+        values = {}
+        for name, kind, n in self._stateful:
+            s = state.setdefault(name, {"count": 0})
+            if kind == "ema":
+                alpha = 2 / (n + 1)
+                s["value"] = close if s["count"] == 0 else alpha * close + (1 - alpha) * s["value"]
+                s["count"] += 1
+                values[name] = s["value"] if s["count"] >= n else None
+
+            elif kind == "rsi":
+                if previous_close is None:
+                    values[name] = None
+                    continue
+                gain = max(close - previous_close, 0.0)
+                loss = max(previous_close - close, 0.0)
+                if s["count"] == 0:
+                    s["gain"], s["loss"] = gain, loss
+                else:
+                    s["gain"] += (gain - s["gain"]) / n
+                    s["loss"] += (loss - s["loss"]) / n
+                s["count"] += 1
+                values[name] = _rsi(s["gain"], s["loss"]) if s["count"] >= n else None
+
+            elif kind == "volatility":
+                if previous_close is None:
+                    values[name] = None
+                    continue
+                returns = s.setdefault("returns", [])
+                log_return = math.log(close) - math.log(previous_close)
+                returns.append(log_return)
+                s["sum"] = s.get("sum", 0.0) + log_return
+                s["sum_sq"] = s.get("sum_sq", 0.0) + log_return * log_return
+                if len(returns) > n:
+                    oldest = returns.pop(0)
+                    s["sum"] -= oldest
+                    s["sum_sq"] -= oldest * oldest
+                s["count"] += 1
+                if s["count"] % n == 0:
+                    # recompute the running sums, so the rounding errors do not pile up
+                    s["sum"] = math.fsum(returns)
+                    s["sum_sq"] = math.fsum(r * r for r in returns)
+                values[name] = _std(s["sum"], s["sum_sq"], n) if len(returns) == n else None
+
+        return values
+
+
+def _rsi(gain: float, loss: float) -> float:
+    if loss == 0:
+        return 100.0 if gain > 0 else 50.0
+    return 100 - 100 / (1 + gain / loss)
+
+
+def _std(total: float, total_sq: float, n: int) -> Optional[float]:
+    if n < 2:
+        return None
+    return math.sqrt(max(total_sq - total * total / n, 0.0) / (n - 1))
+
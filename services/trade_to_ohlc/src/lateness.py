@@ -0,0 +1,136 @@
+"""
+Out-of-order trades of the streaming engine. The windows are in event time (the
+`timestamp_ms` of the trades), and the watermark of a product is the largest trade
+timestamp we saw for it. A window takes trades until the watermark passes its end
+plus `grace_ms`, and its candle comes out then. The trades of a window that closed
+are late:
+
+- up to `allowed_lateness_ms` after their window closed, they go to the late trades
+  topic, if there is one, so a backfill or a correction can take them into account
+- later than that, or without a late trades topic, they are dropped
+
+We filter the late trades out before they reach the quixstreams tumbling window,
+which would drop them, and count them. A larger grace period gives more complete
+candles, later.
+
+quixstreams 2.x (the version in poetry.lock) closes the windows on the largest
+timestamp of the partition, not of the key. With several products in a partition,
+the window drops the trades of a product that lags behind the others, so the
+streaming engine tells late trades apart on that same watermark of the partition,
+and every trade the window would drop goes to the late trades topic or is counted
+as dropped. We also count the ones that are late only because of the partition,
+on time for the watermark of their product.
+"""
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from loguru import logger
+
+# state key, next to the ones of the rollups, partial candles and indicators
+WATERMARK_KEY = "watermark_ms"
+
+ON_TIME = "on_time"
+LATE = "late"
+DROPPED = "dropped"
+# late for the watermark of the partition, but on time for the one of the product
+# (see above). These are counted as late or dropped too
+BEHIND_PARTITION = "behind_partition"
+
+
+class LateTrades:
+    """
+    Tells the late trades apart, and counts the on-time, late and dropped trades.
+    """
+
+    def __init__(
+        self,
+        window_seconds: int,
+        grace_ms: int = 0,
+        allowed_lateness_ms: int = 0,
+        has_late_trades_topic: bool = False,
+        log_every_sec: float = 60.0,
+    ) -> None:
+        """
+        Args:
+            window_seconds (int): The size of the OHLCV windows in seconds.
+            grace_ms (int): How long after its end a window takes trades.
+            allowed_lateness_ms (int): How long after its window closed a trade
+                goes to the late trades topic.
+            has_late_trades_topic (bool): Whether there is a late trades topic.
+            log_every_sec (float): How often we log the counters.
+
+        Returns:
+            None
+        """
+        if grace_ms < 0 or allowed_lateness_ms < 0:
+            raise ValueError("The grace period and allowed lateness can not be negative")
+
+        self.window_ms = window_seconds * 1000
+        self.grace_ms = grace_ms
+        self.allowed_lateness_ms = allowed_lateness_ms
+        self.has_late_trades_topic = has_late_trades_topic
+        self.log_every_sec = log_every_sec
+
+        self.counts: Dict[str, int] = {ON_TIME: 0, LATE: 0, DROPPED: 0, BEHIND_PARTITION: 0}
+        self._last_log_time = time.monotonic()
+
+    def check(
+        self,
+        trade: dict,
+        state: Any,
+        partition_watermark_ms: Optional[int] = None,
+    ) -> Tuple[str, int]:
+        """
+        Tells if a trade is on time, late or dropped, and updates the watermark of
+        its product with it if it is on time.
+
+        Args:
+            trade (dict): The trade.
+            state (Any): Where we keep the watermark of the product, like the
+                quixstreams `State` of the message key.
+            partition_watermark_ms (Optional[int]): The largest timestamp the window
+                took in the partition of the trade. If given, the trade is late on it,
+                like the window decides (see the module docstring), instead of on the
+                watermark of the product.
+
+        Returns:
+            Tuple[str, int]: ON_TIME, LATE or DROPPED, and how long after its window
+                closed the trade came in, in event time (0 if it is on time).
+        """
+        product_watermark_ms = state.get(WATERMARK_KEY)
+        end_ms = trade["timestamp_ms"] // self.window_ms * self.window_ms + self.window_ms
+        is_on_time_for_product = (
+            product_watermark_ms is None or end_ms + self.grace_ms > product_watermark_ms
+        )
+        watermark_ms = product_watermark_ms if partition_watermark_ms is None else partition_watermark_ms
+
+        if watermark_ms is None or end_ms + self.grace_ms > watermark_ms:
+            verdict, late_by_ms = ON_TIME, 0
+            if product_watermark_ms is None or trade["timestamp_ms"] > product_watermark_ms:
+                state.set(WATERMARK_KEY, trade["timestamp_ms"])
+        else:
+            late_by_ms = watermark_ms - end_ms - self.grace_ms
+            verdict = (
+                LATE
+                if self.has_late_trades_topic and late_by_ms <= self.allowed_lateness_ms
+                else DROPPED
+            )
+            if is_on_time_for_product:
+                self.counts[BEHIND_PARTITION] += 1
+
+        self.counts[verdict] += 1
+        if time.monotonic() - self._last_log_time >= self.log_every_sec:
+            self.log()
+        return verdict, late_by_ms
+
+    def log(self) -> None:
+        """
+        Logs the counters.
+        """
+        self._last_log_time = time.monotonic()
+        logger.info(
+            f"{self.counts[ON_TIME]:,} trades on time, {self.counts[LATE]:,} late "
+            f"(to the late trades topic), {self.counts[DROPPED]:,} dropped, "
+            f"{self.counts[BEHIND_PARTITION]:,} of the late and dropped ones on time "
+            f"for their product"
+        )
@@ -0,0 +1,72 @@
+"""
+Runs several workers of the streaming engine, one process each, in the same consumer
+group. Kafka spreads the partitions of the input topic over them, and quixstreams
+keeps the state of every partition (backed up to its changelog topic), so a
+partition takes its windows, rollups and indicators along when it moves to another
+worker. One Python process is bound to one CPU: with N workers (and at least N
+partitions, see `src.topics`) the aggregation scales with the CPUs.
+
+Each worker has its own state directory, so two workers never open the state of
+the same partition, even while a partition moves between them.
+"""
+import signal
+import sys
+from multiprocessing import Process
+from multiprocessing.connection import wait
+from pathlib import Path
+from typing import Callable
+
+from loguru import logger
+
+
+def worker_state_dir(state_dir: str, worker: int) -> str:
+    """
+    Returns the state directory of a worker.
+    """
+    return str(Path(state_dir) / f"worker-{worker}")
+
+
+def run_workers(
+    target: Callable[..., None],
+    n_workers: int,
+    worker_kwargs: Callable[[int], dict],
+) -> None:
+    """
+    Runs `target` in `n_workers` processes, until they all stop. If one of them
+    fails, it stops the others, so the container restarts them all.
+
+    Args:
+        target (Callable[..., None]): What every worker runs, like
+            `transform_trade_to_ohlcv`
+        n_workers (int): The number of processes
+        worker_kwargs (Callable[[int], dict]): The keyword arguments of `target`
+            for every worker, from its number
+
+    Raises:
+        RuntimeError: If a worker failed.
+    """
+    # stopping the launcher (docker stop) stops the workers too
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    processes = [
+        Process(target=target, kwargs=worker_kwargs(worker), name=f"worker-{worker}")
+        for worker in range(n_workers)
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f"Started {n_workers} workers")
+
+    try:
+        running = processes
+        while running:
+            stopped = wait([process.sentinel for process in running])
+            running = [process for process in running if process.sentinel not in stopped]
+            for process in processes:
+                if process.exitcode not in (None, 0):
+                    raise RuntimeError(f"{process.name} failed with exit code {process.exitcode}")
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
@@ -1,35 +1,86 @@
 
-from quixstreams import Application
+from quixstreams import Application, message_context
+from quixstreams.state.rocksdb import RocksDBOptions
 from datetime import timedelta
+import threading
+import time
+from pathlib import Path
 from loguru import logger
-from typing import Any, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
-def init_ohlcv_candle(trade: dict):
+import numpy as np
+import orjson
+from confluent_kafka import TopicPartition
+
+from src.batch_engine import BatchOhlcvEngine, decode_trades
+from src.gap_filler import GapFiller
+from src.indicators import Indicators, strip_aggregates
+from src.launcher import run_workers, worker_state_dir
+from src.lateness import LATE, ON_TIME, WATERMARK_KEY, LateTrades
+from src.partial_candles import throttle_partial_candle
+from src.rollup import DictState, check_rollup_windows, rollup_candle
+from src.topics import create_topic
+from src.window_state import (
+    BUY_VOLUME,
+    CLOSE,
+    HIGH,
+    LOW,
+    NOTIONAL,
+    TRADE_COUNT,
+    VOLUME,
+    WindowCandle,
+    candle_from_state,
+    dumps,
+    loads,
+    window_candle_from_dict,
+)
+from src.wire_format import (
+    OHLCV_SCHEMA,
+    VALUE_FORMATS,
+    BinaryDeserializer,
+    encode_ohlcv,
+    encode_trade,
+    get_value_serializer,
+)
+
+def init_ohlcv_candle(trade: dict) -> WindowCandle:
     """
-    Returns the initial OHLCV candle when the first trade in that window is received
+    Returns the initial OHLCV candle when the first trade in that window is received.
+    It is a compact `WindowCandle` (see `src.window_state`), without the product id,
+    which is the message key
     """
     #logger.debug(f"Initializing OHLCV candle with trade: {trade}")
-    initial_ohlcv_candle = {
-        "open": trade["price"],
-        "high": trade["price"],
-        "low": trade["price"],
-        "close": trade["price"],
-        "volume": trade["quantity"],
-        "product_id": trade["product_id"],
-    }
+    initial_ohlcv_candle = WindowCandle((
+        trade["price"],
+        trade["price"],
+        trade["price"],
+        trade["price"],
+        trade["quantity"],
+        # for the indicators, see src/indicators.py
+        1,
+        trade["price"] * trade["quantity"],
+    ))
+    if "side" in trade:
+        initial_ohlcv_candle.append(trade["quantity"] if trade["side"] == "buy" else 0.0)
     #logger.debug(f"Initial OHLCV candle: {initial_ohlcv_candle}")
     return initial_ohlcv_candle
 
-def update_ohlcv_candle(ohlcv_candle: dict, trade: dict):
+def update_ohlcv_candle(ohlcv_candle: WindowCandle, trade: dict) -> WindowCandle:
     """
     Updates the OHLCV candle with the new trade data
     """
     #logger.debug(f"Updating OHLCV candle with trade: {trade}")
-    ohlcv_candle["high"] = max(ohlcv_candle["high"], trade["price"])
-    ohlcv_candle["low"] = min(ohlcv_candle["low"], trade["price"])
-    ohlcv_candle["close"] = trade["price"]
-    ohlcv_candle["volume"] += trade["quantity"]
-    ohlcv_candle['product_id'] = trade['product_id']
+    if isinstance(ohlcv_candle, dict):
+        # a window of the previous versions of the service, still in the state store
+        ohlcv_candle = window_candle_from_dict(ohlcv_candle)
+    ohlcv_candle[HIGH] = max(ohlcv_candle[HIGH], trade["price"])
+    ohlcv_candle[LOW] = min(ohlcv_candle[LOW], trade["price"])
+    ohlcv_candle[CLOSE] = trade["price"]
+    ohlcv_candle[VOLUME] += trade["quantity"]
+    ohlcv_candle[TRADE_COUNT] += 1
+    ohlcv_candle[NOTIONAL] += trade["price"] * trade["quantity"]
+    if len(ohlcv_candle) > BUY_VOLUME and trade.get("side") == "buy":
+        ohlcv_candle[BUY_VOLUME] += trade["quantity"]
     #logger.debug(f"Updated OHLCV candle: {ohlcv_candle}")
 
     return ohlcv_candle
@@ -54,6 +105,17 @@ def transform_trade_to_ohlcv(
         kafka_output_topic: str,
         kafka_consumer_group: str,
         ohlcv_window_seconds: int,
+        kafka_output_value_format: str = "json",
+        ohlcv_rollup_window_seconds: Optional[List[int]] = None,
+        ohlcv_partial_throttle_ms: Optional[int] = None,
+        ohlcv_gap_fill: bool = False,
+        ohlcv_gap_fill_delay_ms: int = 5_000,
+        ohlcv_gap_fill_wall_clock: bool = False,
+        ohlcv_indicators: Optional[List[str]] = None,
+        state_dir: str = "state",
+        ohlcv_grace_ms: int = 0,
+        ohlcv_allowed_lateness_ms: int = 0,
+        kafka_late_trades_topic: Optional[str] = None,
 ):
     """
     Reads incoming trades from the given `kafka_input_topic`, aggregates them into OHLC data
@@ -64,69 +126,507 @@ def transform_trade_to_ohlcv(
         kafka_input_topic (str): The Kafka topic to read the trades from
         kafka_output_topic (str): The Kafka topic to save the OHLC data
         kafka_consumer_group (str): The Kafka consumer group to read the trades from
+        ohlcv_window_seconds (int): The size of the OHLCV windows in seconds
+        kafka_output_value_format (str): How we encode the candles: "json" or "binary"
+            (see `src.wire_format`). Input trades can be in either format.
+        ohlcv_rollup_window_seconds (Optional[List[int]]): Coarser windows (multiples
+            of `ohlcv_window_seconds`) we roll the candles up into, in the same pass.
+            If given, every candle has a `resolution_seconds` field, and sinks must
+            key the candles by it too.
+        ohlcv_partial_throttle_ms (Optional[int]): If given, we also emit the candles
+            of the open windows, at most one per product every `ohlcv_partial_throttle_ms`,
+            with an `is_final` field (see `src.partial_candles`). Sinks must upsert
+            by (`product_id`, `timestamp_ms`). None means only finished candles.
+        ohlcv_gap_fill (bool): Whether we emit flat candles for the windows of a product
+            without trades (see `src.gap_filler`), driven by the trade timestamps.
+        ohlcv_gap_fill_delay_ms (int): How long after the end of a window we wait for
+            its trades, before we fill it.
+        ohlcv_gap_fill_wall_clock (bool): Whether we also fill the empty windows on the
+            wall clock, from a background thread, so they are filled when the input is
+            idle. Only for live mode.
+        ohlcv_indicators (Optional[List[str]]): Indicators we add to every candle of the
+            base window, like ["ema_12", "rsi_14", "vwap"] (see `src.indicators`)
+        state_dir (str): Where quixstreams keeps the state of the partitions. One
+            per worker, see `src.launcher`
+        ohlcv_grace_ms (int): How long after its end (in event time) a window takes
+            the trades that come out of order, before its candle comes out
+            (see `src.lateness`)
+        ohlcv_allowed_lateness_ms (int): How long after its window closed a late
+            trade still goes to `kafka_late_trades_topic`, instead of being dropped
+        kafka_late_trades_topic (Optional[str]): The Kafka topic of the late trades,
+            with their `late_by_ms`, in `kafka_output_value_format`. None means they
+            are dropped
     
     Returns:
         None
     """
 
+    rollup_window_seconds = sorted(ohlcv_rollup_window_seconds or [])
+    check_rollup_windows(ohlcv_window_seconds, rollup_window_seconds)
+    indicators = (
+        Indicators(ohlcv_indicators, window_seconds=ohlcv_window_seconds)
+        if ohlcv_indicators else None
+    )
+
     app = Application(
         broker_address=kafka_broker_address, 
-        consumer_group=kafka_consumer_group)
+        consumer_group=kafka_consumer_group,
+        state_dir=state_dir,
+        # the windows are packed, see src/window_state.py
+        rocksdb_options=RocksDBOptions(dumps=dumps, loads=loads))
     
     
-    input_topic = app.topic(name=kafka_input_topic, value_deserializer='json',
+    input_topic = app.topic(name=kafka_input_topic, value_deserializer=BinaryDeserializer(),
                             timestamp_extractor=custom_ts_extractor)
-    output_topic = app.topic(name=kafka_output_topic, value_serializer='json')
+    output_topic = app.topic(
+        name=kafka_output_topic,
+        value_serializer=get_value_serializer(kafka_output_value_format, OHLCV_SCHEMA),
+    )
 
     # Create a Quix Streams DataFrame
     sdf = app.dataframe(input_topic)
 
+    # Take the late trades out before the window, which would drop them, and
+    # send them to their own topic, with a producer of their own
+    late_trades = LateTrades(
+        window_seconds=ohlcv_window_seconds,
+        grace_ms=ohlcv_grace_ms,
+        allowed_lateness_ms=ohlcv_allowed_lateness_ms,
+        has_late_trades_topic=kafka_late_trades_topic is not None,
+    )
+    late_trades_producer = app.get_producer() if kafka_late_trades_topic is not None else None
+    # the late trades are in the value format of the service
+    encode_late_trade = encode_trade if kafka_output_value_format == "binary" else orjson.dumps
+
+    # the state of the window, where quixstreams keeps the watermark of every partition
+    processing_context = sdf.processing_context
+
+    def partition_watermark_ms() -> int:
+        ctx = message_context()
+        # `window` is defined below, before the first message comes in
+        transaction = processing_context.checkpoint.get_store_transaction(
+            topic=ctx.topic, partition=ctx.partition, store_name=window.name
+        )
+        return transaction.get_latest_timestamp()
+
+    def is_on_time(trade: dict, state: Any) -> bool:
+        # late on the watermark the window closes on, so the trades the window would
+        # drop go to the late trades topic (or are counted as dropped)
+        verdict, late_by_ms = late_trades.check(
+            trade, state, partition_watermark_ms=partition_watermark_ms()
+        )
+        if verdict == LATE:
+            late_trades_producer.produce(
+                topic=kafka_late_trades_topic,
+                key=trade["product_id"].encode(),
+                value=encode_late_trade({**trade, "late_by_ms": late_by_ms}),
+            )
+            late_trades_producer.poll(0)
+        return verdict == ON_TIME
+
+    sdf = sdf.filter(is_on_time, stateful=True)
+
+    gap_filler = None
+    if ohlcv_gap_fill:
+        gap_filler = GapFiller(
+            window_seconds=ohlcv_window_seconds,
+            delay_ms=ohlcv_gap_fill_delay_ms,
+            indicators=indicators,
+        )
+        # the gap filler needs the last price and window of every product, which
+        # it also saves to the state of the product key
+        sdf = sdf.update(gap_filler.observe_trade, stateful=True)
+
     # Check if we are actually receiving the data
     #sdf.update(logger.debug)
 
     # Aggregate the trades into OHLCV candles (1 minute)
-    sdf = (
-         sdf.tumbling_window(duration_ms=timedelta(seconds=ohlcv_window_seconds))
+    window = (
+         sdf.tumbling_window(
+             duration_ms=timedelta(seconds=ohlcv_window_seconds),
+             grace_ms=timedelta(milliseconds=ohlcv_grace_ms),
+         )
          .reduce(reducer = update_ohlcv_candle, initializer = init_ohlcv_candle)
-         .final()
-         #.current()
      )
+    # .current() gives the candle of the open window after every trade
+    sdf = window.final() if ohlcv_partial_throttle_ms is None else window.current()
 
   #  breakpoint()
-    # Flatten the dictionary
-    sdf['open'] = sdf['value']['open']  
-    sdf['high'] = sdf['value']['high']
-    sdf['low'] = sdf['value']['low']
-    sdf['close'] = sdf['value']['close']
-    sdf['volume'] = sdf['value']['volume']
-    sdf['product_id'] = sdf['value']['product_id']
-    sdf['timestamp_ms'] = sdf['end']
+    # Flatten the window into a candle. The product is the message key, which
+    # the window state does not repeat
+    def to_candle(window: dict, key: Any, timestamp: int, headers: Any) -> dict:
+        product_id = key.decode() if isinstance(key, bytes) else key
+        candle = candle_from_state(window["value"], product_id, window["end"])
+        return candle if indicators is not None else strip_aggregates(candle)
 
-    
-    sdf = sdf[['product_id','timestamp_ms', 'open', 'high', 'low', 'close', 'volume']]
+    sdf = sdf.apply(to_candle, metadata=True)
+
+    if ohlcv_partial_throttle_ms is not None:
+        sdf = sdf.apply(
+            lambda candle, state: throttle_partial_candle(
+                candle,
+                state,
+                ohlcv_partial_throttle_ms,
+                watermark_ms=state.get(WATERMARK_KEY),
+                grace_ms=ohlcv_grace_ms,
+            ),
+            stateful=True,
+            expand=True,
+        )
+
+    if indicators is not None:
+        # the indicators of each product live in the state of the product key
+        sdf = sdf.apply(indicators.add, stateful=True)
+
+    def rollup(candle: dict, state: Any) -> List[dict]:
+        if not candle.get("is_final", True):
+            # partial candles are not rolled up, only the final version of each window
+            return [{**candle, "resolution_seconds": ohlcv_window_seconds}]
+        candles = rollup_candle(candle, state, ohlcv_window_seconds, rollup_window_seconds)
+        if ohlcv_partial_throttle_ms is not None:
+            candles = [{**candle, "is_final": True} for candle in candles]
+        return candles
+
+    if rollup_window_seconds:
+        # Derive the coarser candles from the finished base candles, instead of
+        # running one service (and reading the trades once more) per resolution.
+        # The unfinished coarse candles live in the state of the product key
+        sdf = sdf.apply(rollup, stateful=True, expand=True)
+
+    def fill_gaps(candle: dict, state: Any) -> List[dict]:
+        if not candle.get("is_final", True) or \
+                candle.get("resolution_seconds", ohlcv_window_seconds) != ohlcv_window_seconds:
+            return [candle]
+        # the flat candles get the same extra fields as the finished base candles
+        extra = {k: candle[k] for k in ("resolution_seconds", "is_final") if k in candle}
+        # and their indicators from the indicator state of their product
+        return [{**filled, **extra} for filled in gap_filler.on_candle(candle, state)]
+
+    if gap_filler is not None:
+        sdf = sdf.apply(fill_gaps, stateful=True, expand=True)
+
+        if ohlcv_gap_fill_wall_clock:
+            threading.Thread(
+                target=fill_gaps_on_wall_clock,
+                kwargs={
+                    "gap_filler": gap_filler,
+                    "producer": app.get_producer(),
+                    "topic": kafka_output_topic,
+                    "kafka_output_value_format": kafka_output_value_format,
+                    "extra": {
+                        **({"resolution_seconds": ohlcv_window_seconds} if rollup_window_seconds else {}),
+                        **({"is_final": True} if ohlcv_partial_throttle_ms is not None else {}),
+                    },
+                },
+                daemon=True,
+            ).start()
 
     # Print the output to the console
     sdf.update(logger.debug)
 
-    # Push the data to the output topic
-    sdf = sdf.to_topic(output_topic)
+    # Push the data to the output topic. The flat candles of the gap filler can be of
+    # another product than the message key, so the key is the product of the candle
+    sdf = sdf.to_topic(output_topic, key=lambda candle: candle["product_id"].encode())
 
     # Kick off the application
     app.run(sdf)
 
+    late_trades.log()
+    if late_trades_producer is not None:
+        late_trades_producer.flush()
+
+
+def fill_gaps_on_wall_clock(
+        gap_filler: GapFiller,
+        producer: Any,
+        topic: str,
+        kafka_output_value_format: str,
+        extra: dict,
+):
+    """
+    Produces the flat candles of the empty windows to `topic` on the wall clock,
+    once per second, for as long as the service runs.
+
+    Args:
+        gap_filler (GapFiller): The gap filler of the streaming pipeline
+        producer (Any): A quixstreams producer
+        topic (str): The Kafka topic to save the OHLC data
+        kafka_output_value_format (str): How we encode the candles: "json" or "binary"
+        extra (dict): Extra fields of the candles, like their `resolution_seconds`
+
+    Returns:
+        None
+    """
+    encode = encode_ohlcv if kafka_output_value_format == "binary" else orjson.dumps
+    while True:
+        time.sleep(1)
+        candles = gap_filler.fill(int(time.time() * 1000))
+        for candle in candles:
+            producer.produce(
+                topic=topic,
+                key=candle["product_id"].encode(),
+                value=encode({**candle, **extra}),
+            )
+        if candles:
+            producer.flush()
+            logger.debug(f"Filled {len(candles)} empty windows on the wall clock")
+
+
+def transform_trade_to_ohlcv_batch(
+        kafka_broker_address: str,
+        kafka_input_topic: str,
+        kafka_output_topic: str,
+        kafka_consumer_group: str,
+        ohlcv_window_seconds: int,
+        kafka_output_value_format: str = "json",
+        ohlcv_rollup_window_seconds: Optional[List[int]] = None,
+        batch_size: int = 100_000,
+        state_path: str = "state/ohlcv_batch.json",
+        ohlcv_indicators: Optional[List[str]] = None,
+):
+    """
+    Same as `transform_trade_to_ohlcv`, with the batch engine (see `src.batch_engine`):
+    it consumes up to `batch_size` trades at a time, and aggregates them with NumPy.
+    Meant for historical mode, where the trades are bounded and mostly in order.
+
+    The state of the engine (open candles and watermarks) is saved to `state_path`
+    after every batch, with the offsets of the next trades to read, and we resume
+    from those offsets on restart. Candles can be produced twice after a crash,
+    but they are the same candles.
+
+    Args:
+        kafka_broker_address (str): The address of the Kafka broker
+        kafka_input_topic (str): The Kafka topic to read the trades from
+        kafka_output_topic (str): The Kafka topic to save the OHLC data
+        kafka_consumer_group (str): The Kafka consumer group to read the trades from
+        ohlcv_window_seconds (int): The size of the OHLCV windows in seconds
+        kafka_output_value_format (str): How we encode the candles: "json" or "binary"
+        ohlcv_rollup_window_seconds (Optional[List[int]]): Coarser windows we roll the
+            candles up into, like in `transform_trade_to_ohlcv`
+        batch_size (int): The max number of trades we aggregate at once
+        state_path (str): The JSON file where we keep the state of the engine
+        ohlcv_indicators (Optional[List[str]]): Indicators we add to the candles, like
+            in `transform_trade_to_ohlcv`
+
+    Returns:
+        None
+    """
+    if kafka_output_value_format not in VALUE_FORMATS:
+        raise ValueError(
+            f"Invalid value format {kafka_output_value_format}, expected one of {VALUE_FORMATS}"
+        )
+    encode = encode_ohlcv if kafka_output_value_format == "binary" else orjson.dumps
+
+    rollup_window_seconds = sorted(ohlcv_rollup_window_seconds or [])
+    check_rollup_windows(ohlcv_window_seconds, rollup_window_seconds)
+    indicators = (
+        Indicators(ohlcv_indicators, window_seconds=ohlcv_window_seconds)
+        if ohlcv_indicators else None
+    )
+
+    engine = BatchOhlcvEngine(window_seconds=ohlcv_window_seconds)
+    # the rollups and indicators of each product
+    product_states: Dict[str, DictState] = {}
+    # the offset of the next trade to read, per partition
+    offsets: Dict[str, int] = {}
+
+    state_path = Path(state_path)
+    if state_path.exists():
+        state = orjson.loads(state_path.read_bytes())
+        engine.load_state_dict(state["engine"])
+        product_states = {
+            product_id: DictState(data) for product_id, data in state["products"].items()
+        }
+        offsets = state["offsets"]
+        logger.info(f"Resuming the batch engine from {state_path}, offsets {offsets}")
+
+    def on_assign(consumer, partitions):
+        # start where the saved state ends, not at the committed offsets
+        for partition in partitions:
+            offset = offsets.get(str(partition.partition))
+            if offset is not None:
+                partition.offset = offset
+        consumer.assign(partitions)
+
+    app = Application(
+        broker_address=kafka_broker_address,
+        consumer_group=kafka_consumer_group)
+
+    with app.get_consumer() as consumer, app.get_producer() as producer:
+        consumer.subscribe(topics=[kafka_input_topic], on_assign=on_assign)
+
+        while True:
+            messages = consumer.consume(num_messages=batch_size, timeout=1.0)
+
+            trades = []
+            partitions = []
+            for msg in messages:
+                if msg.error():
+                    logger.error(f"Kafka error: {msg.error()}")
+                    continue
+                trades.append(msg.value())
+                partitions.append(msg.partition())
+                offsets[str(msg.partition())] = msg.offset() + 1
+
+            if not trades:
+                continue
+
+            # the late trades are late on the watermark of their partition, like
+            # in the streaming path
+            candles = engine.process(*decode_trades(trades), partition=np.array(partitions))
+            candles = [
+                indicators.add(candle, product_states.setdefault(candle["product_id"], DictState()))
+                if indicators is not None else strip_aggregates(candle)
+                for candle in candles
+            ]
+
+            if rollup_window_seconds:
+                candles = [
+                    rolled_up
+                    for candle in candles
+                    for rolled_up in rollup_candle(
+                        candle,
+                        product_states.setdefault(candle["product_id"], DictState()),
+                        ohlcv_window_seconds,
+                        rollup_window_seconds,
+                    )
+                ]
+
+            for candle in candles:
+                producer.produce(
+                    topic=kafka_output_topic,
+                    key=candle["product_id"].encode(),
+                    value=encode(candle),
+                )
+            producer.flush()
+
+            # the candles are in Kafka, so we can move on
+            state_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = state_path.with_suffix(".tmp")
+            tmp_path.write_bytes(orjson.dumps({
+                "engine": engine.state_dict(),
+                "products": {product_id: state.data for product_id, state in product_states.items()},
+                "offsets": offsets,
+            }))
+            tmp_path.replace(state_path)
+
+            consumer.commit(
+                offsets=[
+                    TopicPartition(kafka_input_topic, int(partition), offset)
+                    for partition, offset in offsets.items()
+                ],
+                asynchronous=False,
+            )
+            logger.debug(
+                f"Aggregated {len(trades):,} trades into {len(candles):,} candles "
+                f"({engine.late_trades:,} late trades so far)"
+            )
+
 
 if __name__ == "__main__":
 
     # Load configuration
     from src.config import config
 
-    transform_trade_to_ohlcv(
-         kafka_broker_address=config.kafka_broker_address,
-         kafka_input_topic=config.kafka_input_topic,
-         kafka_output_topic=config.kafka_output_topic,
-         kafka_consumer_group=config.kafka_consumer_group,
-         ohlcv_window_seconds=config.ohlcv_window_seconds,
-     )
+    if config.ohlcv_n_workers > 1 and config.ohlcv_engine != "streaming":
+        raise ValueError("Only the streaming engine runs several workers")
+    if config.ohlcv_n_workers > 1 and config.ohlcv_gap_fill:
+        # a worker fills the products it saw, and would go on filling the ones of
+        # the partitions another worker takes over
+        raise ValueError("The gap filler needs a single worker")
+    if config.ohlcv_engine != "streaming" and (
+        config.ohlcv_grace_ms > 0 or config.kafka_late_trades_topic is not None
+    ):
+        # the batch engine closes the windows of a product as soon as its watermark
+        # passes them, and counts the trades it drops
+        raise ValueError("Only the streaming engine has a grace period and a late trades topic")
+
+    # the topics we read and write, before quixstreams creates them with the
+    # defaults. The trade_producer creates the input topic too, with its partitions
+    if config.ohlcv_engine != "offline":
+        create_topic(
+            broker_address=config.kafka_broker_address,
+            topic=config.kafka_input_topic,
+            partitions=config.kafka_input_topic_partitions,
+            replication_factor=config.kafka_topic_replication_factor,
+        )
+    if config.ohlcv_engine != "offline" or config.offline_sink == "kafka":
+        create_topic(
+            broker_address=config.kafka_broker_address,
+            topic=config.kafka_output_topic,
+            partitions=config.kafka_output_topic_partitions,
+            replication_factor=config.kafka_topic_replication_factor,
+            retention_ms=config.kafka_output_topic_retention_ms,
+        )
+    if config.kafka_late_trades_topic is not None:
+        create_topic(
+            broker_address=config.kafka_broker_address,
+            topic=config.kafka_late_trades_topic,
+            partitions=config.kafka_output_topic_partitions,
+            replication_factor=config.kafka_topic_replication_factor,
+            retention_ms=config.kafka_output_topic_retention_ms,
+        )
+
+    if config.ohlcv_engine == "batch":
+        transform_trade_to_ohlcv_batch(
+            kafka_broker_address=config.kafka_broker_address,
+            kafka_input_topic=config.kafka_input_topic,
+            kafka_output_topic=config.kafka_output_topic,
+            kafka_consumer_group=config.kafka_consumer_group,
+            ohlcv_window_seconds=config.ohlcv_window_seconds,
+            kafka_output_value_format=config.kafka_output_value_format,
+            ohlcv_rollup_window_seconds=config.ohlcv_rollup_window_seconds,
+            batch_size=config.ohlcv_batch_size,
+            state_path=config.ohlcv_batch_state_path,
+            ohlcv_indicators=config.ohlcv_indicators,
+        )
+    elif config.ohlcv_engine == "offline":
+        from src.offline_backfill import offline_backfill
+
+        offline_backfill(
+            cache_dir=config.offline_cache_dir,
+            ohlcv_window_seconds=config.ohlcv_window_seconds,
+            sink=config.offline_sink,
+            product_ids=config.offline_product_ids,
+            ohlcv_rollup_window_seconds=config.ohlcv_rollup_window_seconds,
+            n_workers=config.offline_n_workers,
+            kafka_broker_address=config.kafka_broker_address,
+            kafka_output_topic=config.kafka_output_topic,
+            kafka_output_value_format=config.kafka_output_value_format,
+            output_dir=config.offline_output_dir,
+            ohlcv_indicators=config.ohlcv_indicators,
+        )
+    elif config.ohlcv_engine == "streaming":
+        kwargs = dict(
+            kafka_broker_address=config.kafka_broker_address,
+            kafka_input_topic=config.kafka_input_topic,
+            kafka_output_topic=config.kafka_output_topic,
+            kafka_consumer_group=config.kafka_consumer_group,
+            ohlcv_window_seconds=config.ohlcv_window_seconds,
+            kafka_output_value_format=config.kafka_output_value_format,
+            ohlcv_rollup_window_seconds=config.ohlcv_rollup_window_seconds,
+            ohlcv_partial_throttle_ms=config.ohlcv_partial_throttle_ms,
+            ohlcv_gap_fill=config.ohlcv_gap_fill,
+            ohlcv_gap_fill_delay_ms=config.ohlcv_gap_fill_delay_ms,
+            ohlcv_gap_fill_wall_clock=config.ohlcv_gap_fill_wall_clock,
+            ohlcv_indicators=config.ohlcv_indicators,
+            ohlcv_grace_ms=config.ohlcv_grace_ms,
+            ohlcv_allowed_lateness_ms=config.ohlcv_allowed_lateness_ms,
+            kafka_late_trades_topic=config.kafka_late_trades_topic,
+        )
+        if config.ohlcv_n_workers > 1:
+            # one process per worker, in the same consumer group
+            run_workers(
+                target=transform_trade_to_ohlcv,
+                n_workers=config.ohlcv_n_workers,
+                worker_kwargs=lambda worker: {
+                    **kwargs, "state_dir": worker_state_dir(config.state_dir, worker)
+                },
+            )
+        else:
+            transform_trade_to_ohlcv(**kwargs, state_dir=config.state_dir)
+    else:
+        raise ValueError(f"Invalid value for ohlcv_engine: {config.ohlcv_engine}")
 
     # transform_trade_to_ohlcv(
     #      kafka_broker_address='localhost:19092',
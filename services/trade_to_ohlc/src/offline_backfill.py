@@ -0,0 +1,249 @@
+"""
+Offline OHLCV backfill, straight from the trade cache of the trade_producer
+(`CachedTradeData`), without going through Kafka twice:
+
+    cache_dir/
+        ETH-USD/
+            2024-06-17.parquet  -> all the cached ETH/USD trades of that day
+            2024-06-18.parquet
+
+Every day is independent (the windows divide a day, so none goes across midnight),
+so we aggregate the days in parallel, one process per day, with the batch engine
+(see `src.batch_engine`). The candles are the ones of the `ohlcv_historical` topic,
+and go either to that topic or to one parquet file per day.
+"""
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import orjson
+from loguru import logger
+
+from src.batch_engine import BatchOhlcvEngine
+from src.indicators import Indicators, strip_aggregates
+from src.rollup import DictState, check_rollup_windows, rollup_candle
+from src.wire_format import VALUE_FORMATS, encode_ohlcv
+
+DAY_SECONDS = 24 * 60 * 60
+
+SINKS = ("kafka", "parquet")
+
+
+def list_days(cache_dir: str, product_ids: Optional[List[str]] = None) -> Dict[str, List[Path]]:
+    """
+    Returns the parquet files of the cache, grouped by day.
+
+    Args:
+        cache_dir (str): The cache directory of the trade_producer.
+        product_ids (Optional[List[str]]): The products we backfill. None means all.
+
+    Returns:
+        Dict[str, List[Path]]: The files of every day ("2024-06-17"), in day order.
+    """
+    product_dirs = (
+        [Path(cache_dir) / product_id.replace("/", "-") for product_id in product_ids]
+        if product_ids is not None
+        else [path for path in sorted(Path(cache_dir).iterdir()) if path.is_dir()]
+    )
+
+    days: Dict[str, List[Path]] = {}
+    for product_dir in product_dirs:
+        for file_path in sorted(product_dir.glob("*.parquet")):
+            days.setdefault(file_path.stem, []).append(file_path)
+
+    return dict(sorted(days.items()))
+
+
+def compute_day_candles(
+    files: List[Path],
+    ohlcv_window_seconds: int,
+    rollup_window_seconds: List[int],
+) -> List[dict]:
+    """
+    Aggregates the trades of one day into candles.
+
+    Args:
+        files (List[Path]): The cache files of the day, one per product.
+        ohlcv_window_seconds (int): The size of the OHLCV windows in seconds.
+        rollup_window_seconds (List[int]): The coarser windows, in seconds.
+
+    Returns:
+        List[dict]: The candles of the day, like the ones of the streaming path.
+    """
+    import pyarrow.parquet as pq
+
+    product_ids = []
+    columns = {"timestamp_ms": [], "price": [], "quantity": []}
+    for file_path in files:
+        table = pq.read_table(file_path, columns=["product_id", *columns], memory_map=True)
+        if table.num_rows == 0:
+            continue
+        product_ids.extend([table.column("product_id")[0].as_py()] * table.num_rows)
+        for name, values in columns.items():
+            values.append(table.column(name).to_numpy())
+
+    if not product_ids:
+        return []
+
+    engine = BatchOhlcvEngine(window_seconds=ohlcv_window_seconds)
+    candles = engine.process(
+        product_ids,
+        np.concatenate(columns["timestamp_ms"]).astype(np.int64),
+        np.concatenate(columns["price"]).astype(np.float64),
+        np.concatenate(columns["quantity"]).astype(np.float64),
+    )
+    # there are no more trades for this day
+    candles += engine.flush()
+    candles.sort(key=lambda candle: (candle["timestamp_ms"], candle["product_id"]))
+
+    if not rollup_window_seconds:
+        return candles
+
+    states: Dict[str, DictState] = {}
+    candles = [
+        rolled_up
+        for candle in candles
+        for rolled_up in rollup_candle(
+            candle,
+            states.setdefault(candle["product_id"], DictState()),
+            ohlcv_window_seconds,
+            rollup_window_seconds,
+        )
+    ]
+    # the coarse windows end at midnight at the latest, so the ones left are finished
+    candles += [coarse for state in states.values() for coarse in state.data.values()]
+    return candles
+
+
+def _compute_day_candles(args: tuple) -> tuple:
+    day, files, ohlcv_window_seconds, rollup_window_seconds = args
+    return day, compute_day_candles(files, ohlcv_window_seconds, rollup_window_seconds)
+
+
+def offline_backfill(
+    cache_dir: str,
+    ohlcv_window_seconds: int,
+    sink: str = "kafka",
+    product_ids: Optional[List[str]] = None,
+    ohlcv_rollup_window_seconds: Optional[List[int]] = None,
+    n_workers: Optional[int] = None,
+    kafka_broker_address: Optional[str] = None,
+    kafka_output_topic: Optional[str] = None,
+    kafka_output_value_format: str = "json",
+    output_dir: str = "ohlcv",
+    ohlcv_indicators: Optional[List[str]] = None,
+) -> None:
+    """
+    Computes the candles of every day in the trade cache, in `n_workers` processes,
+    and writes them to `sink`, one day at a time, in day order.
+
+    Args:
+        cache_dir (str): The cache directory of the trade_producer
+        ohlcv_window_seconds (int): The size of the OHLCV windows in seconds
+        sink (str): "kafka" to produce the candles to `kafka_output_topic`, or
+            "parquet" to write one file per day to `output_dir`
+        product_ids (Optional[List[str]]): The products we backfill. None means all
+        ohlcv_rollup_window_seconds (Optional[List[int]]): Coarser windows we roll the
+            candles up into, like in `transform_trade_to_ohlcv`
+        n_workers (Optional[int]): The number of processes. None means one per CPU
+        kafka_broker_address (Optional[str]): The address of the Kafka broker
+        kafka_output_topic (Optional[str]): The Kafka topic to save the OHLC data
+        kafka_output_value_format (str): How we encode the candles: "json" or "binary"
+        output_dir (str): Where the "parquet" sink writes the candles
+        ohlcv_indicators (Optional[List[str]]): Indicators we add to the candles of the
+            base window, like in `transform_trade_to_ohlcv`. They go from one day to
+            the next, so we add them here, in day order, not in the workers
+
+    Returns:
+        None
+    """
+    if sink not in SINKS:
+        raise ValueError(f"Invalid sink {sink}, expected one of {SINKS}")
+    if kafka_output_value_format not in VALUE_FORMATS:
+        raise ValueError(
+            f"Invalid value format {kafka_output_value_format}, expected one of {VALUE_FORMATS}"
+        )
+
+    rollup_window_seconds = sorted(ohlcv_rollup_window_seconds or [])
+    check_rollup_windows(ohlcv_window_seconds, rollup_window_seconds)
+    for seconds in [ohlcv_window_seconds, *rollup_window_seconds]:
+        if DAY_SECONDS % seconds != 0:
+            raise ValueError(f"Window of {seconds} seconds does not divide a day")
+
+    indicators = (
+        Indicators(ohlcv_indicators, window_seconds=ohlcv_window_seconds)
+        if ohlcv_indicators else None
+    )
+    indicator_states: Dict[str, DictState] = {}
+
+    days = list_days(cache_dir, product_ids)
+    logger.info(f"Backfilling the candles of {len(days)} days from {cache_dir} to {sink}")
+
+    write = (
+        _kafka_writer(kafka_broker_address, kafka_output_topic, kafka_output_value_format)
+        if sink == "kafka"
+        else _parquet_writer(output_dir)
+    )
+
+    tasks = [
+        (day, files, ohlcv_window_seconds, rollup_window_seconds) for day, files in days.items()
+    ]
+    n_candles = 0
+    with Pool(processes=n_workers) as pool:
+        # imap keeps the day order, while the next days are being computed
+        for day, candles in pool.imap(_compute_day_candles, tasks):
+            candles = [
+                indicators.add(candle, indicator_states.setdefault(candle["product_id"], DictState()))
+                if indicators is not None
+                and candle.get("resolution_seconds", ohlcv_window_seconds) == ohlcv_window_seconds
+                else strip_aggregates(candle)
+                for candle in candles
+            ]
+            write(day, candles)
+            n_candles += len(candles)
+            logger.debug(f"Wrote {len(candles):,} candles of {day}")
+
+    write(None, [])
+    logger.info(f"Backfilled {n_candles:,} candles")
+
+
+def _kafka_writer(broker_address: str, topic: str, value_format: str):
+    """
+    Returns a function that produces the candles of a day to `topic`. Calling it
+    with no day flushes the producer.
+    """
+    from quixstreams import Application
+
+    encode = encode_ohlcv if value_format == "binary" else orjson.dumps
+    producer = Application(broker_address=broker_address).get_producer()
+
+    def write(day: Optional[str], candles: List[dict]) -> None:
+        for candle in candles:
+            producer.produce(
+                topic=topic,
+                key=candle["product_id"].encode(),
+                value=encode(candle),
+            )
+        if day is None:
+            producer.flush()
+
+    return write
+
+
+def _parquet_writer(output_dir: str):
+    """
+    Returns a function that writes the candles of a day to `output_dir/<day>.parquet`.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    def write(day: Optional[str], candles: List[dict]) -> None:
+        if day is None or not candles:
+            return
+        pq.write_table(pa.Table.from_pylist(candles), output_dir / f"{day}.parquet")
+
+    return write
@@ -0,0 +1,76 @@
+"""
+Emits the candles of the open windows while they are still open, for the services
+that need the latest candle now, not when its window closes (the online feature
+store, a live predictor).
+
+With `.current()` the tumbling window gives us the updated candle of the open
+window after every trade. We forward at most one of those partial candles per
+product every `throttle_ms`, and the last version of a window, flagged with
+`is_final`, once the watermark of the product passes the end of the window plus
+the grace period (see `src.lateness`). So the same (`product_id`, `timestamp_ms`)
+candle goes out several times, and the sinks downstream must upsert by those two
+fields.
+"""
+import time
+from typing import Any, List, Optional
+
+# state keys, next to the ones of the rollups
+PARTIAL_CANDLES_KEY = "partial_candles"
+EMITTED_MS_KEY = "partial_emitted_ms"
+# the single open window of the previous versions, with no grace period
+_LEGACY_PARTIAL_CANDLE_KEY = "partial_candle"
+
+
+def throttle_partial_candle(
+    candle: dict,
+    state: Any,
+    throttle_ms: int,
+    now_ms: Optional[int] = None,
+    watermark_ms: Optional[int] = None,
+    grace_ms: int = 0,
+) -> List[dict]:
+    """
+    Takes the current candle of an open window of a product, and returns the
+    candles to emit: the final version of the windows the watermark closed, and
+    this candle, if we did not emit one in the last `throttle_ms`.
+
+    Args:
+        candle (dict): The current candle of the open window, with `timestamp_ms`
+            at the end of the window.
+        state (Any): Where we keep the last candles of the product, like the
+            quixstreams `State` of the message key.
+        throttle_ms (int): The min time between two partial candles of a product.
+        now_ms (Optional[int]): The wall clock time, in Unix milliseconds. None
+            means now.
+        watermark_ms (Optional[int]): The largest trade timestamp of the product.
+            None means it is in the window of `candle`, which closes the earlier
+            windows when there is no grace period.
+        grace_ms (int): How long after its end a window takes trades.
+
+    Returns:
+        List[dict]: The candles to emit, each with its `is_final` flag.
+    """
+    now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+    watermark_ms = candle["timestamp_ms"] - 1 if watermark_ms is None else watermark_ms
+
+    # the last candle of every window that is still open, by the end of the window
+    open_candles = dict(state.get(PARTIAL_CANDLES_KEY) or {})
+    legacy = state.get(_LEGACY_PARTIAL_CANDLE_KEY)
+    if legacy is not None:
+        open_candles.setdefault(str(legacy["timestamp_ms"]), legacy)
+        state.delete(_LEGACY_PARTIAL_CANDLE_KEY)
+    open_candles[str(candle["timestamp_ms"])] = candle
+
+    # final candles are never throttled
+    candles = []
+    for end_ms in sorted(open_candles, key=int):
+        if int(end_ms) + grace_ms <= watermark_ms:
+            candles.append({**open_candles.pop(end_ms), "is_final": True})
+    state.set(PARTIAL_CANDLES_KEY, open_candles)
+
+    if str(candle["timestamp_ms"]) in open_candles and \
+            now_ms - state.get(EMITTED_MS_KEY, 0) >= throttle_ms:
+        candles.append({**candle, "is_final": False})
+        state.set(EMITTED_MS_KEY, now_ms)
+
+    return candles
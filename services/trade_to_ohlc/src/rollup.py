@@ -0,0 +1,116 @@
+"""
+Rolls the finished candles of the base window up into coarser windows, so one
+pass over the trades gives us candles at several resolutions.
+
+A coarse candle is the merge of the base candles inside its window: first open,
+max high, min low, last close and total volume. As the base candles only exist
+for windows with trades, this is the same candle we would get aggregating the
+trades directly, without reading (and deserializing) the trades again.
+"""
+from typing import Any, List, Optional
+
+from loguru import logger
+
+
+class DictState:
+    """
+    The unfinished coarse candles of one product in a dictionary, for the services
+    that do not keep them in the quixstreams `State`.
+    """
+
+    def __init__(self, data: Optional[dict] = None) -> None:
+        self.data = data or {}
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.data.get(key, default)
+
+    def set(self, key: str, value: Any) -> None:
+        self.data[key] = value
+
+    def delete(self, key: str) -> None:
+        self.data.pop(key, None)
+
+
+def check_rollup_windows(base_window_seconds: int, rollup_window_seconds: List[int]) -> None:
+    """
+    Checks that every rollup window is a multiple of the base window.
+
+    Raises:
+        ValueError: If a rollup window is not a (larger) multiple of the base window.
+    """
+    for seconds in rollup_window_seconds:
+        if seconds <= base_window_seconds or seconds % base_window_seconds != 0:
+            raise ValueError(
+                f"Rollup window of {seconds} seconds is not a multiple of the "
+                f"base window of {base_window_seconds} seconds"
+            )
+
+
+def rollup_candle(
+    candle: dict,
+    state: Any,
+    base_window_seconds: int,
+    rollup_window_seconds: List[int],
+) -> List[dict]:
+    """
+    Adds a finished base candle to the coarser candles of its product, and returns
+    the base candle and every coarser candle that is finished now.
+
+    A coarse candle is finished when we get the base candle that ends with it, or
+    the first base candle of a later window.
+
+    Args:
+        candle (dict): A finished base candle, with `timestamp_ms` at the end of
+            its window.
+        state (Any): Where we keep the unfinished coarse candles of the product,
+            like the quixstreams `State` of the message key. Anything with `get`,
+            `set` and `delete` works.
+        base_window_seconds (int): The window of `candle`, in seconds.
+        rollup_window_seconds (List[int]): The coarser windows, in seconds.
+
+    Returns:
+        List[dict]: The candles to emit, each with its `resolution_seconds`.
+    """
+    candles = [{**candle, "resolution_seconds": base_window_seconds}]
+    start_ms = candle["timestamp_ms"] - base_window_seconds * 1000
+
+    for seconds in rollup_window_seconds:
+        window_ms = seconds * 1000
+        end_ms = start_ms // window_ms * window_ms + window_ms
+        state_key = f"rollup_{seconds}"
+
+        coarse = state.get(state_key)
+        if coarse is not None and coarse["timestamp_ms"] != end_ms:
+            if coarse["timestamp_ms"] > end_ms:
+                # a base candle of a window we already emitted
+                logger.warning(f"Dropping late {base_window_seconds}s candle {candle}")
+                continue
+            # the first base candle of a later window, so the coarse one is finished
+            candles.append(coarse)
+            coarse = None
+
+        if coarse is None:
+            coarse = {
+                "product_id": candle["product_id"],
+                "timestamp_ms": end_ms,
+                "open": candle["open"],
+                "high": candle["high"],
+                "low": candle["low"],
+                "close": candle["close"],
+                "volume": candle["volume"],
+                "resolution_seconds": seconds,
+            }
+        else:
+            coarse["high"] = max(coarse["high"], candle["high"])
+            coarse["low"] = min(coarse["low"], candle["low"])
+            coarse["close"] = candle["close"]
+            coarse["volume"] += candle["volume"]
+
+        if candle["timestamp_ms"] == end_ms:
+            # the last base candle of the coarse window
+            candles.append(coarse)
+            state.delete(state_key)
+        else:
+            state.set(state_key, coarse)
+
+    return candles
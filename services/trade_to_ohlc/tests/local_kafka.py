@@ -0,0 +1,316 @@
+"""
+Runs `transform_trade_to_ohlcv`, the real quixstreams pipeline, on a list of trades,
+without a Kafka broker.
+
+Only the Kafka clients are replaced: the consumer hands the trades to quixstreams as
+Kafka messages, and the producers keep what they produce. Everything in between is
+quixstreams: the deserializer and timestamp extractor of the input topic, the
+stateful functions and windows with their RocksDB state (with our `RocksDBOptions`),
+the checkpoints, and the serializers and keys of `to_topic`.
+
+It drives the internals of quixstreams 2.x, the version in poetry.lock.
+"""
+import zlib
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from unittest import mock
+
+import orjson
+from confluent_kafka import OFFSET_INVALID, TIMESTAMP_CREATE_TIME, TopicPartition
+from quixstreams import Application
+from quixstreams.rowconsumer import RowConsumer
+from quixstreams.rowproducer import RowProducer
+from rocksdict import AccessType, Options, Rdict
+
+import src.main
+from src.wire_format import decode, encode_trade
+
+INPUT_TOPIC = "trade"
+OUTPUT_TOPIC = "ohlcv"
+LATE_TRADES_TOPIC = "trade_late"
+
+
+class LocalMessage:
+    """
+    A Kafka message, with the methods of `confluent_kafka.Message` quixstreams uses.
+    """
+
+    def __init__(self, topic: str, partition: int, offset: int, key: bytes, value: bytes, timestamp: int):
+        self._topic = topic
+        self._partition = partition
+        self._offset = offset
+        self._key = key
+        self._value = value
+        self._timestamp = timestamp
+
+    def topic(self) -> str:
+        return self._topic
+
+    def partition(self) -> int:
+        return self._partition
+
+    def offset(self) -> int:
+        return self._offset
+
+    def key(self) -> bytes:
+        return self._key
+
+    def value(self) -> bytes:
+        return self._value
+
+    def timestamp(self) -> Tuple[int, int]:
+        return TIMESTAMP_CREATE_TIME, self._timestamp
+
+    def headers(self) -> None:
+        return None
+
+    def error(self) -> None:
+        return None
+
+    def latency(self) -> None:
+        return None
+
+    def leader_epoch(self) -> None:
+        return None
+
+    def __len__(self) -> int:
+        return len(self._value)
+
+
+class LocalConsumer(RowConsumer):
+    """
+    Hands the messages of its partitions to quixstreams, on one assignment, from
+    the committed offsets, and stops the application once they are all consumed.
+    """
+
+    def __init__(
+        self,
+        messages: Iterator[LocalMessage],
+        partitions: List[int],
+        on_done: Callable[[], None],
+        committed: Dict[Tuple[str, int], int],
+    ):
+        super().__init__(
+            broker_address="localhost:9092",
+            consumer_group="local",
+            auto_offset_reset="earliest",
+            auto_commit_enable=False,
+        )
+        self._messages = messages
+        self._partitions = partitions
+        self._on_done = on_done
+        self._on_assign = self._on_revoke = None
+        self._assigned: List[TopicPartition] = []
+        self._committed = committed
+
+    def subscribe(self, topics, on_assign=None, on_revoke=None, on_lost=None):
+        self._topics = {topic.name: topic for topic in topics}
+        self._on_assign, self._on_revoke = on_assign, on_revoke
+
+    def poll(self, timeout: Optional[float] = None) -> Optional[LocalMessage]:
+        if self._on_assign is not None:
+            # like the Kafka consumer, assign the partitions on the first poll
+            self._assigned = [
+                TopicPartition(topic, partition)
+                for topic in self._topics
+                for partition in self._partitions
+            ]
+            self._on_assign(self, self._assigned)
+            self._on_assign = None
+
+        for message in self._messages:
+            # like the Kafka consumer, start from the committed offsets
+            if message.offset() >= self._committed.get((message.topic(), message.partition()), 0):
+                return message
+        self._on_done()
+        return None
+
+    def incremental_assign(self, partitions: List[TopicPartition]) -> None:
+        pass
+
+    def incremental_unassign(self, partitions: List[TopicPartition]) -> None:
+        pass
+
+    def committed(self, partitions: List[TopicPartition], timeout: Optional[float] = None) -> List[TopicPartition]:
+        return [
+            TopicPartition(tp.topic, tp.partition, self._committed.get((tp.topic, tp.partition), OFFSET_INVALID))
+            for tp in partitions
+        ]
+
+    def commit(self, message=None, offsets=None, asynchronous: bool = True) -> List[TopicPartition]:
+        for tp in offsets:
+            self._committed[tp.topic, tp.partition] = tp.offset
+        return offsets
+
+    def close(self) -> None:
+        # like the Kafka consumer, revoke the partitions, which commits the checkpoint
+        if self._assigned:
+            self._on_revoke(self, self._assigned)
+            self._assigned = []
+
+
+class LocalProducer(RowProducer):
+    """
+    Keeps the messages instead of producing them.
+    """
+
+    def __init__(self, produced: List[dict]):
+        super().__init__(broker_address="localhost:9092")
+        self.produced = produced
+
+    def produce(self, topic: str, value=None, key=None, headers=None, partition=None, timestamp=None, **kwargs):
+        self.produced.append({"topic": topic, "key": key, "value": value, "timestamp": timestamp})
+
+    def poll(self, timeout: float = 0) -> None:
+        pass
+
+    def flush(self, timeout: Optional[float] = None) -> int:
+        return 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+def local_application(
+    messages: List[LocalMessage],
+    partitions: List[int],
+    produced: List[dict],
+    committed: Dict[Tuple[str, int], int],
+):
+    """
+    Returns an `Application` class whose Kafka clients are the local ones above.
+    """
+
+    class LocalApplication(Application):
+        def __init__(self, **kwargs: Any):
+            # no changelog topics: there is no broker to recover the state from
+            super().__init__(**kwargs, use_changelog_topics=False, commit_every=1_000)
+            self._consumer = LocalConsumer(iter(messages), partitions, on_done=self.stop, committed=committed)
+            self._pausing_manager._consumer = self._consumer
+            self._processing_context.consumer = self._consumer
+
+        def _get_rowproducer(self, **kwargs: Any) -> RowProducer:
+            return LocalProducer(produced)
+
+        def get_producer(self) -> LocalProducer:
+            return self._producer
+
+        def setup_topics(self) -> None:
+            pass
+
+        def _setup_signal_handlers(self) -> None:
+            pass
+
+    return LocalApplication
+
+
+def partitions_per_key(product_ids: Iterable[str]) -> int:
+    """
+    The smallest number of partitions that puts every product in its own partition.
+
+    quixstreams 2.x closes the windows on the largest timestamp of the partition, and
+    `tests.trades.TumblingWindows` on the one of the product: with one product per
+    partition, they are the same.
+    """
+    keys = {product_id.encode() for product_id in product_ids}
+    partitions = len(keys)
+    while len({zlib.crc32(key) % partitions for key in keys}) < len(keys):
+        partitions += 1
+    return partitions
+
+
+def trade_messages(trades: List[dict], value_format: str = "json", partitions: int = 1) -> List[LocalMessage]:
+    """
+    The messages of the trades in the `trade` topic, keyed by product like the
+    trade_producer does, in as many partitions.
+    """
+    encode = encode_trade if value_format == "binary" else orjson.dumps
+    offsets: Dict[int, int] = {}
+    messages = []
+    for trade in trades:
+        key = trade["product_id"].encode()
+        partition = zlib.crc32(key) % partitions
+        offset = offsets[partition] = offsets.get(partition, -1) + 1
+        messages.append(LocalMessage(INPUT_TOPIC, partition, offset, key, encode(trade), trade["timestamp_ms"]))
+    return messages
+
+
+def run_pipeline(
+    trades: List[dict],
+    state_dir: str,
+    ohlcv_window_seconds: int = 60,
+    value_format: str = "json",
+    partitions: int = 1,
+    assigned_partitions: Optional[List[int]] = None,
+    committed: Optional[Dict[Tuple[str, int], int]] = None,
+    **kwargs: Any,
+) -> List[dict]:
+    """
+    Runs the trades through `transform_trade_to_ohlcv`, and returns what it produced,
+    with the values decoded, in order.
+
+    Args:
+        trades (List[dict]): The trades, in the order they are in the input topic.
+        state_dir (str): Where quixstreams keeps the state. Run again with the same
+            one to restart from it.
+        ohlcv_window_seconds (int): The size of the OHLCV windows in seconds.
+        value_format (str): How the trades are encoded: "json" or "binary".
+        partitions (int): The number of partitions of the input topic.
+        assigned_partitions (Optional[List[int]]): The partitions this run consumes,
+            like one worker of a consumer group. None means all of them.
+        committed (Optional[Dict[Tuple[str, int], int]]): The committed offsets of
+            the consumer group, by topic and partition. Run again with the same
+            dictionary and `state_dir` (and more trades) to restart the service.
+        **kwargs (Any): The other arguments of `transform_trade_to_ohlcv`.
+
+    Returns:
+        List[dict]: The "topic", "key", raw "value" and decoded "message" of every
+            message it produced.
+    """
+    produced: List[dict] = []
+    if assigned_partitions is None:
+        assigned_partitions = list(range(partitions))
+    messages = [
+        message for message in trade_messages(trades, value_format, partitions)
+        if message.partition() in assigned_partitions
+    ]
+    committed = {} if committed is None else committed
+    application = local_application(messages, assigned_partitions, produced, committed)
+    with mock.patch.object(src.main, "Application", application):
+        src.main.transform_trade_to_ohlcv(
+            kafka_broker_address="localhost:9092",
+            kafka_input_topic=INPUT_TOPIC,
+            kafka_output_topic=OUTPUT_TOPIC,
+            kafka_consumer_group="local",
+            ohlcv_window_seconds=ohlcv_window_seconds,
+            state_dir=state_dir,
+            **kwargs,
+        )
+    for message in produced:
+        message["message"] = decode(message["value"])
+    return produced
+
+
+def state_store(state_dir: str, store_name: str) -> Dict[bytes, bytes]:
+    """
+    The raw keys and values a run left in a state store, over all its partitions.
+
+    Args:
+        state_dir (str): The state directory of the run.
+        store_name (str): The name of the store, like "default", or the one of a
+            window, like "tumbling_window_60000_reduce".
+
+    Returns:
+        Dict[bytes, bytes]: The values, by key.
+    """
+    values = {}
+    for path in sorted(Path(state_dir, "local", store_name, INPUT_TOPIC).iterdir()):
+        db = Rdict(str(path), options=Options(raw_mode=True), access_type=AccessType.read_only())
+        try:
+            values.update(db.items())
+        finally:
+            db.close()
+    return values
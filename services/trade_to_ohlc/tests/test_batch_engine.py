@@ -0,0 +1,97 @@
+import random
+import struct
+from typing import List
+
+import orjson
+import pytest
+
+from src.batch_engine import NO_SIDE, BatchOhlcvEngine, decode_trades
+from src.indicators import strip_aggregates
+from src.window_state import candle_from_state, loads
+from src.wire_format import encode_trade
+from tests.local_kafka import run_pipeline, state_store, trade_messages
+from tests.trades import TumblingWindows, make_trades
+
+WINDOW_SECONDS = 60
+
+
+def make_trades_without_side(duration_sec: int) -> List[dict]:
+    trades = make_trades({'BTC/USD': 0.5, 'ETH/USD': 2}, duration_sec)
+    rng = random.Random(0)
+    for trade in trades:
+        # some trades have no side, like the ones of the REST API
+        if rng.random() < 0.1:
+            del trade['side']
+    return trades
+
+
+@pytest.mark.parametrize('value_format', ['json', 'binary'])
+def test_buy_volume_like_the_streaming_reducer(value_format):
+    trades = make_trades_without_side(duration_sec=60 * 60)
+    encode = encode_trade if value_format == 'binary' else orjson.dumps
+    messages = [encode(trade) for trade in trades]
+
+    engine = BatchOhlcvEngine(window_seconds=WINDOW_SECONDS)
+    candles = []
+    # small batches, so windows go across batches
+    for i in range(0, len(messages), 97):
+        candles += engine.process(*decode_trades(messages[i:i + 97]))
+    candles += engine.flush()
+
+    key = lambda candle: (candle['product_id'], candle['timestamp_ms'])  # noqa: E731
+    windows = TumblingWindows(WINDOW_SECONDS)
+    expected = sorted(windows.run(trades) + windows.flush(), key=key)
+    assert sorted(candles, key=key) == expected
+    # the windows whose first trade has no side have no buy_volume
+    assert 0 < sum('buy_volume' in candle for candle in expected) < len(expected)
+
+
+def test_binary_trades_without_side():
+    trades = [
+        {'product_id': 'ETH/USD', 'quantity': 1.0, 'price': 10.0, 'timestamp_ms': 1_000},
+        {'product_id': 'ETH/USD', 'quantity': 2.0, 'price': 11.0, 'timestamp_ms': 2_000},
+    ]
+    product_ids, _, _, _, side = decode_trades([encode_trade(trade) for trade in trades])
+    assert product_ids == ['ETH/USD', 'ETH/USD']
+    assert side.tolist() == [NO_SIDE, NO_SIDE]
+
+    engine = BatchOhlcvEngine(window_seconds=WINDOW_SECONDS)
+    engine.process(*decode_trades([encode_trade(trade) for trade in trades]))
+    (candle,) = engine.flush()
+    assert 'buy_volume' not in candle
+    assert candle['volume'] == 3.0
+
+
+@pytest.mark.parametrize('partitions', [1, 2])
+def test_several_products_in_a_partition_like_the_streaming_path(tmp_path, partitions):
+    # out of order, and a slow product behind the others in its partition
+    trades = make_trades(
+        {'BTC/USD': 1, 'ETH/USD': 5, 'XTZ/USD': 90},
+        duration_sec=2 * 60 * 60,
+        late_fraction=0.05,
+        max_delay_ms=90_000,
+    )
+    produced = run_pipeline(
+        trades, state_dir=str(tmp_path), ohlcv_window_seconds=WINDOW_SECONDS, partitions=partitions
+    )
+    # the finished candles, and the ones of the windows that are still open
+    streaming = [message['message'] for message in produced]
+    for key, value in state_store(str(tmp_path), f'tumbling_window_{WINDOW_SECONDS * 1000}_reduce').items():
+        end_ms, = struct.unpack('>Q', key[-8:])
+        streaming.append(strip_aggregates(candle_from_state(loads(value), key.split(b'|')[0].decode(), end_ms)))
+
+    def run_batch(with_partitions: bool) -> List[dict]:
+        messages = trade_messages(trades, partitions=partitions)
+        engine = BatchOhlcvEngine(window_seconds=WINDOW_SECONDS)
+        candles = []
+        for i in range(0, len(messages), 97):
+            batch = messages[i:i + 97]
+            partition = [message.partition() for message in batch] if with_partitions else None
+            candles += engine.process(*decode_trades([message.value() for message in batch]), partition=partition)
+        return [strip_aggregates(candle) for candle in candles + engine.flush()]
+
+    key = lambda candle: (candle['product_id'], candle['timestamp_ms'])  # noqa: E731
+    assert sorted(run_batch(with_partitions=True), key=key) == sorted(streaming, key=key)
+    # on the watermarks of the products, the batch engine would keep trades the
+    # streaming path drops
+    assert sorted(run_batch(with_partitions=False), key=key) != sorted(streaming, key=key)
@@ -0,0 +1,118 @@
+from typing import Dict, List, Optional
+
+from src.gap_filler import GapFiller
+from src.indicators import Indicators, strip_aggregates
+from src.rollup import DictState
+from tests.trades import TumblingWindows, make_trades
+
+WINDOW_SECONDS = 60
+WINDOW_MS = WINDOW_SECONDS * 1000
+INDICATORS = ['ema_3', 'rsi_3', 'volatility_3', 'vwap', 'trade_count', 'imbalance']
+# mean seconds between two trades of each product
+PRODUCTS = {'BTC/USD': 2, 'XTZ/USD': 200}
+
+
+def run(trades: List[dict], indicators: Optional[Indicators]) -> tuple:
+    """
+    Runs the trades through the tumbling window with `.final()`, the indicators and
+    the gap filler, like `transform_trade_to_ohlcv`, then fills the windows after
+    the last trade on the wall clock.
+
+    Returns the candles out of the gap filler, upserted by (product, window), and
+    the candles of the windows with trades, before the indicators.
+    """
+    gap_filler = GapFiller(window_seconds=WINDOW_SECONDS, indicators=indicators)
+    states: Dict[str, DictState] = {}
+    windows = TumblingWindows(WINDOW_SECONDS)
+    raw = []
+    out = []
+
+    def emit(candle: dict) -> None:
+        raw.append(dict(candle))
+        state = states.setdefault(candle['product_id'], DictState())
+        if indicators is not None:
+            candle = indicators.add(candle, state)
+        else:
+            candle = strip_aggregates(candle)
+        out.extend(gap_filler.on_candle(candle, state))
+
+    for trade in trades:
+        gap_filler.observe_trade(trade)
+        for candle in windows.add(trade)[1]:
+            emit(candle)
+
+    # the input is idle: the wall clock fills the windows after the last trades,
+    # before the candles of those last windows come out
+    out += gap_filler.fill(trades[-1]['timestamp_ms'] + 30 * WINDOW_MS)
+    for candle in windows.flush():
+        emit(candle)
+
+    by_key = {}
+    for candle in out:
+        key = (candle['product_id'], candle['timestamp_ms'])
+        # a candle with trades replaces the flat one, like an upsert
+        if key not in by_key or candle['volume'] > 0:
+            by_key[key] = candle
+    return by_key, raw
+
+
+def test_flat_candles_go_through_the_indicator_state():
+    indicators = Indicators(INDICATORS, window_seconds=WINDOW_SECONDS)
+    by_key, raw = run(make_trades(PRODUCTS, duration_sec=3 * 60 * 60), indicators)
+    raw_by_key = {(candle['product_id'], candle['timestamp_ms']): candle for candle in raw}
+
+    n_flat = 0
+    for product_id in PRODUCTS:
+        timestamps = sorted(ts for p, ts in by_key if p == product_id)
+        assert timestamps == list(range(timestamps[0], timestamps[-1] + WINDOW_MS, WINDOW_MS))
+
+        # the indicators over the dense series of windows, with the empty windows
+        # flat at the previous close
+        state = DictState()
+        close = None
+        for ts in timestamps:
+            candle = raw_by_key.get((product_id, ts))
+            if candle is None:
+                n_flat += 1
+                candle = {
+                    'open': close,
+                    'high': close,
+                    'low': close,
+                    'close': close,
+                    'volume': 0.0,
+                    'product_id': product_id,
+                    'timestamp_ms': ts,
+                    'trade_count': 0,
+                    'notional': 0.0,
+                }
+            close = candle['close']
+            assert by_key[product_id, ts] == indicators.add(dict(candle), state)
+
+    assert n_flat > 0
+
+
+def test_flat_candles_have_the_fields_of_the_candles_with_trades():
+    indicators = Indicators(INDICATORS, window_seconds=WINDOW_SECONDS)
+    for with_indicators in (indicators, None):
+        by_key, _ = run(make_trades(PRODUCTS, duration_sec=60 * 60), with_indicators)
+        flat = [candle for candle in by_key.values() if candle['volume'] == 0]
+        with_trades = [candle for candle in by_key.values() if candle['volume'] > 0]
+        assert flat and with_trades
+        assert {tuple(sorted(candle)) for candle in flat} == \
+            {tuple(sorted(candle)) for candle in with_trades}
+        if with_indicators is not None:
+            assert all(candle['trade_count'] == 0 for candle in flat)
+
+
+def test_product_without_candles_starts_from_an_empty_indicator_state():
+    indicators = Indicators(INDICATORS, window_seconds=WINDOW_SECONDS)
+    gap_filler = GapFiller(window_seconds=WINDOW_SECONDS, indicators=indicators)
+    gap_filler.observe_trade(
+        {'product_id': 'XTZ/USD', 'price': 2.0, 'quantity': 1.0, 'timestamp_ms': 30_000}
+    )
+    # the candle of the trade did not come out yet
+    flat = gap_filler.fill(4 * WINDOW_MS)
+    assert [candle['timestamp_ms'] for candle in flat] == [2 * WINDOW_MS, 3 * WINDOW_MS, 4 * WINDOW_MS]
+    assert [candle['ema_3'] for candle in flat] == [None, 2.0, 2.0]
+    assert [candle['rsi_3'] for candle in flat] == [None, None, 50.0]
+    assert all(candle['trade_count'] == 0 and candle['vwap'] is None for candle in flat)
@@ -0,0 +1,137 @@
+"""
+The indicators of the candles of `tests/trades.py`'s tumbling windows, after the
+indicator stage, against:
+
+- a pandas implementation over the whole history of each product, on the dense
+  series of windows (empty windows flat at the previous close)
+- the batch engine path, which must give the same values
+"""
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.batch_engine import BUY, SELL, BatchOhlcvEngine
+from src.indicators import Indicators
+from src.rollup import DictState
+from tests.trades import TumblingWindows, make_trades
+
+WINDOW_SECONDS = 60
+INDICATORS = [
+    'ema_12', 'ema_26', 'rsi_14', 'volatility_20', 'vwap', 'trade_count', 'imbalance',
+]
+# mean seconds between two trades of each product
+PRODUCTS = {'BTC/USD': 0.5, 'ETH/USD': 3, 'XTZ/USD': 90}
+
+
+@pytest.fixture(scope='module')
+def trades() -> List[dict]:
+    return make_trades(PRODUCTS, duration_sec=6 * 60 * 60)
+
+
+def run_streaming(trades: List[dict], indicators: Indicators) -> List[dict]:
+    states: Dict[str, DictState] = {}
+    return [
+        indicators.add(candle, states.setdefault(candle['product_id'], DictState()))
+        for candle in TumblingWindows(WINDOW_SECONDS).run(trades)
+    ]
+
+
+def run_batch(trades: List[dict], indicators: Indicators) -> List[dict]:
+    engine = BatchOhlcvEngine(window_seconds=WINDOW_SECONDS)
+    states: Dict[str, DictState] = {}
+    candles = []
+    for i in range(0, len(trades), 5_000):
+        batch = trades[i:i + 5_000]
+        candles += [
+            indicators.add(candle, states.setdefault(candle['product_id'], DictState()))
+            for candle in engine.process(
+                [trade['product_id'] for trade in batch],
+                np.array([trade['timestamp_ms'] for trade in batch]),
+                np.array([trade['price'] for trade in batch]),
+                np.array([trade['quantity'] for trade in batch]),
+                np.array([BUY if trade['side'] == 'buy' else SELL for trade in batch]),
+            )
+        ]
+    return candles
+
+
+def pandas_reference(candles: pd.DataFrame) -> pd.DataFrame:
+    """
+    The indicators of the candles of one product, over its dense series of windows.
+    """
+    candles = candles.set_index('timestamp_ms')
+    dense = candles.reindex(
+        range(candles.index[0], candles.index[-1] + 1, WINDOW_SECONDS * 1000)
+    )
+    close = dense['close'].ffill()
+
+    out = pd.DataFrame(index=dense.index)
+    for n in (12, 26):
+        out[f'ema_{n}'] = close.ewm(span=n, adjust=False, min_periods=n).mean()
+
+    delta = close.diff()
+    gain = delta.clip(lower=0).ewm(alpha=1 / 14, adjust=False, min_periods=14).mean()
+    loss = (-delta).clip(lower=0).ewm(alpha=1 / 14, adjust=False, min_periods=14).mean()
+    out['rsi_14'] = np.where(
+        loss == 0, np.where(gain > 0, 100.0, 50.0), 100 - 100 / (1 + gain / loss)
+    )
+    out.loc[gain.isna(), 'rsi_14'] = np.nan
+
+    out['volatility_20'] = np.log(close).diff().rolling(20).std()
+    out['vwap'] = dense['notional'] / dense['volume']
+    out['trade_count'] = dense['trade_count']
+    out['imbalance'] = (2 * dense['buy_volume'] - dense['volume']) / dense['volume']
+
+    return out.loc[candles.index]
+
+
+def aggregates(trades: List[dict], product_id: str) -> pd.DataFrame:
+    """
+    The aggregates of the windows of a product, recomputed from its trades.
+    """
+    window_ms = WINDOW_SECONDS * 1000
+    product_trades = pd.DataFrame([t for t in trades if t['product_id'] == product_id])
+    product_trades['timestamp_ms'] = (
+        product_trades['timestamp_ms'] // window_ms * window_ms + window_ms
+    )
+    product_trades['notional'] = product_trades['price'] * product_trades['quantity']
+    product_trades['buy_volume'] = product_trades['quantity'].where(
+        product_trades['side'] == 'buy', 0.0
+    )
+    return product_trades.groupby('timestamp_ms').agg(
+        trade_count=('price', 'size'),
+        notional=('notional', 'sum'),
+        buy_volume=('buy_volume', 'sum'),
+    )
+
+
+@pytest.mark.parametrize('product_id', list(PRODUCTS))
+def test_indicators_like_pandas(trades, product_id):
+    streaming = run_streaming(trades, Indicators(INDICATORS, window_seconds=WINDOW_SECONDS))
+
+    # the reference needs the aggregates, which the indicator stage drops
+    raw = pd.DataFrame([
+        candle
+        for candle in run_streaming(trades, Indicators([], window_seconds=WINDOW_SECONDS))
+        if candle['product_id'] == product_id
+    ])
+    expected = pandas_reference(raw.join(aggregates(trades, product_id), on='timestamp_ms'))
+
+    actual = pd.DataFrame(
+        [candle for candle in streaming if candle['product_id'] == product_id]
+    ).set_index('timestamp_ms')
+    assert len(actual) == len(expected) > 26
+    for name in INDICATORS:
+        assert np.allclose(
+            actual[name].astype(float), expected[name].astype(float),
+            rtol=1e-9, atol=1e-12, equal_nan=True,
+        ), f'{name} of {product_id} is different'
+
+
+def test_batch_engine_gives_the_same_indicators(trades):
+    indicators = Indicators(INDICATORS, window_seconds=WINDOW_SECONDS)
+    key = lambda candle: (candle['product_id'], candle['timestamp_ms'])  # noqa: E731
+    assert sorted(run_batch(trades, indicators), key=key) == \
+        sorted(run_streaming(trades, indicators), key=key)
@@ -0,0 +1,230 @@
+import struct
+from typing import Dict, List
+from unittest import mock
+
+import pytest
+
+import src.main
+from src.indicators import strip_aggregates
+from src.lateness import BEHIND_PARTITION, DROPPED, LATE, ON_TIME, WATERMARK_KEY, LateTrades
+from src.rollup import DictState
+from src.window_state import TRADE_COUNT, WindowCandle, candle_from_state, loads
+from tests.local_kafka import (
+    LATE_TRADES_TOPIC,
+    OUTPUT_TOPIC,
+    partitions_per_key,
+    run_pipeline,
+    state_store,
+)
+from tests.trades import TumblingWindows, make_trades
+
+WINDOW_SECONDS = 60
+WINDOW_STORE = f'tumbling_window_{WINDOW_SECONDS * 1000}_reduce'
+# mean seconds between two trades of each product
+PRODUCTS = {'BTC/USD': 1, 'ETH/USD': 5, 'XTZ/USD': 90}
+# one product per partition, so the windows close on the watermark of the product
+PARTITIONS = partitions_per_key(PRODUCTS)
+ALLOWED_LATENESS_MS = 30_000
+
+
+def trades_out_of_order() -> List[dict]:
+    return make_trades(PRODUCTS, duration_sec=2 * 60 * 60, late_fraction=0.05, max_delay_ms=90_000)
+
+
+def run(trades: List[dict], state_dir, partitions: int = PARTITIONS, **kwargs) -> Dict[str, List[dict]]:
+    """
+    Runs the pipeline, checks every message is keyed by its product and in the
+    value format of the service, and returns the decoded messages by topic.
+    """
+    is_json = kwargs.get('kafka_output_value_format', 'json') == 'json'
+    by_topic = {OUTPUT_TOPIC: [], LATE_TRADES_TOPIC: []}
+    for message in run_pipeline(
+        trades,
+        state_dir=str(state_dir),
+        ohlcv_window_seconds=WINDOW_SECONDS,
+        partitions=partitions,
+        **kwargs,
+    ):
+        assert message['key'] == message['message']['product_id'].encode()
+        assert (message['value'][:1] == b'{') == is_json
+        by_topic[message['topic']].append(message['message'])
+    return by_topic
+
+
+def expected_candles(trades: List[dict]) -> List[dict]:
+    return [strip_aggregates(candle) for candle in TumblingWindows(WINDOW_SECONDS).run(trades)]
+
+
+def by_product(candles: List[dict]) -> Dict[str, List[dict]]:
+    out: Dict[str, List[dict]] = {}
+    for candle in candles:
+        out.setdefault(candle['product_id'], []).append(candle)
+    return out
+
+
+def test_final_candles_like_the_tumbling_windows(tmp_path):
+    trades = trades_out_of_order()
+    produced = run(trades, tmp_path)
+    assert produced[LATE_TRADES_TOPIC] == []
+    assert by_product(produced[OUTPUT_TOPIC]) == by_product(expected_candles(trades))
+
+
+@pytest.mark.parametrize('value_format', ['json', 'binary'])
+def test_stateful_filter_sends_the_late_trades_to_their_topic(tmp_path, value_format):
+    trades = trades_out_of_order()
+    produced = run(
+        trades,
+        tmp_path,
+        kafka_output_value_format=value_format,
+        ohlcv_allowed_lateness_ms=ALLOWED_LATENESS_MS,
+        kafka_late_trades_topic=LATE_TRADES_TOPIC,
+    )
+
+    late_trades = LateTrades(
+        window_seconds=WINDOW_SECONDS,
+        allowed_lateness_ms=ALLOWED_LATENESS_MS,
+        has_late_trades_topic=True,
+    )
+    states: Dict[str, DictState] = {}
+    expected_late = []
+    for trade in trades:
+        verdict, late_by_ms = late_trades.check(trade, states.setdefault(trade['product_id'], DictState()))
+        if verdict == LATE:
+            expected_late.append({**trade, 'late_by_ms': late_by_ms})
+    assert late_trades.counts[LATE] > 0 and late_trades.counts[DROPPED] > 0
+
+    assert produced[LATE_TRADES_TOPIC] == expected_late
+    # the filter takes out the trades the window would drop
+    assert by_product(produced[OUTPUT_TOPIC]) == by_product(expected_candles(trades))
+    # and keeps the watermark of every product in the state of its key
+    watermarks = state_store(str(tmp_path), 'default')
+    for product_id, state in states.items():
+        assert int(watermarks[f'{product_id}|"{WATERMARK_KEY}"'.encode()]) == state.get(WATERMARK_KEY)
+
+
+def test_partial_candles_of_current(tmp_path):
+    trades = trades_out_of_order()
+    produced = run(trades, tmp_path, ohlcv_partial_throttle_ms=1_000)[OUTPUT_TOPIC]
+
+    windows = TumblingWindows(WINDOW_SECONDS)
+    currents = []
+    finals = []
+    for trade in trades:
+        current, closed = windows.add(trade)
+        if current is not None:
+            currents.append(strip_aggregates(current))
+        finals += [strip_aggregates(candle) for candle in closed]
+
+    partials, produced_finals = [], []
+    for candle in produced:
+        (produced_finals if candle.pop('is_final') else partials).append(candle)
+    assert partials
+    assert all(candle in currents for candle in partials)
+    assert by_product(produced_finals) == by_product(finals)
+
+
+def test_restart_from_the_packed_window_state(tmp_path):
+    trades = trades_out_of_order()
+    committed = {}
+    before = run(trades[:len(trades) // 2], tmp_path, committed=committed)[OUTPUT_TOPIC]
+
+    # the open windows are in RocksDB, packed by `src.window_state.dumps`
+    windows = TumblingWindows(WINDOW_SECONDS)
+    windows.run(trades[:len(trades) // 2])
+    open_windows = []
+    for key, value in state_store(str(tmp_path), WINDOW_STORE).items():
+        state = loads(value)
+        assert type(state) is WindowCandle
+        end_ms, = struct.unpack('>Q', key[-8:])
+        open_windows.append(candle_from_state(state, key.split(b'|')[0].decode(), end_ms))
+    assert by_product(open_windows) == by_product(windows.flush())
+
+    # the restart carries on from the committed offsets and the state
+    after = run(trades, tmp_path, committed=committed)[OUTPUT_TOPIC]
+    assert by_product(before + after) == by_product(expected_candles(trades))
+
+
+def test_flat_candles_are_keyed_by_their_product(tmp_path):
+    trades = trades_out_of_order()
+    # `run` checks the key of every candle
+    candles = run(trades, tmp_path, ohlcv_gap_fill=True)[OUTPUT_TOPIC]
+    flat = by_product([candle for candle in candles if candle['volume'] == 0])
+    assert len(flat['XTZ/USD']) > len(flat.get('BTC/USD', []))
+
+
+def test_several_products_in_one_partition(tmp_path):
+    recorded = []
+
+    class RecordedLateTrades(LateTrades):
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            recorded.append(self)
+
+    # all the products in one partition: quixstreams 2.x closes the windows on
+    # the largest timestamp of the partition, ahead of the one of the slow products
+    trades = trades_out_of_order()
+    with mock.patch.object(src.main, 'LateTrades', RecordedLateTrades):
+        produced = run(
+            trades,
+            tmp_path,
+            partitions=1,
+            ohlcv_indicators=['trade_count'],
+            ohlcv_allowed_lateness_ms=ALLOWED_LATENESS_MS,
+            kafka_late_trades_topic=LATE_TRADES_TOPIC,
+        )
+
+    # the trades late on the watermark of the partition go to their topic
+    late_trades = LateTrades(
+        window_seconds=WINDOW_SECONDS,
+        allowed_lateness_ms=ALLOWED_LATENESS_MS,
+        has_late_trades_topic=True,
+    )
+    states: Dict[str, DictState] = {}
+    partition_watermark_ms = 0
+    expected_late = []
+    for trade in trades:
+        verdict, late_by_ms = late_trades.check(
+            trade, states.setdefault(trade['product_id'], DictState()), partition_watermark_ms
+        )
+        if verdict == ON_TIME:
+            partition_watermark_ms = max(partition_watermark_ms, trade['timestamp_ms'])
+        elif verdict == LATE:
+            expected_late.append({**trade, 'late_by_ms': late_by_ms})
+    counts = recorded[0].counts
+    assert counts == late_trades.counts
+    assert counts[BEHIND_PARTITION] > 0
+    assert produced[LATE_TRADES_TOPIC] == expected_late
+
+    # and every trade on time is in a candle, or in a window still open
+    open_windows = state_store(str(tmp_path), WINDOW_STORE).values()
+    in_windows = sum(candle['trade_count'] for candle in produced[OUTPUT_TOPIC]) + \
+        sum(loads(value)[TRADE_COUNT] for value in open_windows)
+    assert in_windows == counts[ON_TIME]
+    assert counts[ON_TIME] + counts[LATE] + counts[DROPPED] == len(trades)
+
+
+def upserted(candles: List[dict]) -> Dict[tuple, dict]:
+    """
+    The candles the sinks end up with, upserting by product and window.
+    """
+    by_key = {}
+    for candle in candles:
+        key = (candle['product_id'], candle['timestamp_ms'])
+        # a candle with trades replaces the flat one
+        if key not in by_key or candle['volume'] > 0:
+            by_key[key] = candle
+    return by_key
+
+
+@pytest.mark.parametrize('indicators', [None, ['ema_3', 'rsi_3', 'trade_count']])
+def test_gap_filler_carries_on_after_a_restart(tmp_path, indicators):
+    trades = trades_out_of_order()
+    kwargs = {'ohlcv_gap_fill': True, 'ohlcv_indicators': indicators}
+    expected = upserted(run(trades, tmp_path / 'once', **kwargs)[OUTPUT_TOPIC])
+
+    # the windows of a product between its last trade before the restart and its
+    # first trade after are filled, with the indicators it had before
+    committed = {}
+    before = run(trades[:len(trades) // 2], tmp_path / 'restart', committed=committed, **kwargs)
+    after = run(trades, tmp_path / 'restart', committed=committed, **kwargs)
+    assert upserted(before[OUTPUT_TOPIC] + after[OUTPUT_TOPIC]) == expected
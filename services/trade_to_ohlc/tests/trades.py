@@ -0,0 +1,137 @@
+"""
+The synthetic trades and the in-memory tumbling windows of the benchmarks and tests.
+
+`TumblingWindows` is the tumbling window of `transform_trade_to_ohlcv` without
+quixstreams and RocksDB: the reducers of `src.main`, with the windows of every
+product closed by its watermark, like `.final()`, and the candle of the window of
+every trade, like `.current()`. The benchmarks use it to measure the work per
+trade, and `tests/test_pipeline.py` checks it gives the candles of the real
+pipeline.
+"""
+import random
+from typing import Dict, List, Optional, Tuple
+
+from src.main import init_ohlcv_candle, update_ohlcv_candle
+from src.window_state import candle_from_state
+
+START_MS = 1_718_000_000_000
+
+
+def synthetic_products(n_products: int, mean_sec: float) -> Dict[str, float]:
+    """
+    `n_products` products, with `mean_sec` seconds between two trades of each.
+    """
+    return {f'SYN{i}/USD': mean_sec for i in range(n_products)}
+
+
+def make_trades(
+    products: Dict[str, float],
+    duration_sec: float,
+    late_fraction: float = 0.0,
+    max_delay_ms: int = 0,
+    seed: int = 0,
+) -> List[dict]:
+    """
+    Trades of every product for `duration_sec`, in the order they come in.
+
+    Args:
+        products (Dict[str, float]): The mean seconds between two trades of every
+            product. The gaps are exponential, and the prices a random walk.
+        duration_sec (float): How long the trades go on, in event time.
+        late_fraction (float): The fraction of the trades that come in late.
+        max_delay_ms (int): How late they come in, at most.
+        seed (int): The seed of the random numbers.
+
+    Returns:
+        List[dict]: The trades, with a `side`.
+    """
+    rng = random.Random(seed)
+    trades = []
+    for i, (product_id, mean_sec) in enumerate(products.items()):
+        ts = START_MS
+        price = 100.0 * (i + 1)
+        while True:
+            ts += int(rng.expovariate(1 / (mean_sec * 1000)))
+            if ts >= START_MS + duration_sec * 1000:
+                break
+            price *= 1 + rng.gauss(0, 1e-3)
+            delay_ms = rng.randrange(max_delay_ms) if rng.random() < late_fraction else 0
+            trades.append((ts + delay_ms, {
+                'product_id': product_id,
+                'price': round(price, 2),
+                'quantity': round(rng.random(), 8),
+                'timestamp_ms': ts,
+                'side': rng.choice(['buy', 'sell']),
+            }))
+    return [trade for _, trade in sorted(trades, key=lambda item: item[0])]
+
+
+class TumblingWindows:
+    """
+    The tumbling windows of the streaming path, in memory, see the module docstring.
+
+    A window of a product closes once the watermark of the product (its largest
+    trade timestamp) reaches its end plus `grace_ms`, and the trades of the windows
+    that closed are dropped.
+    """
+
+    def __init__(self, window_seconds: int, grace_ms: int = 0) -> None:
+        self.window_ms = window_seconds * 1000
+        self.grace_ms = grace_ms
+        self.watermarks: Dict[str, int] = {}
+        # per product: the state of every open window, by its end
+        self._open_windows: Dict[str, Dict[int, list]] = {}
+
+    def add(self, trade: dict) -> Tuple[Optional[dict], List[dict]]:
+        """
+        Adds a trade to its window.
+
+        Args:
+            trade (dict): The trade.
+
+        Returns:
+            Tuple[Optional[dict], List[dict]]: The candle of the window of the trade
+                after it, like `.current()` (None if the window closed and the trade
+                is dropped), and the candles of the windows it closed, like `.final()`.
+        """
+        product_id = trade['product_id']
+        end_ms = trade['timestamp_ms'] // self.window_ms * self.window_ms + self.window_ms
+        watermark_ms = self.watermarks.get(product_id, -1)
+        if end_ms + self.grace_ms <= watermark_ms:
+            return None, []
+
+        windows = self._open_windows.setdefault(product_id, {})
+        windows[end_ms] = (
+            update_ohlcv_candle(windows[end_ms], trade) if end_ms in windows
+            else init_ohlcv_candle(trade)
+        )
+        current = candle_from_state(windows[end_ms], product_id, end_ms)
+
+        watermark_ms = self.watermarks[product_id] = max(watermark_ms, trade['timestamp_ms'])
+        finals = [
+            candle_from_state(windows.pop(closed_ms), product_id, closed_ms)
+            for closed_ms in sorted(windows)
+            if closed_ms + self.grace_ms <= watermark_ms
+        ]
+        return current, finals
+
+    def flush(self) -> List[dict]:
+        """
+        Returns the candles of the windows that are still open, and closes them.
+        """
+        candles = [
+            candle_from_state(state, product_id, end_ms)
+            for product_id, windows in self._open_windows.items()
+            for end_ms, state in sorted(windows.items())
+        ]
+        self._open_windows.clear()
+        return candles
+
+    def run(self, trades: List[dict]) -> List[dict]:
+        """
+        Adds the trades, and returns the candles of the windows they closed.
+        """
+        candles = []
+        for trade in trades:
+            candles += self.add(trade)[1]
+        return candles